@@ -1,89 +1,156 @@
 import argparse
-from collections import defaultdict
+import heapq
+import itertools
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
 
 from sacrerouge.io import JsonlReader, JsonlWriter
 
+from syslevel.cache import is_cache_enabled, save_cached_matrices
+from syslevel.util import GROUND_TRUTH, build_matrices
+
+# For every dataset, maps each output metric to the (input metric, field,
+# scale) it is read from. A field of None means the input value is used as-is.
+FIELD_MAPPINGS = {
+    "summeval": {
+        "ROUGE-1": ("rouge-1", "f1", 1),
+        "ROUGE-2": ("rouge-2", "f1", 1),
+        "ROUGE-L": ("rouge-l", "f1", 1),
+        "BERTScore": ("bertscore", "recall", 100),
+        "QAEval": ("qa-eval", "f1", 100),
+        GROUND_TRUTH: ("ground-truth", None, 1),
+    },
+    "realsumm": {
+        "ROUGE-1": ("rouge-1", "recall", 1),
+        "ROUGE-2": ("rouge-2", "recall", 1),
+        "ROUGE-L": ("rouge-l", "recall", 1),
+        "BERTScore": ("bertscore", "recall", 100),
+        "QAEval": ("qa-eval", "f1", 100),
+        GROUND_TRUTH: ("ground-truth", None, 1),
+    },
+}
+
+# A record is (instance_id, summarizer_id, file index, run index, metrics), so
+# sorting the records orders equal keys by the file they were read from
+Record = Tuple[str, str, int, int, Dict]
+
+
+def select_metrics(metrics: Dict, mapping: Dict) -> Dict:
+    selected = {}
+    for name, (input_name, field, scale) in mapping.items():
+        if input_name in metrics:
+            value = metrics[input_name]
+            if field is not None:
+                value = value[field] * scale
+            selected[name] = value
+    return selected
+
+
+def _read_run(path: str) -> Iterator[Record]:
+    with open(path, "r") as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def extract_runs(
+    input_jsonl: str, file_index: int, dataset: str, max_keys: int, temp_dir: str
+) -> List[str]:
+    # Selects the metrics from one input file and writes them to sorted runs
+    # of at most `max_keys` keys in `temp_dir`, returning the runs' paths, so
+    # only `max_keys` keys are ever held in memory
+    mapping = FIELD_MAPPINGS[dataset]
+    runs = []
+    key_to_metrics = {}
+
+    def flush() -> None:
+        run = sorted(
+            (instance_id, summarizer_id, file_index, len(runs), metrics)
+            for (instance_id, summarizer_id), metrics in key_to_metrics.items()
+        )
+        fd, path = tempfile.mkstemp(dir=temp_dir, suffix=".jsonl")
+        with os.fdopen(fd, "w") as out:
+            for record in run:
+                out.write(json.dumps(record) + "\n")
+        runs.append(path)
+        key_to_metrics.clear()
+
+    with JsonlReader(input_jsonl) as f:
+        for instance in f:
+            metrics = select_metrics(instance["metrics"], mapping)
+            if len(metrics) == 0:
+                continue
+            key = (instance["instance_id"], instance["summarizer_id"])
+            key_to_metrics.setdefault(key, {}).update(metrics)
+            if len(key_to_metrics) >= max_keys:
+                flush()
+
+    if len(key_to_metrics) > 0:
+        flush()
+    return runs
+
+
+def merge_runs(runs: List[str]) -> Iterator[Dict]:
+    # Joins the records with the same key, reading every run one record at a
+    # time. Metrics from later input files replace those from earlier ones.
+    records = heapq.merge(*map(_read_run, runs), key=lambda record: record[:4])
+    for (instance_id, summarizer_id), group in itertools.groupby(
+        records, key=lambda record: record[:2]
+    ):
+        metrics = {}
+        for record in group:
+            metrics.update(record[4])
+        yield {
+            "instance_id": instance_id,
+            "summarizer_id": summarizer_id,
+            "summarizer_type": "peer",
+            "metrics": metrics,
+        }
+
 
 def main(args):
-    metrics_dict = defaultdict(dict)
-
-    for input_jsonl in args.input_jsonls:
-        with JsonlReader(input_jsonl) as f:
-            for instance in f:
-                instance_id = instance["instance_id"]
-                summarizer_id = instance["summarizer_id"]
-                key = (instance_id, summarizer_id)
-
-                if args.dataset == "summeval":
-                    if "rouge-1" in instance["metrics"]:
-                        metrics_dict[key]["ROUGE-1"] = instance["metrics"]["rouge-1"][
-                            "f1"
-                        ]
-                    if "rouge-2" in instance["metrics"]:
-                        metrics_dict[key]["ROUGE-2"] = instance["metrics"]["rouge-2"][
-                            "f1"
-                        ]
-                    if "rouge-l" in instance["metrics"]:
-                        metrics_dict[key]["ROUGE-L"] = instance["metrics"]["rouge-l"][
-                            "f1"
-                        ]
-                    if "bertscore" in instance["metrics"]:
-                        metrics_dict[key]["BERTScore"] = (
-                            instance["metrics"]["bertscore"]["recall"] * 100
-                        )
-                    if "qa-eval" in instance["metrics"]:
-                        metrics_dict[key]["QAEval"] = (
-                            instance["metrics"]["qa-eval"]["f1"] * 100
-                        )
-                    if "ground-truth" in instance["metrics"]:
-                        metrics_dict[key]["ground-truth"] = instance["metrics"][
-                            "ground-truth"
-                        ]
-
-                elif args.dataset == "realsumm":
-                    if "rouge-1" in instance["metrics"]:
-                        metrics_dict[key]["ROUGE-1"] = instance["metrics"]["rouge-1"][
-                            "recall"
-                        ]
-                    if "rouge-2" in instance["metrics"]:
-                        metrics_dict[key]["ROUGE-2"] = instance["metrics"]["rouge-2"][
-                            "recall"
-                        ]
-                    if "rouge-l" in instance["metrics"]:
-                        metrics_dict[key]["ROUGE-L"] = instance["metrics"]["rouge-l"][
-                            "recall"
-                        ]
-                    if "bertscore" in instance["metrics"]:
-                        metrics_dict[key]["BERTScore"] = (
-                            instance["metrics"]["bertscore"]["recall"] * 100
-                        )
-                    if "qa-eval" in instance["metrics"]:
-                        metrics_dict[key]["QAEval"] = (
-                            instance["metrics"]["qa-eval"]["f1"] * 100
-                        )
-                    if "ground-truth" in instance["metrics"]:
-                        metrics_dict[key]["ground-truth"] = instance["metrics"][
-                            "ground-truth"
-                        ]
-                else:
-                    raise Exception()
-
-    with JsonlWriter(args.output_jsonl) as out:
-        for (instance_id, summarizer_id), metrics in metrics_dict.items():
-            out.write(
-                {
-                    "instance_id": instance_id,
-                    "summarizer_id": summarizer_id,
-                    "summarizer_type": "peer",
-                    "metrics": metrics,
-                }
-            )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # The input files are decoded in parallel. At most `num_workers` files
+        # are decoded at once, so splitting `max_keys` between the workers
+        # bounds the number of keys in memory across all of them.
+        max_keys = max(1, args.max_keys // args.num_workers)
+        with ProcessPoolExecutor(args.num_workers) as executor:
+            futures = [
+                executor.submit(
+                    extract_runs, input_jsonl, i, args.dataset, max_keys, temp_dir
+                )
+                for i, input_jsonl in enumerate(args.input_jsonls)
+            ]
+            runs = [run for future in futures for run in future.result()]
+
+        # The matrices for the analysis code's cache are built while the
+        # merged instances are written
+        with JsonlWriter(args.output_jsonl) as out:
+
+            def write_instances() -> Iterator[Dict]:
+                for instance in merge_runs(runs):
+                    out.write(instance)
+                    yield instance
+
+            matrices = build_matrices(write_instances())
+
+    if is_cache_enabled():
+        save_cached_matrices(args.output_jsonl, matrices)
 
 
 if __name__ == "__main__":
     argp = argparse.ArgumentParser()
     argp.add_argument("--input-jsonls", required=True, nargs="+")
-    argp.add_argument("--dataset", required=True)
+    argp.add_argument("--dataset", required=True, choices=list(FIELD_MAPPINGS))
     argp.add_argument("--output-jsonl", required=True)
+    argp.add_argument("--num-workers", type=int, default=os.cpu_count())
+    argp.add_argument(
+        "--max-keys",
+        type=int,
+        default=1_000_000,
+        help="The most keys held in memory at once across all of the workers",
+    )
     args = argp.parse_args()
     main(args)
@@ -2,15 +2,105 @@ import argparse
 import gzip
 import json
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from repro.models.deutsch2021 import QAEval
 from repro.models.lin2004 import ROUGE
 from repro.models.zhang2020 import BERTScore
-from typing import List
+from typing import Dict, Iterator, List, Set, Tuple
+
+from score_cache import ScoreCache
+from work_queue import claim_next, mark_done
+
+# orjson parses the lines faster than the standard library if it is installed
+try:
+    import orjson
+
+    def loads(line: bytes):
+        # orjson rejects the NaN and Infinity tokens which `json.dumps` writes
+        # for undefined scores, so those lines are parsed by the json module
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            return json.loads(line)
+
+except ImportError:
+    from json import loads
+
+# ROUGE only needs the CPU, so it is run on a process pool at the same time as
+# the model-based metrics, which are run one after the other on the device
+CPU_METRICS = {"rouge": ROUGE}
+MODEL_METRICS = {"bertscore": BERTScore, "qaeval": QAEval}
+
+_cpu_metric = None
+
+
+def read_inputs(input_jsonl: str) -> Iterator[Dict]:
+    with gzip.open(input_jsonl, "r") as f:
+        for line in f:
+            instance = loads(line)
+
+            instance_id = instance["instance_id"]
+            summarizer_id = instance["summarizer_id"]
+            summarizer_type = instance["summarizer_type"]
+
+            candidate = instance["summary"]["text"]
+            if "reference" in instance:
+                reference = instance["reference"]["text"]
+            else:
+                reference = instance["references"][0]["text"]
+
+            yield {
+                "instance_id": instance_id,
+                "summarizer_id": summarizer_id,
+                "summarizer_type": summarizer_type,
+                "candidate": candidate,
+                "references": [reference],
+            }
+
+
+def get_scored_keys(output_file: str) -> Set[Tuple[str, str]]:
+    # Returns the (instance_id, summarizer_id) keys which were already scored
+    # by a previous run. If that run was interrupted while writing a line, the
+    # partial line is removed.
+    keys = set()
+    if not os.path.exists(output_file):
+        return keys
+
+    valid_length = 0
+    with open(output_file, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            result = loads(line)
+            keys.add((result["instance_id"], result["summarizer_id"]))
+            valid_length += len(line)
+
+    if valid_length < os.path.getsize(output_file):
+        with open(output_file, "rb+") as f:
+            f.truncate(valid_length)
+    return keys
+
+
+def read_chunks(
+    input_jsonl: str, scored_keys: Set[Tuple[str, str]], chunk_size: int
+) -> Iterator[List[Dict]]:
+    chunk = []
+    for inp in read_inputs(input_jsonl):
+        if (inp["instance_id"], inp["summarizer_id"]) in scored_keys:
+            continue
+        chunk.append(inp)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
 
 
 def save(inputs: List, micro: List, output_file: str) -> None:
+    # Appends the results so that every finished chunk is kept
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, "w") as out:
+    with open(output_file, "a") as out:
         for inp, metrics in zip(inputs, micro):
             out.write(
                 json.dumps(
@@ -24,49 +114,151 @@ def save(inputs: List, micro: List, output_file: str) -> None:
             )
 
 
-def main(args):
-    inputs = []
-    with gzip.open(args.input_jsonl, "r") as f:
-        for line in f:
-            instance = json.loads(line.decode())
+def _init_cpu_worker(name: str) -> None:
+    global _cpu_metric
+    _cpu_metric = CPU_METRICS[name]()
 
-            instance_id = instance["instance_id"]
-            summarizer_id = instance["summarizer_id"]
-            summarizer_type = instance["summarizer_type"]
 
-            candidate = instance["summary"]["text"]
-            if "reference" in instance:
-                reference = instance["reference"]["text"]
-            else:
-                reference = instance["references"][0]["text"]
+def _score_cpu_chunk(chunk: List[Dict]) -> List:
+    if len(chunk) == 0:
+        return []
+    _, micro = _cpu_metric.predict_batch(chunk)
+    return micro
 
-            inputs.append(
-                {
-                    "instance_id": instance_id,
-                    "summarizer_id": summarizer_id,
-                    "summarizer_type": summarizer_type,
-                    "candidate": candidate,
-                    "references": [reference],
-                }
+
+class Scorer:
+    # Scores input files for one worker. The models are only loaded once, each
+    # CPU metric has one process pool, and the keys which are already in the
+    # output files are read once and then kept up to date in memory, so that
+    # scoring the many chunks of a work queue costs the same as one file
+    def __init__(self, args) -> None:
+        self.args = args
+        self.models = {}
+        self.scored_keys = {
+            name: get_scored_keys(self.get_output_file(name)) for name in args.metrics
+        }
+        self.executors = {
+            name: ProcessPoolExecutor(
+                args.num_cpu_workers, initializer=_init_cpu_worker, initargs=(name,)
             )
+            for name in CPU_METRICS
+            if name in args.metrics
+        }
+
+    def __enter__(self) -> "Scorer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for executor in self.executors.values():
+            executor.shutdown()
 
-    metric = ROUGE()
-    _, micro = metric.predict_batch(inputs)
-    save(inputs, micro, f"{args.output_dir}/rouge.jsonl")
+    def get_output_file(self, name: str) -> str:
+        return f"{self.args.output_dir}/{name}.jsonl"
 
-    metric = BERTScore(device=args.device)
-    _, micro = metric.predict_batch(inputs)
-    save(inputs, micro, f"{args.output_dir}/bertscore.jsonl")
+    def get_model(self, name: str):
+        # Only load the model if there is something left to score
+        if name not in self.models:
+            self.models[name] = MODEL_METRICS[name](device=self.args.device)
+        return self.models[name]
+
+    def save(self, name: str, chunk: List[Dict], micro: List) -> None:
+        save(chunk, micro, self.get_output_file(name))
+        self.scored_keys[name].update(
+            (inp["instance_id"], inp["summarizer_id"]) for inp in chunk
+        )
+
+    def score_cpu_metric(self, name: str, input_jsonl: str) -> ScoreCache:
+        cache = ScoreCache(self.args.cache_file)
+        num_workers = self.args.num_cpu_workers
+
+        def finish(chunk, keys, results, missing, future) -> None:
+            cache.store(name, missing, future.result(), results)
+            self.save(name, chunk, [results[key] for key in keys])
+
+        # Only a few chunks are kept in flight at once, and they are saved in
+        # the order they were read
+        pending = deque()
+        chunks = read_chunks(input_jsonl, self.scored_keys[name], self.args.chunk_size)
+        for chunk in chunks:
+            keys, results, missing = cache.lookup(name, chunk)
+            future = self.executors[name].submit(_score_cpu_chunk, missing)
+            pending.append((chunk, keys, results, missing, future))
+            if len(pending) >= 2 * num_workers:
+                finish(*pending.popleft())
+        while len(pending) > 0:
+            finish(*pending.popleft())
+
+        cache.close()
+        return cache
+
+    def score_model_metric(self, name: str, input_jsonl: str) -> ScoreCache:
+        cache = ScoreCache(self.args.cache_file)
+        chunks = read_chunks(input_jsonl, self.scored_keys[name], self.args.chunk_size)
+        for chunk in chunks:
+            keys, results, missing = cache.lookup(name, chunk)
+            if len(missing) > 0:
+                _, micro = self.get_model(name).predict_batch(missing)
+                cache.store(name, missing, micro, results)
+            self.save(name, chunk, [results[key] for key in keys])
+
+        cache.close()
+        return cache
+
+    def score_file(self, input_jsonl: str) -> Dict[str, ScoreCache]:
+        caches = {}
+        with ThreadPoolExecutor(max(1, len(self.executors))) as threads:
+            futures = {
+                name: threads.submit(self.score_cpu_metric, name, input_jsonl)
+                for name in self.executors
+            }
+
+            for name in MODEL_METRICS:
+                if name in self.args.metrics:
+                    caches[name] = self.score_model_metric(name, input_jsonl)
+
+            for name, future in futures.items():
+                caches[name] = future.result()
+        return caches
+
+
+def main(args):
+    with Scorer(args) as scorer:
+        if args.input_jsonl is not None:
+            caches_list = [scorer.score_file(args.input_jsonl)]
+        else:
+            # Keep pulling chunks from the shared queue until it is empty
+            caches_list = []
+            worker_id = str(args.device)
+            while True:
+                chunk_file = claim_next(args.queue_dir, worker_id)
+                if chunk_file is None:
+                    break
+                caches_list.append(scorer.score_file(chunk_file))
+                mark_done(args.queue_dir, chunk_file)
 
-    metric = QAEval(device=args.device)
-    _, micro = metric.predict_batch(inputs)
-    save(inputs, micro, f"{args.output_dir}/qaeval.jsonl")
+    if args.cache_file is not None:
+        for name in CPU_METRICS.keys() | MODEL_METRICS.keys():
+            if name in args.metrics:
+                hits = sum(caches[name].hits for caches in caches_list)
+                misses = sum(caches[name].misses for caches in caches_list)
+                print(f"{name}: {hits} cache hits, {misses} misses")
 
 
 if __name__ == "__main__":
     argp = argparse.ArgumentParser()
-    argp.add_argument("--input-jsonl", required=True)
+    inputs = argp.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("--input-jsonl")
+    inputs.add_argument("--queue-dir")
     argp.add_argument("--device", required=True, type=int)
     argp.add_argument("--output-dir", required=True)
+    argp.add_argument(
+        "--metrics",
+        nargs="+",
+        default=list(CPU_METRICS) + list(MODEL_METRICS),
+        choices=list(CPU_METRICS) + list(MODEL_METRICS),
+    )
+    argp.add_argument("--chunk-size", type=int, default=1000)
+    argp.add_argument("--num-cpu-workers", type=int, default=1)
+    argp.add_argument("--cache-file")
     args = argp.parse_args()
     main(args)
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+# Changing a metric's configuration here invalidates its cached scores
+METRIC_CONFIGS = {
+    "rouge": {"version": 1},
+    "bertscore": {"version": 1},
+    "qaeval": {"version": 1},
+}
+
+
+class ScoreCache:
+    # A persistent cache of metric scores keyed on a hash of the metric's name
+    # and configuration and the candidate and reference texts, so identical
+    # summaries are only scored once across the judged and all splits and
+    # across runs. It is backed by SQLite so that concurrent scoring processes
+    # can share one file.
+    def __init__(self, path: Optional[str]) -> None:
+        self.connection = None
+        self.hits = 0
+        self.misses = 0
+        if path is None:
+            return
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=600)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, metrics TEXT)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def get_key(name: str, inp: Dict) -> str:
+        data = [name, METRIC_CONFIGS[name], inp["candidate"], inp["references"]]
+        return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+    def lookup(self, name: str, inputs: List[Dict]) -> Tuple[List[str], Dict, List]:
+        # Returns the key for every input, the cached results by key, and the
+        # inputs which still need to be scored (one per unique key)
+        keys = [self.get_key(name, inp) for inp in inputs]
+        results = {}
+        if self.connection is not None:
+            unique_keys = list(set(keys))
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i : i + 500]
+                rows = self.connection.execute(
+                    "SELECT key, metrics FROM scores WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                )
+                for key, metrics in rows:
+                    results[key] = json.loads(metrics)
+
+        missing = {}
+        for key, inp in zip(keys, inputs):
+            if key not in results and key not in missing:
+                missing[key] = inp
+        num_hits = sum(key in results for key in keys)
+        self.hits += num_hits
+        self.misses += len(keys) - num_hits
+        return keys, results, list(missing.values())
+
+    def store(self, name: str, inputs: List[Dict], micro: List, results: Dict) -> None:
+        # Adds the newly scored `inputs` to both the cache and `results`
+        items = []
+        for inp, metrics in zip(inputs, micro):
+            key = self.get_key(name, inp)
+            results[key] = metrics
+            items.append((key, json.dumps(metrics)))
+
+        if self.connection is not None:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO scores (key, metrics) VALUES (?, ?)", items
+            )
+            self.connection.commit()
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
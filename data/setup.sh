@@ -26,29 +26,31 @@ NUM_DEVICES=8
 
 for dataset in summeval realsumm; do
   for split in judged all; do
+    # Every device pulls chunks from a shared queue until all are scored
     python data/split_into_batches.py \
       --input-jsonl data/${dataset}/${split}/summaries.jsonl.gz \
-      --num-batches ${NUM_DEVICES} \
-      --output-dir data/${dataset}/${split}/temp/summaries
+      --mode queue \
+      --output-dir data/${dataset}/${split}/temp/queue
 
     for ((device=0;device<${NUM_DEVICES};device++)); do
       python data/score.py \
-        --input-jsonl data/${dataset}/${split}/temp/summaries/${device}.jsonl.gz \
+        --queue-dir data/${dataset}/${split}/temp/queue \
         --device ${device} \
         --output-dir data/${dataset}/${split}/temp/metrics/${device} \
+        --cache-file data/temp/score-cache.sqlite \
       &
     done
     wait
   done
 
-  python data/merge.py \
+  python -m data.merge \
     --input-jsonls \
         data/${dataset}/judged/ground-truth.jsonl \
         data/${dataset}/judged/temp/metrics/*/*.jsonl \
     --dataset ${dataset} \
     --output-jsonl data/${dataset}/judged/metrics.jsonl.gz
 
-  python data/merge.py \
+  python -m data.merge \
     --input-jsonls \
         data/${dataset}/judged/ground-truth.jsonl \
         data/${dataset}/all/rouge.jsonl \
@@ -1,33 +1,156 @@
 import argparse
 import contextlib
+import heapq
+import json
 import math
+import os
 
 from sacrerouge.io import JsonlReader, JsonlWriter
+from typing import Dict, List, Union
 
+from work_queue import (
+    QUEUE_ENTRIES,
+    get_chunk_names,
+    get_config_file,
+    get_pending_dir,
+)
 
-def main(args):
-    # Read all of the instances in so we can maintain the order across the files
-    instances = JsonlReader(args.input_jsonl).read()
 
-    num_instances = len(instances)
-    num_instances_per_chunk = int(math.ceil(num_instances / args.num_batches))
+def _count_tokens(text: Union[str, List[str]]) -> int:
+    if isinstance(text, list):
+        return sum(len(sentence.split()) for sentence in text)
+    return len(text.split())
+
+
+def get_cost(instance) -> int:
+    # The time to score a summary grows with the lengths of the summary and
+    # reference, plus a fixed overhead per instance
+    if "reference" in instance:
+        reference = instance["reference"]
+    else:
+        reference = instance["references"][0]
+    return (
+        1
+        + _count_tokens(instance["summary"]["text"])
+        + _count_tokens(reference["text"])
+    )
+
+
+def assign_by_count(num_instances: int, num_batches: int) -> List[int]:
+    num_instances_per_chunk = int(math.ceil(num_instances / num_batches))
+    return [i // num_instances_per_chunk for i in range(num_instances)]
+
+
+def assign_by_cost(costs: List[int], num_batches: int) -> List[int]:
+    # Longest-processing-time: the most expensive remaining instance is always
+    # assigned to the batch with the lowest total cost
+    heap = [(0, batch) for batch in range(num_batches)]
+    assignments = [0] * len(costs)
+    for index in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        total, batch = heapq.heappop(heap)
+        assignments[index] = batch
+        heapq.heappush(heap, (total + costs[index], batch))
+    return assignments
+
+
+def write_batches(input_jsonl: str, mode: str, num_batches: int, output_dir: str):
+    # The input is streamed twice: once to compute the assignments and once
+    # to write the instances, which keeps their order within every batch
+    with JsonlReader(input_jsonl) as f:
+        costs = [get_cost(instance) for instance in f]
+
+    if mode == "count":
+        assignments = assign_by_count(len(costs), num_batches)
+    else:
+        assignments = assign_by_cost(costs, num_batches)
 
     with contextlib.ExitStack() as stack:
         writers = [
-            stack.enter_context(JsonlWriter(f"{args.output_dir}/{i}.jsonl.gz"))
-            for i in range(args.num_batches)
+            stack.enter_context(JsonlWriter(f"{output_dir}/{i}.jsonl.gz"))
+            for i in range(num_batches)
         ]
-        for i, writer in zip(
-            range(0, len(instances), num_instances_per_chunk), writers
-        ):
-            for instance in instances[i : i + num_instances_per_chunk]:
-                writer.write(instance)
+        with JsonlReader(input_jsonl) as f:
+            for instance, batch in zip(f, assignments):
+                writers[batch].write(instance)
+
+
+def get_queue_config(input_jsonl: str, chunk_size: int) -> Dict:
+    return {"input_jsonl": os.path.abspath(input_jsonl), "chunk_size": chunk_size}
+
+
+def can_write_queue(input_jsonl: str, chunk_size: int, output_dir: str) -> bool:
+    # A queue is written to a new or empty directory, or resumed in the queue
+    # which was split from the same input with the same chunk size
+    if not os.path.exists(output_dir) or len(os.listdir(output_dir)) == 0:
+        return True
+    if not set(os.listdir(output_dir)) <= QUEUE_ENTRIES:
+        return False
+    config_file = get_config_file(output_dir)
+    if not os.path.exists(config_file):
+        return False
+    with open(config_file, "r") as f:
+        return json.load(f) == get_queue_config(input_jsonl, chunk_size)
+
+
+def write_queue(input_jsonl: str, chunk_size: int, output_dir: str):
+    pending_dir = get_pending_dir(output_dir)
+    temp_dir = f"{output_dir}/temp"
+    os.makedirs(pending_dir, exist_ok=True)
+    os.makedirs(temp_dir, exist_ok=True)
+    with open(get_config_file(output_dir), "w") as out:
+        json.dump(get_queue_config(input_jsonl, chunk_size), out)
+
+    # The chunks are always split the same way, so the chunks of an earlier
+    # run which are already pending, claimed or done are not written again
+    existing_names = get_chunk_names(output_dir)
+
+    def enqueue(chunk: List, index: int) -> None:
+        name = f"{index:06d}.jsonl.gz"
+        if name in existing_names:
+            return
+        # Chunks are written elsewhere first so workers never see partial files
+        with JsonlWriter(f"{temp_dir}/{name}") as out:
+            for instance in chunk:
+                out.write(instance)
+        os.rename(f"{temp_dir}/{name}", f"{pending_dir}/{name}")
+
+    num_chunks = 0
+    chunk = []
+    with JsonlReader(input_jsonl) as f:
+        for instance in f:
+            chunk.append(instance)
+            if len(chunk) == chunk_size:
+                enqueue(chunk, num_chunks)
+                num_chunks += 1
+                chunk = []
+    if len(chunk) > 0:
+        enqueue(chunk, num_chunks)
+    os.rmdir(temp_dir)
+
+
+def main(args):
+    if args.mode == "queue":
+        write_queue(args.input_jsonl, args.chunk_size, args.output_dir)
+    else:
+        write_batches(args.input_jsonl, args.mode, args.num_batches, args.output_dir)
 
 
 if __name__ == "__main__":
     argp = argparse.ArgumentParser()
     argp.add_argument("--input-jsonl", required=True)
-    argp.add_argument("--num-batches", required=True, type=int)
+    argp.add_argument("--num-batches", type=int)
     argp.add_argument("--output-dir", required=True)
+    argp.add_argument("--mode", choices=["count", "cost", "queue"], default="cost")
+    argp.add_argument("--chunk-size", type=int, default=500)
     args = argp.parse_args()
+    if args.mode != "queue" and args.num_batches is None:
+        argp.error("--num-batches is required unless --mode is queue")
+    if args.mode == "queue" and not can_write_queue(
+        args.input_jsonl, args.chunk_size, args.output_dir
+    ):
+        argp.error(
+            f"{args.output_dir} is not empty or a queue of {args.input_jsonl} with "
+            f"a chunk size of {args.chunk_size}. Remove it to split the input "
+            f"into a new queue."
+        )
     main(args)
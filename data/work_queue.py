@@ -0,0 +1,58 @@
+import os
+from typing import Optional, Set
+
+# A work queue of chunk files in a local directory. Chunks are added to
+# `pending/` and a worker claims one by atomically renaming it into its own
+# `claimed/<worker_id>/` directory, so no chunk is scored twice and fast
+# workers keep pulling chunks until the queue is empty. `queue.json` records
+# the input and chunk size the queue was split from, so that splitting the
+# same input again resumes the queue, and a directory holding anything else is
+# never reused as a queue.
+QUEUE_ENTRIES = {"pending", "claimed", "done", "temp", "queue.json"}
+
+
+def get_pending_dir(queue_dir: str) -> str:
+    return f"{queue_dir}/pending"
+
+
+def get_config_file(queue_dir: str) -> str:
+    return f"{queue_dir}/queue.json"
+
+
+def get_chunk_names(queue_dir: str) -> Set[str]:
+    # Returns the names of the chunks which are pending, claimed or done
+    names = set()
+    for dirname in [get_pending_dir(queue_dir), f"{queue_dir}/done"]:
+        if os.path.exists(dirname):
+            names.update(os.listdir(dirname))
+    claimed_dir = f"{queue_dir}/claimed"
+    if os.path.exists(claimed_dir):
+        for worker_id in os.listdir(claimed_dir):
+            names.update(os.listdir(f"{claimed_dir}/{worker_id}"))
+    return names
+
+
+def claim_next(queue_dir: str, worker_id: str) -> Optional[str]:
+    claimed_dir = f"{queue_dir}/claimed/{worker_id}"
+    os.makedirs(claimed_dir, exist_ok=True)
+
+    # Finish any chunk this worker claimed before it was interrupted first
+    claimed = sorted(os.listdir(claimed_dir))
+    if len(claimed) > 0:
+        return f"{claimed_dir}/{claimed[0]}"
+
+    pending_dir = get_pending_dir(queue_dir)
+    for name in sorted(os.listdir(pending_dir)):
+        try:
+            os.rename(f"{pending_dir}/{name}", f"{claimed_dir}/{name}")
+            return f"{claimed_dir}/{name}"
+        except FileNotFoundError:
+            # Another worker claimed it first
+            continue
+    return None
+
+
+def mark_done(queue_dir: str, path: str) -> None:
+    done_dir = f"{queue_dir}/done"
+    os.makedirs(done_dir, exist_ok=True)
+    os.rename(path, f"{done_dir}/{os.path.basename(path)}")
@@ -0,0 +1,218 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from typing import Callable, Dict, List
+
+from syslevel.benchmarks.synthetic import generate_matrices, write_metrics_file
+from syslevel.confidence_intervals.bootstrap import bootstrap_system_correlations
+from syslevel.delta_correlations.pairs import PairTable, calculate_tau, get_all_pairs
+from syslevel.ranking_stability.run import sample_self_correlation
+from syslevel.util import GROUND_TRUTH, METRICS, bootstrap_system_scores, load_matrices
+
+# Every benchmark takes the generated matrices (the metrics followed by the
+# ground-truth), the path to the same data as a metrics file, and the
+# arguments, and returns the function to time.
+
+
+def _benchmark_load_matrices(Xs: List[np.ndarray], input_file: str, args) -> Callable:
+    metrics = args.metrics + [GROUND_TRUTH]
+    return lambda: load_matrices(input_file, False, metrics, use_cache=False)
+
+
+def _benchmark_bootstrap_system_scores(
+    Xs: List[np.ndarray], input_file: str, args
+) -> Callable:
+    rng = np.random.default_rng(args.seed)
+    return lambda: bootstrap_system_scores(Xs[0], args.num_iterations, rng)
+
+
+def _benchmark_sample_self_correlation(
+    Xs: List[np.ndarray], input_file: str, args
+) -> Callable:
+    rng = np.random.default_rng(args.seed)
+    M = Xs[0].shape[1]
+    num_inputs_list = sorted({max(1, M // 10), max(1, M // 2), M})
+    return lambda: sample_self_correlation(
+        Xs[0], num_inputs_list, args.num_iterations, rng
+    )
+
+
+def _benchmark_delta_tau(Xs: List[np.ndarray], input_file: str, args) -> Callable:
+    with np.errstate(invalid="ignore"):
+        x = np.nanmean(Xs[0], axis=1)
+        z = np.nanmean(Xs[-1], axis=1)
+    return lambda: calculate_tau(get_all_pairs(x, z))
+
+
+def _benchmark_pair_table(Xs: List[np.ndarray], input_file: str, args) -> Callable:
+    with np.errstate(invalid="ignore"):
+        x = np.nanmean(Xs[0], axis=1)
+        z = np.nanmean(Xs[-1], axis=1)
+
+    def run():
+        pairs = PairTable(x, z)
+        min_deltas, max_deltas = pairs.get_percentile_deltas()
+        return pairs.heatmap(min_deltas, max_deltas)
+
+    return run
+
+
+def _benchmark_ci_bootstrap(Xs: List[np.ndarray], input_file: str, args) -> Callable:
+    rng = np.random.default_rng(args.seed)
+    return lambda: bootstrap_system_correlations(
+        Xs[:-1], Xs[-1], "both", True, args.num_iterations, rng
+    )
+
+
+BENCHMARKS = {
+    "load_matrices": _benchmark_load_matrices,
+    "bootstrap_system_scores": _benchmark_bootstrap_system_scores,
+    "sample_self_correlation": _benchmark_sample_self_correlation,
+    "delta_tau": _benchmark_delta_tau,
+    "pair_table": _benchmark_pair_table,
+    "ci_bootstrap": _benchmark_ci_bootstrap,
+}
+
+
+def measure(function: Callable, repeats: int) -> Dict[str, float]:
+    # The time is the fastest of `repeats` runs. The peak memory is measured
+    # in a separate run because tracing the allocations slows them down.
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"time": min(times), "peak_memory": peak_memory}
+
+
+def get_key(result: Dict) -> tuple:
+    return (
+        result["benchmark"],
+        result["num_systems"],
+        result["num_inputs"],
+        result["sparsity"],
+        result["num_annotators"],
+    )
+
+
+def compare(
+    results: List[Dict],
+    baseline: List[Dict],
+    time_tolerance: float,
+    memory_tolerance: float,
+) -> List[Dict]:
+    # Returns the results which are slower or use more memory than the
+    # baseline result with the same key by more than the tolerances
+    key_to_baseline = {get_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        key = get_key(result)
+        if key not in key_to_baseline:
+            continue
+        base = key_to_baseline[key]
+        time_ratio = result["time"] / max(base["time"], 1e-9)
+        memory_ratio = result["peak_memory"] / max(base["peak_memory"], 1)
+        if time_ratio > 1 + time_tolerance or memory_ratio > 1 + memory_tolerance:
+            regressions.append(
+                dict(result, time_ratio=time_ratio, memory_ratio=memory_ratio)
+            )
+    return regressions
+
+
+def main(args):
+    # The seeded analysis functions would otherwise return their cached
+    # results from the previous run instead of being timed
+    os.environ["SYSLEVEL_DISABLE_CACHE"] = "1"
+
+    results = []
+    sizes = itertools.product(
+        args.num_systems, args.num_inputs, args.sparsity, args.num_annotators
+    )
+    print(
+        f"{'Benchmark':<24} {'Systems':>7} {'Inputs':>7} {'Sparsity':>8} "
+        f"{'Annot.':>6} {'Time (s)':>9} {'Peak (MB)':>10}"
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for num_systems, num_inputs, sparsity, num_annotators in sizes:
+            # The matrices and the metrics file have the same scores
+            params = (num_systems, num_inputs, args.metrics, sparsity, num_annotators)
+            Xs = generate_matrices(*params, np.random.default_rng(args.seed))
+            input_file = f"{temp_dir}/metrics.jsonl.gz"
+            if "load_matrices" in args.benchmarks:
+                write_metrics_file(
+                    input_file, *params, np.random.default_rng(args.seed)
+                )
+
+            for name in args.benchmarks:
+                function = BENCHMARKS[name](Xs, input_file, args)
+                result = {
+                    "benchmark": name,
+                    "num_systems": num_systems,
+                    "num_inputs": num_inputs,
+                    "sparsity": sparsity,
+                    "num_annotators": num_annotators,
+                }
+                result.update(measure(function, args.repeats))
+                results.append(result)
+                print(
+                    f"{name:<24} {num_systems:>7} {num_inputs:>7} {sparsity:>8.2f} "
+                    f"{num_annotators:>6} {result['time']:>9.3f} "
+                    f"{result['peak_memory'] / 1e6:>10.1f}"
+                )
+
+    if args.output_json is not None:
+        dirname = os.path.dirname(args.output_json)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(args.output_json, "w") as out:
+            json.dump({"args": vars(args), "results": results}, out, indent=2)
+
+    if args.baseline_json is not None:
+        with open(args.baseline_json, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(
+            results, baseline, args.time_tolerance, args.memory_tolerance
+        )
+        for result in regressions:
+            print(
+                f"Regression: {result['benchmark']} with {result['num_systems']} "
+                f"systems, {result['num_inputs']} inputs, sparsity "
+                f"{result['sparsity']}, {result['num_annotators']} annotators: "
+                f"{result['time_ratio']:.2f}x time, "
+                f"{result['memory_ratio']:.2f}x peak memory"
+            )
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser()
+    argp.add_argument(
+        "--benchmarks", nargs="+", default=list(BENCHMARKS), choices=list(BENCHMARKS)
+    )
+    argp.add_argument("--num-systems", type=int, nargs="+", default=[16, 64])
+    argp.add_argument("--num-inputs", type=int, nargs="+", default=[100, 1000])
+    argp.add_argument("--sparsity", type=float, nargs="+", default=[0.0])
+    argp.add_argument("--num-annotators", type=int, nargs="+", default=[1])
+    argp.add_argument("--metrics", nargs="+", default=METRICS)
+    argp.add_argument("--num-iterations", type=int, default=1000)
+    argp.add_argument("--repeats", type=int, default=3)
+    argp.add_argument("--seed", type=int, default=0)
+    argp.add_argument("--output-json")
+    argp.add_argument("--baseline-json")
+    argp.add_argument("--time-tolerance", type=float, default=0.2)
+    argp.add_argument("--memory-tolerance", type=float, default=0.1)
+    args = argp.parse_args()
+    main(args)
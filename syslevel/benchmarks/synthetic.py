@@ -0,0 +1,100 @@
+import gzip
+import json
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from syslevel.util import GROUND_TRUTH, METRICS
+
+
+def generate_scores(
+    num_systems: int,
+    num_inputs: int,
+    metrics: List[str] = METRICS,
+    sparsity: float = 0.0,
+    num_annotators: int = 1,
+    rng: Optional[np.random.Generator] = None,
+) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    # Generates scores which look like a summarization dataset's: every system
+    # has a quality, every input a difficulty, and the metrics are noisy
+    # versions of the ground-truth. Returns the (systems, inputs) matrix for
+    # every metric and the (systems, inputs, annotators) ground-truth scores.
+    # A `sparsity` fraction of the cells is nan in every matrix.
+    if rng is None:
+        rng = np.random.default_rng()
+
+    quality = rng.normal(0.0, 1.0, size=(num_systems, 1))
+    difficulty = rng.normal(0.0, 1.0, size=(1, num_inputs))
+    truth = quality + difficulty + rng.normal(0.0, 1.0, size=(num_systems, num_inputs))
+    is_missing = rng.random((num_systems, num_inputs)) < sparsity
+
+    annotations = 3.0 + truth[:, :, None]
+    annotations = annotations + rng.normal(
+        0.0, 0.5, size=(num_systems, num_inputs, num_annotators)
+    )
+    annotations[is_missing] = np.nan
+
+    metric_to_matrix = {}
+    for metric in metrics:
+        noise = rng.normal(0.0, rng.uniform(0.5, 2.0), size=(num_systems, num_inputs))
+        matrix = 0.3 + 0.05 * (truth + noise)
+        matrix[is_missing] = np.nan
+        metric_to_matrix[metric] = matrix
+    return metric_to_matrix, annotations
+
+
+def generate_matrices(
+    num_systems: int,
+    num_inputs: int,
+    metrics: List[str] = METRICS,
+    sparsity: float = 0.0,
+    num_annotators: int = 1,
+    rng: Optional[np.random.Generator] = None,
+) -> List[np.ndarray]:
+    # Returns the matrices in the same order as `load_matrices` would for
+    # `metrics + [GROUND_TRUTH]`
+    metric_to_matrix, annotations = generate_scores(
+        num_systems, num_inputs, metrics, sparsity, num_annotators, rng
+    )
+    with np.errstate(invalid="ignore"):
+        Z = annotations.mean(axis=2)
+    return [metric_to_matrix[metric] for metric in metrics] + [Z]
+
+
+def generate_instances(
+    num_systems: int,
+    num_inputs: int,
+    metrics: List[str] = METRICS,
+    sparsity: float = 0.0,
+    num_annotators: int = 1,
+    rng: Optional[np.random.Generator] = None,
+) -> Iterator[Dict]:
+    # Yields the instances of a `metrics.jsonl.gz` file. The IDs are padded so
+    # that they sort in the same order as the matrices. The missing cells are
+    # left out, and the ground-truth is the list of annotator scores if there
+    # is more than one annotator.
+    metric_to_matrix, annotations = generate_scores(
+        num_systems, num_inputs, metrics, sparsity, num_annotators, rng
+    )
+    for i in range(num_systems):
+        for j in range(num_inputs):
+            if np.isnan(annotations[i, j, 0]):
+                continue
+            scores = {metric: metric_to_matrix[metric][i, j] for metric in metrics}
+            if num_annotators == 1:
+                scores[GROUND_TRUTH] = annotations[i, j, 0]
+            else:
+                scores[GROUND_TRUTH] = annotations[i, j].tolist()
+            yield {
+                "instance_id": f"input-{j:08d}",
+                "summarizer_id": f"system-{i:08d}",
+                "summarizer_type": "peer",
+                "metrics": scores,
+            }
+
+
+def write_metrics_file(output_file: str, *args, **kwargs) -> None:
+    # Writes the output of `generate_instances` in the same format as
+    # `data/merge.py`
+    with gzip.open(output_file, "wt") as out:
+        for instance in generate_instances(*args, **kwargs):
+            out.write(json.dumps(instance) + "\n")
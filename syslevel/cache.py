@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from typing import Callable, Dict, List, Tuple
+
+from syslevel.profiling import profiled
+from syslevel.sparse import SparseScores
+
+CACHE_VERSION = 2
+
+Matrices = Tuple[Dict[str, np.ndarray], List[str], List[str]]
+
+# (metrics, systems, inputs) scores, metrics, summarizer IDs, instance IDs
+Scores = Tuple[np.ndarray, List[str], List[str], List[str]]
+
+SparseMatrices = Tuple[Dict[str, SparseScores], List[str], List[str]]
+
+
+def get_cache_dir() -> str:
+    default = os.path.join(os.path.expanduser("~"), ".cache", "syslevel")
+    return os.environ.get("SYSLEVEL_CACHE_DIR", default)
+
+
+def is_cache_enabled() -> bool:
+    return os.environ.get("SYSLEVEL_DISABLE_CACHE", "").lower() not in {"1", "true"}
+
+
+def hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _write_json_atomic(path: str, data: Dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w") as out:
+        json.dump(data, out)
+    os.replace(temp_path, path)
+
+
+def get_content_hash(input_file: str, cache_dir: str) -> str:
+    # The content hash is only recomputed when the file's path, size, or
+    # modification time no longer match what was recorded for it
+    stat = os.stat(input_file)
+    stamp = {
+        "version": CACHE_VERSION,
+        "path": os.path.abspath(input_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+    path_hash = hashlib.sha256(stamp["path"].encode()).hexdigest()
+    source_file = os.path.join(cache_dir, "sources", f"{path_hash}.json")
+
+    if os.path.exists(source_file):
+        with open(source_file, "r") as f:
+            record = json.load(f)
+        if all(record.get(key) == value for key, value in stamp.items()):
+            return record["content_hash"]
+
+    stamp["content_hash"] = hash_file(input_file)
+    _write_json_atomic(source_file, stamp)
+    return stamp["content_hash"]
+
+
+def _write_entry(
+    entry_dir: str,
+    metrics: List[str],
+    summarizer_ids: List[str],
+    instance_ids: List[str],
+    write_scores: Callable[[str], None],
+) -> None:
+    parent_dir = os.path.dirname(entry_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+
+    # Write to a temporary directory first so that concurrent processes never
+    # see a partially written entry
+    temp_dir = tempfile.mkdtemp(dir=parent_dir)
+    np.save(f"{temp_dir}/summarizer_ids.npy", np.array(summarizer_ids, dtype=str))
+    np.save(f"{temp_dir}/instance_ids.npy", np.array(instance_ids, dtype=str))
+    write_scores(temp_dir)
+    _write_json_atomic(
+        f"{temp_dir}/metadata.json", {"version": CACHE_VERSION, "metrics": metrics}
+    )
+
+    try:
+        os.rename(temp_dir, entry_dir)
+    except OSError:
+        # Another process already created the same entry
+        shutil.rmtree(temp_dir)
+
+
+def _write_dense_entry(
+    entry_dir: str,
+    metric_to_matrix: Dict[str, np.ndarray],
+    summarizer_ids: List[str],
+    instance_ids: List[str],
+) -> None:
+    # The matrices are written as one contiguous (metrics, systems, inputs)
+    # array so that it can be memory-mapped as a whole
+    metrics = sorted(metric_to_matrix.keys())
+
+    def write_scores(temp_dir: str) -> None:
+        scores = np.lib.format.open_memmap(
+            f"{temp_dir}/scores.npy",
+            mode="w+",
+            dtype=np.float64,
+            shape=(len(metrics), len(summarizer_ids), len(instance_ids)),
+        )
+        for i, metric in enumerate(metrics):
+            scores[i] = metric_to_matrix[metric]
+        scores.flush()
+
+    _write_entry(entry_dir, metrics, summarizer_ids, instance_ids, write_scores)
+
+
+def _write_sparse_entry(
+    entry_dir: str,
+    metric_to_matrix: Dict[str, SparseScores],
+    summarizer_ids: List[str],
+    instance_ids: List[str],
+) -> None:
+    metrics = sorted(metric_to_matrix.keys())
+
+    def write_scores(temp_dir: str) -> None:
+        for i, metric in enumerate(metrics):
+            X = metric_to_matrix[metric]
+            np.save(f"{temp_dir}/indptr-{i}.npy", X.indptr)
+            np.save(f"{temp_dir}/indices-{i}.npy", X.indices)
+            np.save(f"{temp_dir}/data-{i}.npy", X.data)
+
+    _write_entry(entry_dir, metrics, summarizer_ids, instance_ids, write_scores)
+
+
+def _read_ids(entry_dir: str) -> Tuple[List[str], List[str], List[str]]:
+    with open(f"{entry_dir}/metadata.json", "r") as f:
+        metadata = json.load(f)
+    summarizer_ids = np.load(f"{entry_dir}/summarizer_ids.npy").tolist()
+    instance_ids = np.load(f"{entry_dir}/instance_ids.npy").tolist()
+    return metadata["metrics"], summarizer_ids, instance_ids
+
+
+def _read_dense_entry(entry_dir: str) -> Scores:
+    metrics, summarizer_ids, instance_ids = _read_ids(entry_dir)
+    scores = np.load(f"{entry_dir}/scores.npy", mmap_mode="r")
+    return scores, metrics, summarizer_ids, instance_ids
+
+
+def _read_sparse_entry(entry_dir: str) -> SparseMatrices:
+    metrics, summarizer_ids, instance_ids = _read_ids(entry_dir)
+    shape = (len(summarizer_ids), len(instance_ids))
+    metric_to_matrix = {}
+    for i, metric in enumerate(metrics):
+        arrays = [
+            np.load(f"{entry_dir}/{name}-{i}.npy", mmap_mode="r")
+            for name in ["indptr", "indices", "data"]
+        ]
+        metric_to_matrix[metric] = SparseScores(shape, *arrays)
+    return metric_to_matrix, summarizer_ids, instance_ids
+
+
+def _get_entry_dir(input_file: str, kind: str = "matrices") -> str:
+    cache_dir = get_cache_dir()
+    content_hash = get_content_hash(input_file, cache_dir)
+    return os.path.join(cache_dir, f"{kind}-v{CACHE_VERSION}", content_hash)
+
+
+def save_cached_matrices(input_file: str, matrices: Matrices) -> None:
+    # Caches already built (metric -> matrix, summarizer IDs, instance IDs)
+    # for the `input_file`
+    entry_dir = _get_entry_dir(input_file)
+    if not os.path.exists(f"{entry_dir}/metadata.json"):
+        _write_dense_entry(entry_dir, *matrices)
+
+
+@profiled("load_cached_scores")
+def load_cached_scores(input_file: str, build: Callable[[], Matrices]) -> Scores:
+    # Returns the (scores, metrics, summarizer IDs, instance IDs) for the
+    # `input_file`, calling `build` to create the matrices if they are not
+    # cached yet. The scores are one read-only memory-mapped array with every
+    # metric in the file in sorted order.
+    entry_dir = _get_entry_dir(input_file)
+    if not os.path.exists(f"{entry_dir}/metadata.json"):
+        _write_dense_entry(entry_dir, *build())
+    return _read_dense_entry(entry_dir)
+
+
+@profiled("load_cached_sparse_scores")
+def load_cached_sparse_scores(
+    input_file: str, build: Callable[[], SparseMatrices]
+) -> SparseMatrices:
+    # Like `load_cached_scores`, but for every metric's `SparseScores`, whose
+    # arrays are cached separately from the dense scores and memory-mapped
+    entry_dir = _get_entry_dir(input_file, "sparse")
+    if not os.path.exists(f"{entry_dir}/metadata.json"):
+        _write_sparse_entry(entry_dir, *build())
+    return _read_sparse_entry(entry_dir)
@@ -0,0 +1,212 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from syslevel.profiling import profiled
+
+CHUNKED_VERSION = 1
+
+# The out-of-core mode stores the scores in column chunks of at most
+# `chunk_width` inputs, each a memory-mapped (metrics, systems, chunk_width)
+# `.npy` file, and only ever reads one chunk of a metric at a time. The memory
+# budget (SYSLEVEL_MEMORY_BUDGET_MB or --memory-budget-mb) sets the width of
+# the chunks and how many iterations are processed per pass over them.
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+# The number of (systems, chunk_width) float arrays which are alive at once
+# while a chunk is processed
+ARRAYS_PER_CHUNK = 4
+
+# (metric indices, system indices, input indices, values)
+ScoreBatch = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def get_memory_budget(memory_budget_mb: Optional[float] = None) -> int:
+    # The memory budget in bytes
+    if memory_budget_mb is None:
+        memory_budget_mb = float(
+            os.environ.get("SYSLEVEL_MEMORY_BUDGET_MB", DEFAULT_MEMORY_BUDGET_MB)
+        )
+    return int(memory_budget_mb * 1e6)
+
+
+def get_chunk_width(num_systems: int, memory_budget: int) -> int:
+    return max(1, memory_budget // (ARRAYS_PER_CHUNK * 8 * max(1, num_systems)))
+
+
+@profiled("write_chunked_scores")
+def write_chunked_scores(
+    output_dir: str,
+    metrics: List[str],
+    system_ids: List[str],
+    input_ids: List[str],
+    batches: Iterable[ScoreBatch],
+    memory_budget: int,
+    content_hash: str = "",
+) -> None:
+    # Scatters the batches of scores into the chunk files. The files are
+    # written to a temporary directory which is renamed to `output_dir` once
+    # they are complete.
+    K, N, M = len(metrics), len(system_ids), len(input_ids)
+    width = get_chunk_width(N, memory_budget)
+    bounds = list(range(0, M, width)) + [M]
+
+    parent_dir = os.path.dirname(os.path.abspath(output_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=parent_dir)
+    chunks = []
+    for c in range(len(bounds) - 1):
+        chunk = np.lib.format.open_memmap(
+            f"{temp_dir}/chunk-{c}.npy",
+            mode="w+",
+            dtype=np.float64,
+            shape=(K, N, bounds[c + 1] - bounds[c]),
+        )
+        chunk[:] = np.nan
+        chunks.append(chunk)
+
+    for metric_indices, rows, columns, values in batches:
+        chunk_indices = columns // width
+        for c in np.unique(chunk_indices):
+            mask = chunk_indices == c
+            chunks[c][metric_indices[mask], rows[mask], columns[mask] - c * width] = (
+                values[mask]
+            )
+    for chunk in chunks:
+        chunk.flush()
+    del chunks
+
+    np.save(f"{temp_dir}/system_ids.npy", np.array(system_ids, dtype=str))
+    np.save(f"{temp_dir}/input_ids.npy", np.array(input_ids, dtype=str))
+    metadata = {
+        "version": CHUNKED_VERSION,
+        "metrics": metrics,
+        "bounds": bounds,
+        "memory_budget": memory_budget,
+        "content_hash": content_hash,
+    }
+    with open(f"{temp_dir}/metadata.json", "w") as out:
+        json.dump(metadata, out)
+
+    try:
+        os.rename(temp_dir, output_dir)
+    except OSError:
+        # Another process already created the same directory
+        shutil.rmtree(temp_dir)
+
+
+class ChunkedScores:
+    # The scores of every metric in a directory written by
+    # `write_chunked_scores`. Indexing by a metric returns its `ChunkedMatrix`.
+    def __init__(self, path: str) -> None:
+        with open(f"{path}/metadata.json", "r") as f:
+            metadata = json.load(f)
+        if metadata["version"] != CHUNKED_VERSION:
+            raise Exception(f"Unknown chunked scores version in {path}")
+
+        self.path = path
+        self.metrics = metadata["metrics"]
+        self.bounds = metadata["bounds"]
+        self.memory_budget = metadata["memory_budget"]
+        self.content_hash = metadata["content_hash"]
+        self.system_ids = np.load(f"{path}/system_ids.npy").tolist()
+        self.input_ids = np.load(f"{path}/input_ids.npy").tolist()
+        self.metric_to_index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.system_to_index = {id_: i for i, id_ in enumerate(self.system_ids)}
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return len(self.metrics), len(self.system_ids), len(self.input_ids)
+
+    def __getitem__(self, metric: str) -> "ChunkedMatrix":
+        return ChunkedMatrix(self, self.metric_to_index[metric])
+
+    def get_system_indices(self, system_ids: Iterable[str]) -> np.ndarray:
+        return np.array([self.system_to_index[id_] for id_ in system_ids], dtype=int)
+
+
+class ChunkedMatrix:
+    # The (systems, inputs) matrix of one metric of a `ChunkedScores`. Like
+    # `SparseScores`, the number, sum and sum of squares of every system's
+    # non-nan scores are computed up front, here in one pass over the chunks.
+    def __init__(self, scores: ChunkedScores, metric_index: int) -> None:
+        self.path = scores.path
+        self.metric_index = metric_index
+        self.bounds = scores.bounds
+        self.memory_budget = scores.memory_budget
+        self.content_hash = scores.content_hash
+        self.shape = (len(scores.system_ids), len(scores.input_ids))
+
+        N = self.shape[0]
+        self.counts = np.zeros(N, dtype=np.int64)
+        self.sums = np.zeros(N)
+        self.sums_of_squares = np.zeros(N)
+        for _, block in self.iter_blocks():
+            is_scored = ~np.isnan(block)
+            block = np.where(is_scored, block, 0.0)
+            self.counts += is_scored.sum(axis=1)
+            self.sums += block.sum(axis=1)
+            self.sums_of_squares += np.sum(block**2, axis=1)
+
+    @property
+    def chunk_width(self) -> int:
+        return self.bounds[1] - self.bounds[0] if len(self.bounds) > 1 else 0
+
+    def iter_blocks(self) -> Iterator[Tuple[int, np.ndarray]]:
+        # Yields the first input index and the (systems, width) scores of every
+        # chunk, reading one chunk at a time
+        for c in range(len(self.bounds) - 1):
+            chunk = np.load(f"{self.path}/chunk-{c}.npy", mmap_mode="r")
+            yield self.bounds[c], np.array(chunk[self.metric_index])
+
+    def get_iterations_per_pass(self, bytes_per_iteration: int) -> int:
+        # How many iterations fit in the memory budget at once
+        return max(1, self.memory_budget // max(1, bytes_per_iteration))
+
+    def get_sums_of_squares(self) -> np.ndarray:
+        return self.sums_of_squares
+
+    def get_means(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sums / self.counts
+
+
+@profiled("bootstrap_chunked_system_scores")
+def bootstrap_chunked_system_scores(
+    X: ChunkedMatrix, num_iterations: int, rng: np.random.Generator
+) -> np.ndarray:
+    # Resamples every system's non-nan scores with replacement one chunk at a
+    # time. How many of a system's M draws fall into each chunk is multinomial,
+    # which is sampled chunk by chunk as a binomial of the draws left over the
+    # scores left. The draws within a chunk are then uniform over its scores,
+    # and only the per-system running sums are kept across chunks.
+    N = X.shape[0]
+    samples = np.empty((N, num_iterations))
+    iterations_per_pass = X.get_iterations_per_pass(4 * 8 * max(1, X.chunk_width))
+    for j in range(0, num_iterations, iterations_per_pass):
+        k = min(j + iterations_per_pass, num_iterations)
+        draws_left = np.repeat(X.counts[:, None], k - j, axis=1)
+        scores_left = X.counts.copy()
+        sums = np.zeros((N, k - j))
+        for _, block in X.iter_blocks():
+            is_scored = ~np.isnan(block)
+            counts = is_scored.sum(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                p = np.where(scores_left > 0, counts / scores_left, 0.0)
+            num_draws = rng.binomial(draws_left, np.minimum(p, 1.0)[:, None])
+            for i in np.where(counts > 0)[0]:
+                scores = block[i, is_scored[i]]
+                columns = rng.integers(0, counts[i], size=num_draws[i].sum())
+                iterations = np.repeat(np.arange(k - j), num_draws[i])
+                sums[i] += np.bincount(
+                    iterations, weights=scores[columns], minlength=k - j
+                )
+            draws_left -= num_draws
+            scores_left -= counts
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            samples[:, j:k] = sums / X.counts[:, None]
+    return samples
@@ -0,0 +1,103 @@
+import numpy as np
+from typing import Dict, List, Optional
+
+from syslevel.correlations import batch_kendall_tau, batch_pearson, batch_spearman
+from syslevel.profiling import profiled
+from syslevel.result_cache import memoized
+
+COEFFICIENTS = {
+    "pearson": batch_pearson,
+    "spearman": batch_spearman,
+    "kendall": batch_kendall_tau,
+}
+
+
+def _get_resampled_means(
+    scores: np.ndarray, is_scored: np.ndarray, weights: Optional[np.ndarray]
+) -> np.ndarray:
+    # Computes the nan-ignoring row means of `scores` after resampling the
+    # columns, where `weights[b, j]` is the number of times column j was
+    # sampled in resample b. Returns a (resamples, rows) array.
+    if weights is None:
+        sums = scores.sum(axis=1)[None, :]
+        counts = is_scored.sum(axis=1)[None, :]
+    else:
+        sums = weights @ scores.T
+        counts = weights @ is_scored.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sums / counts
+
+
+@profiled("bootstrap_system_correlations")
+@memoized("bootstrap_system_correlations")
+def bootstrap_system_correlations(
+    Xs: List[np.ndarray],
+    Z: np.ndarray,
+    resampling_method: str,
+    paired_inputs: bool,
+    n_resamples: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+    chunk_size: int = 10_000_000,
+) -> Dict[str, List[np.ndarray]]:
+    # Bootstraps the system-level correlations between every metric matrix in
+    # `Xs` and the ground-truth `Z` with the same resampling as
+    # `nlpstats.correlations.bootstrap`. One set of system and input indices
+    # is drawn per resample and shared by all of the metrics. If the inputs
+    # are not paired, the metrics' inputs are resampled independently of the
+    # ground-truth's. Returns the samples for every coefficient and metric,
+    # with the nan correlations removed.
+    if resampling_method not in {"systems", "inputs", "both"}:
+        raise ValueError(f"Unknown resampling method: {resampling_method}")
+    if rng is None:
+        rng = np.random.default_rng()
+
+    K = len(Xs)
+    m, n = Z.shape
+    groups = [np.concatenate(Xs, axis=0), Z]
+    groups = [
+        (np.nan_to_num(group), (~np.isnan(group)).astype(float)) for group in groups
+    ]
+
+    if resampling_method in {"systems", "both"}:
+        rows = rng.integers(0, m, size=(n_resamples, m))
+    else:
+        rows = np.tile(np.arange(m), (n_resamples, 1))
+
+    resample_inputs = resampling_method in {"inputs", "both"}
+    num_draws = 1 if paired_inputs else 2
+    samples = {coefficient: np.empty((K, n_resamples)) for coefficient in COEFFICIENTS}
+    resamples_per_chunk = max(1, chunk_size // (num_draws * n + (K + 1) * m))
+    for start in range(0, n_resamples, resamples_per_chunk):
+        end = min(start + resamples_per_chunk, n_resamples)
+        num_resamples = end - start
+
+        weights = [None, None]
+        if resample_inputs:
+            # Count how many times each input was sampled in each resample.
+            # Drawing all of the columns per resample keeps the resamples
+            # independent of the chunk size.
+            columns = rng.integers(0, n, size=(num_resamples, num_draws, n))
+            offsets = np.arange(num_resamples * num_draws).reshape(-1, num_draws, 1)
+            counts = np.bincount(
+                (columns + offsets * n).ravel(), minlength=columns.size
+            )
+            counts = counts.reshape(num_resamples, num_draws, n).astype(float)
+            weights = [counts[:, 0], counts[:, -1]]
+
+        (x_scores, x_is_scored), (z_scores, z_is_scored) = groups
+        x_means = _get_resampled_means(x_scores, x_is_scored, weights[0])
+        z_means = _get_resampled_means(z_scores, z_is_scored, weights[1])
+        x_means = np.broadcast_to(x_means, (num_resamples, K * m)).reshape(-1, K, m)
+        z_means = np.broadcast_to(z_means, (num_resamples, m))
+
+        chunk_rows = rows[start:end]
+        z_means = np.take_along_axis(z_means, chunk_rows, axis=1)
+        for k in range(K):
+            x_k = np.take_along_axis(x_means[:, k], chunk_rows, axis=1)
+            for coefficient, function in COEFFICIENTS.items():
+                samples[coefficient][k, start:end] = function(x_k, z_means)
+
+    return {
+        coefficient: [row[~np.isnan(row)] for row in values]
+        for coefficient, values in samples.items()
+    }
@@ -1,32 +1,28 @@
 import argparse
-import os
-from nlpstats.correlations import bootstrap
+import numpy as np
 
-from syslevel.util import GROUND_TRUTH, load_matrices
+from syslevel.confidence_intervals.bootstrap import bootstrap_system_correlations
+from syslevel.confidence_intervals.samples import save_samples
+from syslevel.profiling import profile_run
+from syslevel.util import GROUND_TRUTH, load_scores
 
 
 def main(args):
-    os.makedirs(args.output_dir, exist_ok=True)
-
     paired_inputs = args.paired_inputs.lower() == "true"
-    (X, Z), _ = load_matrices(
-        args.input_file, paired_inputs, [args.metric, GROUND_TRUTH]
-    )
+    scores = load_scores(args.input_file, paired_inputs, [args.metric, GROUND_TRUTH])
+    X, Z = scores[args.metric], scores[GROUND_TRUTH]
 
-    for coefficient in ["pearson", "spearman", "kendall"]:
-        result = bootstrap(
-            X,
-            Z,
-            "system",
-            coefficient,
-            args.resampling_method,
-            paired_inputs=paired_inputs,
-            n_resamples=1000,
-        )
-
-        with open(f"{args.output_dir}/{coefficient}.txt", "w") as out:
-            for sample in result.samples:
-                out.write(str(sample) + "\n")
+    rng = None if args.seed is None else np.random.default_rng(args.seed)
+    coefficient_to_samples = bootstrap_system_correlations(
+        [X], Z, args.resampling_method, paired_inputs, rng=rng
+    )
+    parameters = {
+        "input_file": args.input_file,
+        "resampling_method": args.resampling_method,
+        "paired_inputs": paired_inputs,
+        "seed": args.seed,
+    }
+    save_samples(args.output_dir, [args.metric], coefficient_to_samples, parameters)
 
 
 if __name__ == "__main__":
@@ -36,5 +32,8 @@ if __name__ == "__main__":
     argp.add_argument("--resampling-method", required=True)
     argp.add_argument("--paired-inputs", required=True)
     argp.add_argument("--output-dir", required=True)
+    argp.add_argument("--seed", type=int)
+    argp.add_argument("--profile", action="store_true")
     args = argp.parse_args()
-    main(args)
+    with profile_run("confidence_intervals.calculate", args.profile):
+        main(args)
@@ -0,0 +1,107 @@
+import argparse
+import time
+import numpy as np
+from typing import Dict, List, Tuple
+
+from syslevel.confidence_intervals.bootstrap import bootstrap_system_correlations
+from syslevel.confidence_intervals.samples import save_samples
+from syslevel.parallel import (
+    get_default_num_workers,
+    get_shared_array,
+    map_with_shared_arrays,
+)
+from syslevel.profiling import profile_run
+from syslevel.util import GROUND_TRUTH, METRICS, load_scores
+
+SPLITS = {"judged": True, "all": False}
+
+
+def _calculate_samples_task(
+    task: Tuple[int, List[str], str, bool, str, Dict, np.random.SeedSequence],
+) -> float:
+    index, metrics, method, paired_inputs, output_dir, parameters, seed = task
+    start = time.time()
+
+    # The last metric is the ground-truth
+    scores = get_shared_array(index)
+    Xs = list(scores[:-1])
+    Z = scores[-1]
+    # Without --seed, no generator is passed so that the bootstrap is not
+    # cached
+    rng = None if parameters["seed"] is None else np.random.default_rng(seed)
+    coefficient_to_samples = bootstrap_system_correlations(
+        Xs, Z, method, paired_inputs, rng=rng
+    )
+
+    parameters = dict(
+        parameters, seed_entropy=seed.entropy, seed_spawn_key=list(seed.spawn_key)
+    )
+    save_samples(output_dir, metrics, coefficient_to_samples, parameters)
+    return time.time() - start
+
+
+def main(args):
+    start = time.time()
+
+    # Every split's scores are loaded once and shared by all of the jobs which
+    # use them
+    arrays = []
+    keys = []
+    tasks = []
+    for dataset in args.datasets:
+        for split, paired_inputs in SPLITS.items():
+            input_file = f"{args.data_dir}/{dataset}/{split}/metrics.jsonl.gz"
+            scores = load_scores(
+                input_file, paired_inputs, args.metrics + [GROUND_TRUTH]
+            )
+            index = len(arrays)
+            arrays.append(scores.scores)
+
+            for method in args.methods:
+                output_dir = (
+                    f"{args.output_dir}/{dataset}/{split}/correlations/{method}"
+                )
+                keys.append((dataset, split, method))
+                parameters = {
+                    "input_file": input_file,
+                    "resampling_method": method,
+                    "paired_inputs": paired_inputs,
+                    "seed": args.seed,
+                }
+                tasks.append(
+                    (
+                        index,
+                        args.metrics,
+                        method,
+                        paired_inputs,
+                        output_dir,
+                        parameters,
+                    )
+                )
+    load_time = time.time() - start
+
+    seeds = np.random.SeedSequence(args.seed).spawn(len(tasks))
+    tasks = [task + (seed,) for task, seed in zip(tasks, seeds)]
+    times = map_with_shared_arrays(_calculate_samples_task, tasks, arrays, args.workers)
+
+    print(f"{'Dataset':<10} {'Split':<7} {'Method':<8} {'Time (s)':>9}")
+    for (dataset, split, method), job_time in zip(keys, times):
+        print(f"{dataset:<10} {split:<7} {method:<8} {job_time:>9.2f}")
+    print(f"Loading: {load_time:.2f}s")
+    print(f"Job time: {sum(times):.2f}s over {len(tasks)} jobs")
+    print(f"Wall time: {time.time() - start:.2f}s with {args.workers} workers")
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser()
+    argp.add_argument("--data-dir", default="data")
+    argp.add_argument("--datasets", nargs="+", default=["summeval", "realsumm"])
+    argp.add_argument("--metrics", nargs="+", default=METRICS)
+    argp.add_argument("--methods", nargs="+", default=["systems", "inputs", "both"])
+    argp.add_argument("--output-dir", required=True)
+    argp.add_argument("--workers", type=int, default=get_default_num_workers())
+    argp.add_argument("--seed", type=int)
+    argp.add_argument("--profile", action="store_true")
+    args = argp.parse_args()
+    with profile_run("confidence_intervals", args.profile):
+        main(args)
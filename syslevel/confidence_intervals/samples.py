@@ -0,0 +1,106 @@
+import json
+import os
+import numpy as np
+from collections import defaultdict
+from glob import glob
+from typing import Any, Dict, List, Optional
+
+from syslevel.profiling import profiled
+
+SAMPLES_VERSION = 1
+
+# The bootstrapped correlations of one (dataset, split, resampling method) are
+# saved as a (metrics, coefficients, resamples) `.npy` array which can be
+# memory-mapped, next to a JSON header with the metric and coefficient names,
+# the number of non-nan samples in each row and the bootstrap's parameters.
+# Each row holds its samples first and is padded with nan.
+SAMPLES_FILE = "samples.npy"
+HEADER_FILE = "samples.json"
+
+Samples = Dict[str, Dict[str, np.ndarray]]
+
+
+@profiled("save_samples")
+def save_samples(
+    output_dir: str,
+    metrics: List[str],
+    coefficient_to_samples: Dict[str, List[np.ndarray]],
+    parameters: Optional[Dict[str, Any]] = None,
+) -> None:
+    # `coefficient_to_samples` maps each coefficient to the samples of every
+    # metric, as returned by `bootstrap_system_correlations`
+    coefficients = list(coefficient_to_samples.keys())
+    num_samples = [
+        [len(coefficient_to_samples[coefficient][i]) for coefficient in coefficients]
+        for i in range(len(metrics))
+    ]
+    array = np.full(
+        (len(metrics), len(coefficients), max(map(max, num_samples))), np.nan
+    )
+    for i in range(len(metrics)):
+        for j, coefficient in enumerate(coefficients):
+            array[i, j, : num_samples[i][j]] = coefficient_to_samples[coefficient][i]
+
+    header = {
+        "version": SAMPLES_VERSION,
+        "metrics": metrics,
+        "coefficients": coefficients,
+        "num_samples": num_samples,
+        "parameters": parameters or {},
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    np.save(f"{output_dir}/{SAMPLES_FILE}", array)
+    with open(f"{output_dir}/{HEADER_FILE}", "w") as out:
+        json.dump(header, out, indent=2)
+
+
+def load_header(input_dir: str) -> Dict[str, Any]:
+    with open(f"{input_dir}/{HEADER_FILE}", "r") as f:
+        header = json.load(f)
+    if header["version"] != SAMPLES_VERSION:
+        raise Exception(f"Unknown samples version {header['version']} in {input_dir}")
+    return header
+
+
+def _load_binary_samples(input_dir: str) -> Samples:
+    # The samples are views into the memory-mapped array, so nothing is read
+    # until they are used
+    header = load_header(input_dir)
+    array = np.load(f"{input_dir}/{SAMPLES_FILE}", mmap_mode="r")
+    samples = defaultdict(dict)
+    for i, metric in enumerate(header["metrics"]):
+        for j, coefficient in enumerate(header["coefficients"]):
+            samples[metric][coefficient] = array[i, j, : header["num_samples"][i][j]]
+    return samples
+
+
+def _load_text_samples(metric_dir: str) -> Dict[str, np.ndarray]:
+    # Reads the older layout of one `{coefficient}.txt` file per coefficient
+    # with one sample per line
+    samples = {}
+    for path in sorted(glob(f"{metric_dir}/*.txt")):
+        coefficient = os.path.splitext(os.path.basename(path))[0]
+        samples[coefficient] = np.loadtxt(path, ndmin=1)
+    return samples
+
+
+def load_samples(input_dir: str) -> Samples:
+    # Loads the samples of every metric in `input_dir`, which may either hold
+    # one samples file for all of the metrics or one directory per metric,
+    # each with a samples file or the older text files
+    if os.path.exists(f"{input_dir}/{SAMPLES_FILE}"):
+        return _load_binary_samples(input_dir)
+
+    samples = defaultdict(dict)
+    for metric_dir in sorted(glob(f"{input_dir}/*")):
+        if not os.path.isdir(metric_dir):
+            continue
+        metric = os.path.basename(metric_dir)
+        if os.path.exists(f"{metric_dir}/{SAMPLES_FILE}"):
+            for name, coefficient_to_samples in _load_binary_samples(
+                metric_dir
+            ).items():
+                samples[name].update(coefficient_to_samples)
+        else:
+            samples[metric].update(_load_text_samples(metric_dir))
+    return samples
@@ -0,0 +1,141 @@
+import numpy as np
+
+from syslevel.profiling import profiled
+
+
+def _count_tied_pairs(counts: np.ndarray) -> int:
+    return int(np.sum(counts * (counts - 1) // 2))
+
+
+def _count_inversions(a: np.ndarray) -> int:
+    # Counts the pairs i < j with a[i] > a[j] using a bottom-up merge sort in
+    # which every level is a single vectorized pass. `a` must contain
+    # non-negative integers.
+    n = len(a)
+    K = int(a.max()) + 1 if n > 0 else 1
+    positions = np.arange(n)
+    inversions = 0
+    width = 1
+    while width < n:
+        block_ids = positions // width
+        merged_ids = block_ids // 2
+        is_right = block_ids % 2 == 1
+
+        # Offsetting the values by their merged block makes all of the left
+        # blocks one sorted array that can be searched at once
+        keys = merged_ids * K + a
+        left_keys = keys[~is_right]
+        right_keys = keys[is_right]
+        right_ids = merged_ids[is_right]
+        num_left = np.searchsorted(left_keys, (right_ids + 1) * K, side="left")
+        num_left_leq = np.searchsorted(left_keys, right_keys, side="right")
+        inversions += int(np.sum(num_left - num_left_leq))
+
+        a = np.sort(keys) - merged_ids * K
+        width *= 2
+    return inversions
+
+
+@profiled("kendall_tau")
+def kendall_tau(x: np.ndarray, y: np.ndarray) -> float:
+    # Computes Kendall's tau-b in O(n log n) (Knight, 1966), where
+    #   tau = (P - Q) / sqrt((P + Q + T) * (P + Q + U))
+    # This is equal to `scipy.stats.kendalltau(x, y)[0]`, including returning
+    # nan if either vector is constant or contains nan.
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) != len(y):
+        raise ValueError("`x` and `y` must have the same length")
+    n = len(x)
+    if n < 2 or np.isnan(x).any() or np.isnan(y).any():
+        return np.nan
+
+    _, x_ranks, x_counts = np.unique(x, return_inverse=True, return_counts=True)
+    _, y_ranks, y_counts = np.unique(y, return_inverse=True, return_counts=True)
+    _, joint_counts = np.unique(x_ranks * len(y_counts) + y_ranks, return_counts=True)
+
+    total = n * (n - 1) // 2
+    x_ties = _count_tied_pairs(x_counts)
+    y_ties = _count_tied_pairs(y_counts)
+    joint_ties = _count_tied_pairs(joint_counts)
+
+    # Sorting by x then y means pairs tied in x are never counted as inversions
+    order = np.lexsort((y_ranks, x_ranks))
+    discordant = _count_inversions(y_ranks[order])
+
+    denominator = float(total - x_ties) * float(total - y_ties)
+    if denominator == 0:
+        return np.nan
+    concordant_minus_discordant = total - x_ties - y_ties + joint_ties - 2 * discordant
+    return concordant_minus_discordant / np.sqrt(denominator)
+
+
+def calculate_tau_from_deltas(delta_auto: np.ndarray, delta_human: np.ndarray) -> float:
+    # Computes Kendall's tau-b over a subset of system pairs given the pairs'
+    # score differences. Returns 0 if there are no pairs with a non-zero human
+    # score difference or that are untied in both.
+    delta_auto = np.asarray(delta_auto)
+    delta_human = np.asarray(delta_human)
+    signs = np.sign(delta_auto) * np.sign(delta_human)
+    P = int(np.sum(signs > 0))
+    Q = int(np.sum(signs < 0))
+    T = int(np.sum((delta_auto == 0) & (delta_human != 0)))
+    U = int(np.sum((delta_auto != 0) & (delta_human == 0)))
+    if P + Q + T == 0:
+        return 0
+    return (P - Q) / np.sqrt((P + Q + T) * (P + Q + U))
+
+
+@profiled("batch_kendall_tau")
+def batch_kendall_tau(
+    X: np.ndarray, Y: np.ndarray, chunk_size: int = 10_000_000
+) -> np.ndarray:
+    # Computes Kendall's tau-b between every row of `X` and the same row of
+    # `Y`, both (batch, n), with the same semantics as
+    # `scipy.stats.kendalltau`. With the signs of all n * (n - 1) / 2 pairwise
+    # differences, tau-b is sum(sx * sy) / sqrt(sum(sx^2) * sum(sy^2)).
+    # `chunk_size` bounds the number of pairwise differences held at once.
+    X = np.asarray(X, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    if X.shape != Y.shape:
+        raise ValueError("`X` and `Y` must have the same shape")
+    batch_size, n = X.shape
+    first, second = np.triu_indices(n, k=1)
+
+    taus = np.empty(batch_size)
+    rows_per_chunk = max(1, chunk_size // max(len(first), 1))
+    for start in range(0, batch_size, rows_per_chunk):
+        end = min(start + rows_per_chunk, batch_size)
+        signs_x = np.sign(X[start:end, first] - X[start:end, second])
+        signs_y = np.sign(Y[start:end, first] - Y[start:end, second])
+        numerator = np.sum(signs_x * signs_y, axis=1)
+        denominator = np.sqrt(
+            np.sum(np.abs(signs_x), axis=1) * np.sum(np.abs(signs_y), axis=1)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            taus[start:end] = np.where(denominator > 0, numerator / denominator, np.nan)
+    return taus
+
+
+@profiled("batch_pearson")
+def batch_pearson(X: np.ndarray, Y: np.ndarray) -> np.ndarray:
+    # Computes Pearson's r between every row of `X` and the same row of `Y`.
+    # Rows with nan or which are constant have a correlation of nan.
+    X = X - X.mean(axis=1, keepdims=True)
+    Y = Y - Y.mean(axis=1, keepdims=True)
+    numerator = np.sum(X * Y, axis=1)
+    denominator = np.sqrt(np.sum(X * X, axis=1) * np.sum(Y * Y, axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+@profiled("batch_spearman")
+def batch_spearman(X: np.ndarray, Y: np.ndarray) -> np.ndarray:
+    # Computes Spearman's rho between every row of `X` and the same row of
+    # `Y` as the Pearson correlation of the average ranks
+    from scipy.stats import rankdata
+
+    has_nan = np.isnan(X).any(axis=1) | np.isnan(Y).any(axis=1)
+    rhos = batch_pearson(rankdata(X, axis=1), rankdata(Y, axis=1))
+    rhos[has_nan] = np.nan
+    return rhos
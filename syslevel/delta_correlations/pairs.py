@@ -0,0 +1,127 @@
+import math
+import numpy as np
+from typing import List, Tuple, Union
+
+from syslevel.correlations import calculate_tau_from_deltas
+from syslevel.profiling import profiled
+
+Deltas = Union[float, np.ndarray]
+
+
+def get_all_pairs(x: np.ndarray, z: np.ndarray) -> List:
+    pairs = []
+    N = x.shape[0]
+    for i in range(N):
+        for j in range(i + 1, N):
+            pairs.append((i, j, x[i] - x[j], z[i] - z[j]))
+    return pairs
+
+
+def calculate_tau(pairs: List):
+    #   tau = (P - Q) / sqrt((P + Q + T) * (P + Q + U))
+    # where P is the number of concordant pairs, Q the number of discordant
+    # pairs, T the number of ties only in `x`, and U the number of ties only in
+    # `y`.  If a tie occurs for the same pair in both `x` and `y`, it is not
+    # added to either T or U.
+    pairs = np.asarray(pairs, dtype=np.float64).reshape(-1, 4)
+    return calculate_tau_from_deltas(pairs[:, 2], pairs[:, 3])
+
+
+def get_percentile_deltas(pairs: List):
+    percentile = 0.1
+    num_pairs_per_bucket = int(math.ceil(len(pairs) * percentile))
+    num_buckets = int(math.ceil(len(pairs) / num_pairs_per_bucket))
+
+    min_deltas = [0.0]
+    max_deltas = []
+    pairs = sorted(pairs, key=lambda t: abs(t[2]))
+    for i in range(num_buckets):
+        pair = pairs[min((i + 1) * num_pairs_per_bucket - 1, len(pairs) - 1)]
+        delta = pair[2]
+        min_deltas.append(abs(delta))
+        max_deltas.append(abs(delta))
+    min_deltas.pop()
+    return min_deltas, max_deltas
+
+
+class PairTable:
+    # Stores every pair of systems (i, j) with i < j sorted by the absolute
+    # difference of their automatic metric scores, |x[i] - x[j]|, plus
+    # cumulative counts of the concordant (P), discordant (Q), metric-only
+    # tied (T) and human-only tied (U) pairs. The Kendall's tau over all of
+    # the pairs with min_delta <= |delta| <= max_delta then only requires two
+    # binary searches.
+    @profiled("build_pair_table")
+    def __init__(self, x: np.ndarray, z: np.ndarray) -> None:
+        i, j = np.triu_indices(len(x), k=1)
+        delta_auto = x[i] - x[j]
+        delta_human = z[i] - z[j]
+
+        order = np.argsort(np.abs(delta_auto), kind="stable")
+        self.i = i[order]
+        self.j = j[order]
+        self.deltas = delta_auto[order]
+        self.abs_deltas = np.abs(self.deltas)
+        delta_human = delta_human[order]
+        self.signs = np.sign(self.deltas) * np.sign(delta_human)
+
+        counts = np.stack(
+            [
+                self.signs > 0,
+                self.signs < 0,
+                (self.deltas == 0) & (delta_human != 0),
+                (self.deltas != 0) & (delta_human == 0),
+            ]
+        )
+        self.cumulative_counts = np.zeros((4, len(self) + 1), dtype=np.int64)
+        np.cumsum(counts, axis=1, out=self.cumulative_counts[:, 1:])
+
+    def __len__(self) -> int:
+        return len(self.abs_deltas)
+
+    def get_range(
+        self, min_delta: Deltas, max_delta: Deltas
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # The pairs with min_delta <= |delta| <= max_delta are [start, end)
+        start = np.searchsorted(self.abs_deltas, min_delta, side="left")
+        end = np.searchsorted(self.abs_deltas, max_delta, side="right")
+        start, end = np.broadcast_arrays(start, end)
+        return start, np.maximum(start, end)
+
+    def count(self, min_delta: Deltas, max_delta: Deltas) -> np.ndarray:
+        start, end = self.get_range(min_delta, max_delta)
+        return end - start
+
+    def tau(self, min_delta: Deltas, max_delta: Deltas) -> np.ndarray:
+        # Same definition as `calculate_tau`, including returning 0 when
+        # P + Q + T is 0
+        start, end = self.get_range(min_delta, max_delta)
+        P, Q, T, U = self.cumulative_counts[:, end] - self.cumulative_counts[:, start]
+        numerator = (P - Q).astype(np.float64)
+        denominator = np.sqrt((P + Q + T).astype(np.float64) * (P + Q + U))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            taus = np.where(P + Q + T == 0, 0.0, numerator / denominator)
+        return taus if taus.ndim > 0 else float(taus)
+
+    def heatmap(
+        self, min_deltas: List[float], max_deltas: List[float]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # Returns the correlations and number of pairs for every
+        # (min_delta, max_delta) cell
+        min_deltas = np.asarray(min_deltas)[:, None]
+        max_deltas = np.asarray(max_deltas)[None, :]
+        return self.tau(min_deltas, max_deltas), self.count(min_deltas, max_deltas)
+
+    def get_percentile_deltas(
+        self, percentile: float = 0.1
+    ) -> Tuple[List[float], List[float]]:
+        # Splits the pairs into buckets which each have `percentile` of the
+        # pairs and returns the |delta| values at the bucket boundaries
+        num_pairs_per_bucket = int(math.ceil(len(self) * percentile))
+        num_buckets = int(math.ceil(len(self) / num_pairs_per_bucket))
+
+        indices = np.arange(1, num_buckets + 1) * num_pairs_per_bucket - 1
+        indices = np.minimum(indices, len(self) - 1)
+        max_deltas = self.abs_deltas[indices].tolist()
+        min_deltas = [0.0] + max_deltas[:-1]
+        return min_deltas, max_deltas
@@ -1,56 +1,43 @@
 import argparse
 import os
-import math
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
-from collections import OrderedDict
 from typing import Dict, List
 
-from syslevel.delta_correlations.plot_heatmaps import (
-    get_all_pairs,
-    get_percentile_deltas,
-    calculate_tau,
-)
+from syslevel.delta_correlations.pairs import PairTable
+from syslevel.profiling import profile_run, profiled, span
+from syslevel.results import get_results_file, load_results, save_results
 from syslevel.util import (
     COLOR_MAP,
     GROUND_TRUTH,
     SMALL_METRICS,
     ROUGE_METRICS,
-    load_matrices,
+    load_scores,
     get_dataset_title,
 )
 
 
 def run_05_delta(input_jsonl: str) -> None:
-    (X, Z), _ = load_matrices(input_jsonl, False, ["ROUGE-1", GROUND_TRUTH])
-
-    x = np.nanmean(X, axis=1)
-    z = np.nanmean(Z, axis=1)
-    pairs = get_all_pairs(x, z)
+    scores = load_scores(input_jsonl, False, ["ROUGE-1", GROUND_TRUTH])
 
-    bucket = [pair for pair in pairs if abs(pair[2]) <= 0.5]
-    print(calculate_tau(bucket))
+    x = scores.get_means("ROUGE-1")
+    z = scores.get_means(GROUND_TRUTH)
+    pairs = PairTable(x, z)
+    print(pairs.tau(0.0, 0.5))
 
 
+@profiled("load_data")
 def load_data(input_jsonl: str, metrics: List[str]) -> Dict:
-    Xs, _ = load_matrices(input_jsonl, False, [GROUND_TRUTH] + metrics)
-    Z = Xs[0]
-    Xs = Xs[1:]
+    scores = load_scores(input_jsonl, False, [GROUND_TRUTH] + metrics)
+    z = scores.get_means(GROUND_TRUTH)
 
     metric_to_data = {}
 
-    for X, metric in zip(Xs, metrics):
-        x = np.nanmean(X, axis=1)
-        z = np.nanmean(Z, axis=1)
-        pairs = get_all_pairs(x, z)
-
-        _, max_deltas = get_percentile_deltas(pairs)
-        correlations = []
+    for metric in metrics:
+        x = scores.get_means(metric)
+        pairs = PairTable(x, z)
 
-        for max_delta in max_deltas:
-            bucket = [pair for pair in pairs if abs(pair[2]) <= max_delta]
-            correlations.append(calculate_tau(bucket))
+        _, max_deltas = pairs.get_percentile_deltas()
+        correlations = pairs.tau(0.0, np.asarray(max_deltas)).tolist()
 
         metric_to_data[metric] = {
             "correlations": correlations,
@@ -59,17 +46,12 @@ def load_data(input_jsonl: str, metrics: List[str]) -> Dict:
     return metric_to_data
 
 
-def main(args):
-    fontsize = 8
-    show_u_values = True
-
+def compute(args) -> Dict:
     if args.rouge_only:
         metrics = ROUGE_METRICS
     else:
         metrics = SMALL_METRICS
 
-    plt.rcParams.update({"font.size": fontsize})
-
     if False:
         run_05_delta(args.input_fabbri_jsonl)
         run_05_delta(args.input_bhandari_jsonl)
@@ -80,11 +62,30 @@ def main(args):
         "bhandari": load_data(args.input_bhandari_jsonl, metrics),
     }
 
+    results = {"metrics": metrics, "rouge_only": args.rouge_only}
+    for dataset, metric_to_data in data.items():
+        for metric, metric_data in metric_to_data.items():
+            results[f"{dataset}/{metric}/correlations"] = np.asarray(
+                metric_data["correlations"]
+            )
+            results[f"{dataset}/{metric}/max_deltas"] = metric_data["max_deltas"]
+    return results
+
+
+def render(results: Dict, output_file: str) -> None:
+    import matplotlib.pyplot as plt
+
+    fontsize = 8
+    show_u_values = True
+    metrics = results["metrics"]
+
+    plt.rcParams.update({"font.size": fontsize})
+
     fig, axes = plt.subplots(2, len(metrics), sharey=True, figsize=(6.3, 2.2))
 
     for i, dataset in enumerate(["fabbri", "bhandari"]):
         for j, metric in enumerate(metrics):
-            first_row = data[dataset][metric]["correlations"]
+            first_row = results[f"{dataset}/{metric}/correlations"].tolist()
             x = [10 * (k + 1) for k in range(len(first_row))]
             axes[i, j].plot(
                 x, first_row, color=COLOR_MAP[metric], label=metric
@@ -94,7 +95,7 @@ def main(args):
 
             axes[i, j].set_xticks([0, 20, 40, 60, 80, 100])
             # axes[i, j].set_xticklabels(x, fontsize=fontsize)
-            if args.rouge_only:
+            if results["rouge_only"]:
                 axes[i, j].set_yticks([-0.25, 0, 0.25, 0.50, 0.75])
             else:
                 axes[i, j].set_yticks([0, 0.25, 0.50, 0.75])
@@ -106,7 +107,7 @@ def main(args):
                 twin = axes[i, j].twiny()
                 twin.set_xlim(axes[i, j].get_xlim())
                 twin.set_xticks([20, 40, 60, 80, 100])
-                max_deltas = data[dataset][metric]["max_deltas"]
+                max_deltas = results[f"{dataset}/{metric}/max_deltas"]
                 us = [
                     max_deltas[1],
                     max_deltas[3],
@@ -141,18 +142,41 @@ def main(args):
     # plt.ylabel("System-Level $\\tau$")
 
     plt.tight_layout()
-    dirname = os.path.dirname(args.output_file)
+    dirname = os.path.dirname(output_file)
     if dirname:
         os.makedirs(dirname, exist_ok=True)
-    print(args.output_file)
-    plt.savefig(args.output_file)
+    print(output_file)
+    plt.savefig(output_file)
+
+
+def main(args):
+    results_file = args.results_file or get_results_file(args.output_file)
+    if args.render_only:
+        results = load_results(results_file)
+    else:
+        results = compute(args)
+        save_results(results_file, results)
+
+    if not args.compute_only:
+        with span("plot"):
+            render(results, args.output_file)
 
 
 if __name__ == "__main__":
     argp = argparse.ArgumentParser()
-    argp.add_argument("--input-fabbri-jsonl", required=True)
-    argp.add_argument("--input-bhandari-jsonl", required=True)
+    argp.add_argument("--input-fabbri-jsonl")
+    argp.add_argument("--input-bhandari-jsonl")
     argp.add_argument("--rouge-only", action="store_true")
     argp.add_argument("--output-file", required=True)
+    argp.add_argument("--results-file")
+    stages = argp.add_mutually_exclusive_group()
+    stages.add_argument("--compute-only", action="store_true")
+    stages.add_argument("--render-only", action="store_true")
+    argp.add_argument("--profile", action="store_true")
     args = argp.parse_args()
-    main(args)
+    if not args.render_only and (
+        args.input_fabbri_jsonl is None or args.input_bhandari_jsonl is None
+    ):
+        argp.error("the metrics files are required unless --render-only is used")
+    with profile_run("delta_correlations.plot_combined", args.profile):
+        main(args)
@@ -1,72 +1,20 @@
 import argparse
 import os
-import math
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
-from collections import OrderedDict
-from typing import Dict, List
+from typing import Dict
 
+from syslevel.delta_correlations.pairs import PairTable
+from syslevel.profiling import profile_run, span
+from syslevel.result_cache import memoized
+from syslevel.results import load_results, save_results
 from syslevel.util import (
-    COLOR_MAP,
     GROUND_TRUTH,
     METRICS,
-    SMALL_METRICS,
-    load_matrices,
+    load_scores,
     get_dataset_title,
 )
 
 
-def get_all_pairs(x: np.ndarray, z: np.ndarray) -> List:
-    pairs = []
-    N = x.shape[0]
-    for i in range(N):
-        for j in range(i + 1, N):
-            pairs.append((i, j, x[i] - x[j], z[i] - z[j]))
-    return pairs
-
-
-def calculate_tau(pairs: List):
-    #   tau = (P - Q) / sqrt((P + Q + T) * (P + Q + U))
-    # where P is the number of concordant pairs, Q the number of discordant
-    # pairs, T the number of ties only in `x`, and U the number of ties only in
-    # `y`.  If a tie occurs for the same pair in both `x` and `y`, it is not
-    # added to either T or U.
-    P, Q, T, U = 0, 0, 0, 0
-    for _, _, delta_auto, delta_human in pairs:
-        if (delta_auto > 0 and delta_human > 0) or (delta_auto < 0 and delta_human < 0):
-            P += 1
-        elif (delta_auto > 0 and delta_human < 0) or (
-            delta_auto < 0 and delta_human > 0
-        ):
-            Q += 1
-        elif delta_auto == 0 and delta_human != 0:
-            T += 1
-        elif delta_auto != 0 and delta_human == 0:
-            U += 1
-    if P + Q + T == 0:
-        return 0
-    tau = (P - Q) / np.sqrt((P + Q + T) * (P + Q + U))
-    return tau
-
-
-def get_percentile_deltas(pairs: List):
-    percentile = 0.1
-    num_pairs_per_bucket = int(math.ceil(len(pairs) * percentile))
-    num_buckets = int(math.ceil(len(pairs) / num_pairs_per_bucket))
-
-    min_deltas = [0.0]
-    max_deltas = []
-    pairs = sorted(pairs, key=lambda t: abs(t[2]))
-    for i in range(num_buckets):
-        pair = pairs[min((i + 1) * num_pairs_per_bucket - 1, len(pairs) - 1)]
-        delta = pair[2]
-        min_deltas.append(abs(delta))
-        max_deltas.append(abs(delta))
-    min_deltas.pop()
-    return min_deltas, max_deltas
-
-
 def get_colors(metric: str) -> str:
     if metric == "ROUGE-1":
         return "Reds"
@@ -81,46 +29,58 @@ def get_colors(metric: str) -> str:
     raise Exception(f"Unknown metric: {metric}")
 
 
-def main(args):
+@memoized("calculate_heatmap")
+def calculate_heatmap(
+    x: np.ndarray, z: np.ndarray, percentile: float, min_pairs: int
+) -> Dict:
+    pairs = PairTable(x, z)
+
+    min_deltas, max_deltas = pairs.get_percentile_deltas(percentile)
+    correlations, num_pairs = pairs.heatmap(min_deltas, max_deltas)
+    mask = np.tril(np.ones(correlations.shape), k=-1)
+
+    skipped = np.asarray(min_deltas)[:, None] >= np.asarray(max_deltas)[None, :]
+    num_pairs[skipped] = 0
+    too_few = ~skipped & (num_pairs < min_pairs)
+    mask[too_few] = 1
+    correlations[skipped | too_few] = 0
+
+    return {
+        "correlations": correlations,
+        "num_pairs": num_pairs,
+        "mask": mask,
+        "min_deltas": min_deltas,
+        "max_deltas": max_deltas,
+    }
+
+
+def compute(args) -> Dict:
     min_pairs = 5
-    fontsize = 14
     metrics = METRICS
 
-    Xs, _ = load_matrices(args.input_jsonl, False, [GROUND_TRUTH] + metrics)
-    Z = Xs[0]
-    Xs = Xs[1:]
+    scores = load_scores(args.input_jsonl, False, [GROUND_TRUTH] + metrics)
+    z = scores.get_means(GROUND_TRUTH)
 
-    metric_to_data = OrderedDict()
+    results = {"dataset": args.dataset, "metrics": metrics}
+    for metric in metrics:
+        x = scores.get_means(metric)
+        heatmap = calculate_heatmap(x, z, args.percentile, min_pairs)
+        for key, value in heatmap.items():
+            results[f"{metric}/{key}"] = value
+    return results
 
-    for X, metric in zip(Xs, metrics):
-        x = np.nanmean(X, axis=1)
-        z = np.nanmean(Z, axis=1)
-        pairs = get_all_pairs(x, z)
 
-        min_deltas, max_deltas = get_percentile_deltas(pairs)
-        correlations = np.zeros((len(min_deltas), len(max_deltas)))
-        num_pairs = np.zeros((len(min_deltas), len(max_deltas)))
-        mask = np.tril(np.ones(correlations.shape), k=-1)
-
-        for i, min_delta in enumerate(min_deltas):
-            for j, max_delta in enumerate(max_deltas):
-                if min_delta >= max_delta:
-                    continue
-                bucket = [
-                    pair for pair in pairs if min_delta <= abs(pair[2]) <= max_delta
-                ]
-                num_pairs[i, j] = len(bucket)
-                if len(bucket) < min_pairs:
-                    mask[i, j] = 1
-                else:
-                    correlations[i, j] = calculate_tau(bucket)
-
-        metric_to_data[metric] = {
-            "correlations": correlations,
-            "min_deltas": min_deltas,
-            "max_deltas": max_deltas,
-        }
+def render(results: Dict, output_dir: str) -> None:
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
+    fontsize = 14
+    title = get_dataset_title(results["dataset"])
+    for metric in results["metrics"]:
+        correlations = results[f"{metric}/correlations"]
+        num_pairs = results[f"{metric}/num_pairs"]
+        min_deltas = results[f"{metric}/min_deltas"]
+        max_deltas = results[f"{metric}/max_deltas"]
         yticklabels = ["{:.1f}".format(value) for value in min_deltas]
         xticklabels = ["{:.1f}".format(value) for value in max_deltas]
 
@@ -131,7 +91,7 @@ def main(args):
             annot=True,
             xticklabels=xticklabels,
             yticklabels=yticklabels,
-            mask=mask,
+            mask=results[f"{metric}/mask"],
             fmt=".2f",
             cbar_kws={"label": "System-Level Correlation (Kendall's $\\tau$)"},
             vmin=-1,
@@ -144,11 +104,10 @@ def main(args):
         ax.figure.axes[-1].yaxis.label.set_size(fontsize)
         # ax.collections[0].colorbar.ax.tick_params(labelsize=14)
 
-        title = get_dataset_title(args.dataset)
         plt.title(title, fontsize=fontsize)
         plt.tight_layout(pad=0)
 
-        metric_dir = f"{args.output_dir}/{metric}"
+        metric_dir = f"{output_dir}/{metric}"
         os.makedirs(metric_dir, exist_ok=True)
         plt.savefig(f"{metric_dir}/correlations.pdf")
         plt.close()
@@ -167,17 +126,38 @@ def main(args):
         )
         plt.xlabel(f"Maximum {metric} $\\Delta$", fontsize=fontsize)
         plt.ylabel(f"Minimum {metric} $\\Delta$", fontsize=fontsize)
-        title = get_dataset_title(args.dataset)
         plt.title(title, fontsize=fontsize)
         plt.tight_layout(pad=0)
         plt.savefig(f"{metric_dir}/num-pairs.pdf")
         plt.close()
 
 
+def main(args):
+    results_file = args.results_file or f"{args.output_dir}/results.npz"
+    if args.render_only:
+        results = load_results(results_file)
+    else:
+        results = compute(args)
+        save_results(results_file, results)
+
+    if not args.compute_only:
+        with span("plot"):
+            render(results, args.output_dir)
+
+
 if __name__ == "__main__":
     argp = argparse.ArgumentParser()
-    argp.add_argument("--input-jsonl", required=True)
-    argp.add_argument("--dataset", required=True)
+    argp.add_argument("--input-jsonl")
+    argp.add_argument("--dataset")
     argp.add_argument("--output-dir", required=True)
+    argp.add_argument("--percentile", type=float, default=0.1)
+    argp.add_argument("--results-file")
+    stages = argp.add_mutually_exclusive_group()
+    stages.add_argument("--compute-only", action="store_true")
+    stages.add_argument("--render-only", action="store_true")
+    argp.add_argument("--profile", action="store_true")
     args = argp.parse_args()
-    main(args)
+    if not args.render_only and (args.input_jsonl is None or args.dataset is None):
+        argp.error("--input-jsonl and --dataset are required unless --render-only")
+    with profile_run("delta_correlations.plot_heatmaps", args.profile):
+        main(args)
@@ -0,0 +1,130 @@
+import gzip
+import json
+import os
+import numpy as np
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+# orjson parses the lines several times faster than the standard library if it
+# is installed
+try:
+    import orjson
+
+    def loads(line: bytes):
+        # orjson rejects the NaN and Infinity tokens which `json.dumps` writes
+        # for undefined scores, so those lines are parsed by the json module
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            return json.loads(line)
+
+except ImportError:
+    from json import loads
+
+# The decompressed bytes of each batch of lines which is parsed at once
+DEFAULT_BATCH_BYTES = 1 << 22
+
+# One worker is used per this many compressed bytes, up to the number of CPUs,
+# unless SYSLEVEL_READ_WORKERS is set
+BYTES_PER_WORKER = 4 << 20
+
+
+class ColumnBatch(NamedTuple):
+    # The instances of a batch of lines as columns. Instance i of the batch has
+    # the IDs `summarizer_ids[i]` and `instance_ids[i]`, and `metrics[metric]`
+    # holds the positions of the instances which have a score for the metric
+    # and those scores.
+    summarizer_ids: List[str]
+    instance_ids: List[str]
+    metrics: Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+
+def get_value(value) -> float:
+    if isinstance(value, list):
+        if len(value) == 0:
+            return np.nan
+        return sum(value) / len(value)
+    return value
+
+
+def make_column_batch(instances: Iterable[Dict]) -> ColumnBatch:
+    summarizer_ids = []
+    instance_ids = []
+    buffers = defaultdict(lambda: (array("q"), array("d")))
+    for i, instance in enumerate(instances):
+        summarizer_ids.append(instance["summarizer_id"])
+        instance_ids.append(instance["instance_id"])
+        for metric, value in instance["metrics"].items():
+            positions, values = buffers[metric]
+            positions.append(i)
+            values.append(get_value(value))
+
+    metrics = {
+        metric: (
+            np.frombuffer(positions, dtype=np.int64),
+            np.frombuffer(values, dtype=np.float64),
+        )
+        for metric, (positions, values) in buffers.items()
+    }
+    return ColumnBatch(summarizer_ids, instance_ids, metrics)
+
+
+def _parse_lines(lines: List[bytes]) -> ColumnBatch:
+    return make_column_batch(loads(line) for line in lines)
+
+
+def read_line_batches(input_file: str, batch_bytes: int) -> Iterator[List[bytes]]:
+    # Decompresses the file in blocks of about `batch_bytes` and splits them
+    # into the non-empty lines, carrying a partial last line over to the next
+    # block
+    with gzip.open(input_file, "rb") as f:
+        remainder = b""
+        while True:
+            block = f.read(batch_bytes)
+            if len(block) == 0:
+                break
+            lines = (remainder + block).split(b"\n")
+            remainder = lines.pop()
+            lines = [line for line in lines if line.strip()]
+            if len(lines) > 0:
+                yield lines
+        if remainder.strip():
+            yield [remainder]
+
+
+def get_num_read_workers(input_file: str) -> int:
+    if "SYSLEVEL_READ_WORKERS" in os.environ:
+        return int(os.environ["SYSLEVEL_READ_WORKERS"])
+    num_workers = 1 + os.path.getsize(input_file) // BYTES_PER_WORKER
+    return min(num_workers, os.cpu_count() or 1)
+
+
+def read_column_batches(
+    input_file: str,
+    num_workers: int = None,
+    batch_bytes: int = DEFAULT_BATCH_BYTES,
+) -> Iterator[ColumnBatch]:
+    # Yields the `ColumnBatch` of every batch of lines in a gzipped JSONL file
+    # in order. The file is decompressed in this process and the lines are
+    # parsed on `num_workers` processes, which by default depends on the size
+    # of the file.
+    if num_workers is None:
+        num_workers = get_num_read_workers(input_file)
+    line_batches = read_line_batches(input_file, batch_bytes)
+    if num_workers <= 1:
+        for lines in line_batches:
+            yield _parse_lines(lines)
+        return
+
+    with ProcessPoolExecutor(num_workers) as executor:
+        # Only a few batches are kept in flight at once, and they are yielded
+        # in the order they were read
+        pending = deque()
+        for lines in line_batches:
+            pending.append(executor.submit(_parse_lines, lines))
+            if len(pending) >= 2 * num_workers:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
@@ -0,0 +1,98 @@
+import functools
+import os
+import shutil
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from syslevel.profiling import (
+    is_profiling_enabled,
+    merge_worker_spans,
+    pop_worker_spans,
+    profiled,
+    start_worker_profiling,
+)
+
+_shared_arrays = []
+
+
+def get_default_num_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def _get_shared_dir() -> Optional[str]:
+    # /dev/shm is memory-backed on Linux, so the arrays never touch the disk
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return None
+
+
+@contextmanager
+def share_arrays(arrays: List[np.ndarray]) -> Iterator[List[str]]:
+    # Saves the arrays to temporary .npy files which worker processes can
+    # memory-map instead of receiving a pickled copy for every task
+    temp_dir = tempfile.mkdtemp(prefix="syslevel-", dir=_get_shared_dir())
+    try:
+        paths = []
+        for i, array in enumerate(arrays):
+            path = f"{temp_dir}/{i}.npy"
+            np.save(path, array)
+            paths.append(path)
+        yield paths
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def _load_shared_arrays(paths: List[str]) -> None:
+    global _shared_arrays
+    _shared_arrays = [np.load(path, mmap_mode="r") for path in paths]
+
+
+def _init_worker(paths: List[str], profile: bool) -> None:
+    _load_shared_arrays(paths)
+    if profile:
+        start_worker_profiling()
+
+
+def _run_profiled_task(function: Callable, task) -> Tuple:
+    # Returns the task's result and the spans it recorded
+    return function(task), pop_worker_spans()
+
+
+def get_shared_array(index: int) -> np.ndarray:
+    return _shared_arrays[index]
+
+
+@profiled("map_with_shared_arrays")
+def map_with_shared_arrays(
+    function: Callable, tasks: List, arrays: List[np.ndarray], num_workers: int
+) -> List:
+    # Returns `[function(task) for task in tasks]`, run on `num_workers`
+    # processes. `function` must be a module-level function, and it can read
+    # `arrays[i]` with `get_shared_array(i)`.
+    global _shared_arrays
+    if num_workers <= 1:
+        _shared_arrays = arrays
+        try:
+            return [function(task) for task in tasks]
+        finally:
+            _shared_arrays = []
+
+    profile = is_profiling_enabled()
+    with share_arrays(arrays) as paths:
+        with ProcessPoolExecutor(
+            num_workers, initializer=_init_worker, initargs=(paths, profile)
+        ) as executor:
+            if not profile:
+                return list(executor.map(function, tasks))
+
+            # The spans recorded in the workers are merged into this process's
+            # spans, below the span of this call
+            results = []
+            task_function = functools.partial(_run_profiled_task, function)
+            for result, spans in executor.map(task_function, tasks):
+                merge_worker_spans(spans)
+                results.append(result)
+            return results
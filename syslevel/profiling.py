@@ -0,0 +1,183 @@
+import functools
+import json
+import os
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+# Profiling is off unless an entry point is run with `--profile` or the
+# SYSLEVEL_PROFILE environment variable is set to 1 or true, in which case
+# every span's wall time, CPU time and peak traced memory are recorded. Spans
+# which run in the worker processes of `map_with_shared_arrays` are recorded
+# there and merged into the parent's spans.
+_spans: Optional[List[Dict]] = None
+_stack: List[Dict] = []
+_start_time = 0.0
+
+# `tracemalloc.reset_peak` was added in Python 3.9. Without it, the peaks of
+# nested spans include everything allocated since profiling started.
+_reset_peak = getattr(tracemalloc, "reset_peak", lambda: None)
+
+
+def get_profile_dir() -> str:
+    return os.environ.get("SYSLEVEL_PROFILE_DIR", "profiles")
+
+
+def is_profile_requested() -> bool:
+    return os.environ.get("SYSLEVEL_PROFILE", "").lower() in {"1", "true"}
+
+
+def is_profiling_enabled() -> bool:
+    return _spans is not None
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    if _spans is None:
+        yield
+        return
+
+    # The peak is measured since the last reset, so the parent's peak so far
+    # is saved before it is reset for this span, and this span's peak is
+    # passed up to the parent when it ends
+    memory, peak = tracemalloc.get_traced_memory()
+    if len(_stack) > 0:
+        _stack[-1]["peak"] = max(_stack[-1]["peak"], peak)
+    _reset_peak()
+
+    frame = {"memory": memory, "peak": memory}
+    _stack.append(frame)
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start
+        cpu_time = time.process_time() - start_cpu
+        peak = max(tracemalloc.get_traced_memory()[1], frame["peak"])
+        _stack.pop()
+        if len(_stack) > 0:
+            _stack[-1]["peak"] = max(_stack[-1]["peak"], peak)
+        _reset_peak()
+
+        _spans.append(
+            {
+                "name": name,
+                "depth": len(_stack),
+                "start": start - _start_time,
+                "wall_time": wall_time,
+                "cpu_time": cpu_time,
+                "peak_memory": peak - frame["memory"],
+            }
+        )
+
+
+def profiled(name: str) -> Callable:
+    # Decorates a function so that each call is recorded as a span
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _spans is None:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def start_worker_profiling() -> None:
+    # Records the spans of a worker process, whose start times are kept
+    # relative to the same clock as the parent's until they are merged
+    global _spans, _start_time
+    _spans = []
+    _stack.clear()
+    _start_time = 0.0
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def pop_worker_spans() -> List[Dict]:
+    spans = list(_spans)
+    _spans.clear()
+    return spans
+
+
+def merge_worker_spans(spans: List[Dict]) -> None:
+    # Adds the spans of a worker process below the current span
+    if _spans is None:
+        return
+    for record in spans:
+        _spans.append(
+            dict(
+                record,
+                depth=record["depth"] + len(_stack),
+                start=record["start"] - _start_time,
+            )
+        )
+
+
+def summarize(spans: List[Dict]) -> Dict[str, Dict]:
+    # Totals the spans with the same name in the order they were first started
+    summary = OrderedDict()
+    for record in sorted(spans, key=lambda record: record["start"]):
+        if record["name"] not in summary:
+            summary[record["name"]] = {
+                "calls": 0,
+                "wall_time": 0.0,
+                "cpu_time": 0.0,
+                "peak_memory": 0,
+            }
+        totals = summary[record["name"]]
+        totals["calls"] += 1
+        totals["wall_time"] += record["wall_time"]
+        totals["cpu_time"] += record["cpu_time"]
+        totals["peak_memory"] = max(totals["peak_memory"], record["peak_memory"])
+    return summary
+
+
+def print_summary(summary: Dict[str, Dict]) -> None:
+    print(
+        f"{'Stage':<32} {'Calls':>6} {'Wall (s)':>9} {'CPU (s)':>9} {'Peak (MB)':>10}"
+    )
+    for name, totals in summary.items():
+        print(
+            f"{name:<32} {totals['calls']:>6} {totals['wall_time']:>9.3f} "
+            f"{totals['cpu_time']:>9.3f} {totals['peak_memory'] / 1e6:>10.1f}"
+        )
+
+
+@contextmanager
+def profile_run(name: str, enabled: bool = False) -> Iterator[None]:
+    # Profiles an entry point if `enabled` or SYSLEVEL_PROFILE is set. The
+    # spans are saved to a JSON trace under `get_profile_dir()` and a summary
+    # of the stages is printed when the run ends.
+    global _spans, _start_time
+    if not enabled and not is_profile_requested():
+        yield
+        return
+
+    _spans = []
+    _start_time = time.perf_counter()
+    tracemalloc.start()
+    try:
+        with span(name):
+            yield
+    finally:
+        tracemalloc.stop()
+        spans = sorted(_spans, key=lambda record: record["start"])
+        _spans = None
+
+        summary = summarize(spans)
+        profile_dir = get_profile_dir()
+        os.makedirs(profile_dir, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        output_file = f"{profile_dir}/{name}-{timestamp}-{os.getpid()}.json"
+        with open(output_file, "w") as out:
+            json.dump({"name": name, "spans": spans, "summary": summary}, out, indent=2)
+
+        print_summary(summary)
+        print(f"Saved profile to {output_file}")
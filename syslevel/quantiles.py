@@ -0,0 +1,167 @@
+import numpy as np
+from typing import List, Optional, Sequence, Union
+
+# The default number of items kept by the top level of a `QuantileSketch`.
+# The rank error of the quantiles is roughly 1.7 / k.
+DEFAULT_K = 200
+
+
+class QuantileSketch:
+    # A mergeable sketch of a stream of values from which the quantiles can be
+    # estimated in O(k) memory (the KLL sketch of Karnin, Lang and Liberty,
+    # 2016). The items in level h each stand for 2^h of the values. Once the
+    # sketch is over capacity, the lowest full level is sorted and every other
+    # item, starting from a random offset, is promoted to the next level. If
+    # `exact` is true, every value is kept and the quantiles are the same as
+    # `np.quantile`'s. Nan values are ignored.
+    def __init__(
+        self,
+        k: int = DEFAULT_K,
+        exact: bool = False,
+        rng: Optional[np.random.Generator] = None,
+    ) -> None:
+        self.k = k
+        self.exact = exact
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self.count = 0
+        self._values: List[np.ndarray] = []
+
+    def _get_capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self) -> None:
+        while sum(map(len, self.levels)) > sum(
+            self._get_capacity(h) for h in range(len(self.levels))
+        ):
+            h = next(
+                h
+                for h in range(len(self.levels))
+                if len(self.levels[h]) > self._get_capacity(h)
+            )
+            if h + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+
+            items = np.sort(self.levels[h])
+            num_compacted = len(items) // 2 * 2
+            offset = self.rng.integers(2)
+            promoted = items[:num_compacted][offset::2]
+            self.levels[h] = items[num_compacted:]
+            self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+
+    def update(self, values: Union[np.ndarray, Sequence[float]]) -> "QuantileSketch":
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        if self.exact:
+            self._values.append(values)
+        else:
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        # Adds the values summarized by `other` to this sketch
+        if self.exact != other.exact:
+            raise ValueError("Cannot merge exact and approximate sketches")
+        self.count += other.count
+        if self.exact:
+            self._values.extend(other._values)
+            return self
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self._compress()
+        return self
+
+    def quantile(self, q: Union[float, Sequence[float]]) -> np.ndarray:
+        q = np.asarray(q, dtype=np.float64)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        if self.exact:
+            return np.quantile(np.concatenate(self._values), q)
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(len(level), 2.0**h) for h, level in enumerate(self.levels)]
+        )
+        order = np.argsort(items, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        index = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+        return items[order][np.minimum(index, len(items) - 1)]
+
+
+class SampleAccumulator:
+    # Accumulates bootstrap samples of `num_rows` quantities (e.g. one score
+    # per system) from batches of (num_rows, iterations) samples, keeping the
+    # count, mean and variance of every row and a `QuantileSketch` of its
+    # samples, so the memory does not grow with the number of iterations.
+    # Accumulators of different iterations, such as those of parallel workers,
+    # can be merged. Nan samples are ignored.
+    def __init__(
+        self,
+        num_rows: int,
+        k: int = DEFAULT_K,
+        exact: bool = False,
+        seed: Optional[int] = None,
+    ) -> None:
+        rng = np.random.default_rng(seed)
+        self.sketches = [QuantileSketch(k, exact, rng) for _ in range(num_rows)]
+        self.counts = np.zeros(num_rows)
+        self.means = np.zeros(num_rows)
+        self.m2s = np.zeros(num_rows)
+
+    def _combine(self, counts: np.ndarray, means: np.ndarray, m2s: np.ndarray) -> None:
+        # Chan et al.'s update of the count, mean and sum of squared deviations
+        total = self.counts + counts
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(total > 0, counts / total, 0.0)
+        delta = means - self.means
+        self.means = self.means + delta * ratio
+        self.m2s = self.m2s + m2s + delta**2 * self.counts * ratio
+        self.counts = total
+
+    def update(self, samples: np.ndarray) -> "SampleAccumulator":
+        is_sampled = ~np.isnan(samples)
+        counts = is_sampled.sum(axis=1).astype(float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = np.where(counts > 0, np.nansum(samples, axis=1) / counts, 0.0)
+        deviations = np.where(is_sampled, samples - means[:, None], 0.0)
+        self._combine(counts, means, np.sum(deviations**2, axis=1))
+
+        for sketch, row in zip(self.sketches, samples):
+            sketch.update(row)
+        return self
+
+    def merge(self, other: "SampleAccumulator") -> "SampleAccumulator":
+        if len(self.sketches) != len(other.sketches):
+            raise ValueError("Cannot merge accumulators with different numbers of rows")
+        self._combine(other.counts, other.means, other.m2s)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        return self
+
+    @property
+    def mean(self) -> np.ndarray:
+        return np.where(self.counts > 0, self.means, np.nan)
+
+    @property
+    def variance(self) -> np.ndarray:
+        # The (ddof=0) variance of every row, as with `np.var`
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.counts > 0, self.m2s / self.counts, np.nan)
+
+    def quantiles(self, q: Sequence[float]) -> np.ndarray:
+        # Returns a (num_rows, len(q)) array
+        return np.stack([sketch.quantile(q) for sketch in self.sketches])
+
+    def get_combined_sketch(self) -> QuantileSketch:
+        # A sketch of the samples of every row together
+        first = self.sketches[0]
+        combined = QuantileSketch(first.k, first.exact, first.rng)
+        for sketch in self.sketches:
+            combined.merge(sketch)
+        return combined
@@ -1,18 +1,35 @@
 import argparse
 import os
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import kendalltau
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
+from syslevel.chunked import ChunkedMatrix
+from syslevel.correlations import batch_kendall_tau
+from syslevel.parallel import (
+    get_default_num_workers,
+    get_shared_array,
+    map_with_shared_arrays,
+)
+from syslevel.profiling import profile_run, profiled, span
+from syslevel.result_cache import memoized
+from syslevel.results import get_results_file, load_results, save_results
+from syslevel.sparse import SparseScores
 from syslevel.util import (
     COLOR_MAP,
     GROUND_TRUTH,
     SMALL_METRICS,
-    load_matrices,
+    load_chunked_scores,
+    load_scores,
+    load_sparse_scores,
     get_dataset_title,
 )
 
+# "replacement" samples the inputs with replacement. "independent" takes the
+# first m inputs of two independent random permutations and "disjoint" the
+# first m inputs of the two halves of one permutation, so both sample without
+# replacement and compute every input size from one cumulative sum.
+SAMPLING_METHODS = ["replacement", "independent", "disjoint"]
+
 
 def get_num_inputs_list(M: int, scale: str) -> Tuple[List[int], List[int]]:
     if scale == "normal":
@@ -31,36 +48,313 @@ def get_num_inputs_list(M: int, scale: str) -> Tuple[List[int], List[int]]:
         return sizes, labels
 
 
-def sample_self_correlation(
-    X: np.ndarray,
+def get_system_means(
+    scores: np.ndarray, is_scored: np.ndarray, columns: np.ndarray
+) -> np.ndarray:
+    # Computes the nan-ignoring system means for every row of input indices in
+    # `columns`, returning a (len(columns), systems) array. `scores` is the
+    # score matrix with nans replaced by 0 and `is_scored` marks the non-nans.
+    sums = scores[:, columns].sum(axis=2).T
+    counts = is_scored[:, columns].sum(axis=2).T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sums / counts
+
+
+def get_prefix_means(
+    scores: np.ndarray,
+    is_scored: np.ndarray,
+    permutations: np.ndarray,
+    num_inputs_list: List[int],
+) -> np.ndarray:
+    # Computes the nan-ignoring system means of the first m inputs in every row
+    # of `permutations` for every m in `num_inputs_list` from the cumulative
+    # sums along the rows. Returns a (len(num_inputs_list), len(permutations),
+    # systems) array.
+    ends = np.asarray(num_inputs_list) - 1
+    sums = np.cumsum(scores[:, permutations], axis=2)[:, :, ends]
+    counts = np.cumsum(is_scored[:, permutations], axis=2)[:, :, ends]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (sums / counts).transpose(2, 1, 0)
+
+
+def _sample_nested_self_correlation(
+    X: Union[np.ndarray, SparseScores],
     num_inputs_list: List[int],
     num_iterations: int,
+    rng: np.random.Generator,
+    disjoint: bool,
+    chunk_size: int,
 ) -> np.ndarray:
     N, M = X.shape
+    max_inputs = M // 2 if disjoint else M
+    L = max(num_inputs_list)
+    if L > max_inputs:
+        raise ValueError(
+            f"Cannot sample {L} inputs without replacement from {max_inputs}"
+        )
+
+    # A `SparseScores` matrix bins its non-nan scores by their positions in
+    # the permutations instead of gathering a dense prefix of every one
+    if isinstance(X, SparseScores):
+        get_means = lambda permutations: X.get_prefix_means(
+            permutations, num_inputs_list
+        )
+        iterations_per_chunk = max(1, chunk_size // (2 * max(X.nnz, M)))
+    else:
+        is_scored = ~np.isnan(X)
+        scores = np.where(is_scored, X, 0.0)
+        get_means = lambda permutations: get_prefix_means(
+            scores, is_scored, permutations, num_inputs_list
+        )
+        iterations_per_chunk = max(1, chunk_size // (2 * N * L))
+
     correlations = np.empty((len(num_inputs_list), num_iterations))
-    for i, m in enumerate(num_inputs_list):
-        for j in range(num_iterations):
-            cols1 = np.random.choice(M, m, replace=True)
-            cols2 = np.random.choice(M, m, replace=True)
-            X_s1 = X[:, cols1]
-            X_s2 = X[:, cols2]
+    for j in range(0, num_iterations, iterations_per_chunk):
+        k = min(j + iterations_per_chunk, num_iterations)
+        # Only the first L inputs of each sample are ever used
+        if disjoint:
+            permutations = rng.random((k - j, M)).argsort(axis=1)
+            permutations = permutations[:, : 2 * max_inputs]
+            permutations = permutations.reshape(k - j, 2, max_inputs)[:, :, :L]
+        else:
+            permutations = rng.random((k - j, 2, M)).argsort(axis=2)[:, :, :L]
+        X_s1_means = get_means(permutations[:, 0])
+        X_s2_means = get_means(permutations[:, 1])
+        for i in range(len(num_inputs_list)):
+            correlations[i, j:k] = batch_kendall_tau(
+                X_s1_means[i], X_s2_means[i], chunk_size
+            )
+
+    return correlations
+
 
-            X_s1_mean = np.nanmean(X_s1, axis=1)
-            X_s2_mean = np.nanmean(X_s2, axis=1)
-            correlations[i, j] = kendalltau(X_s1_mean, X_s2_mean)[0]
+def _sample_chunked_nested_self_correlation(
+    X: ChunkedMatrix,
+    num_inputs_list: List[int],
+    num_iterations: int,
+    rng: np.random.Generator,
+    disjoint: bool,
+    chunk_size: int,
+) -> np.ndarray:
+    # Draws the same permutations as `_sample_nested_self_correlation` but
+    # reads the scores one chunk at a time. Each input is put in the bin of the
+    # smallest input size which includes its position in the permutation, and
+    # the running per-system sums and counts of every bin are added up over
+    # the bins afterwards to get those of every input size.
+    N, M = X.shape
+    max_inputs = M // 2 if disjoint else M
+    L = max(num_inputs_list)
+    if L > max_inputs:
+        raise ValueError(
+            f"Cannot sample {L} inputs without replacement from {max_inputs}"
+        )
+    sizes = np.asarray(num_inputs_list)
+    if np.any(np.diff(sizes) < 0):
+        raise ValueError("The input sizes must be in increasing order")
+    num_bins = len(sizes) + 1
+
+    correlations = np.empty((len(sizes), num_iterations))
+    iterations_per_pass = X.get_iterations_per_pass(
+        6 * 8 * 2 * M + 2 * 8 * 2 * num_bins * N
+    )
+    for j in range(0, num_iterations, iterations_per_pass):
+        k = min(j + iterations_per_pass, num_iterations)
+        if disjoint:
+            permutations = rng.random((k - j, M)).argsort(axis=1)
+            ranks = np.empty_like(permutations)
+            np.put_along_axis(ranks, permutations, np.arange(M)[None], axis=1)
+            positions = np.stack([ranks, ranks - max_inputs], axis=1)
+        else:
+            permutations = rng.random((k - j, 2, M)).argsort(axis=2)
+            positions = np.empty_like(permutations)
+            np.put_along_axis(positions, permutations, np.arange(M)[None, None], axis=2)
+        # The positions which are past the largest size (or before the second
+        # half of a disjoint permutation) go in the last bin, which is unused
+        bins = np.searchsorted(sizes, positions, side="right")
+        bins[positions < 0] = len(sizes)
+
+        offsets = np.arange((k - j) * 2).reshape(k - j, 2, 1) * num_bins
+        sums = np.zeros(((k - j) * 2 * num_bins, N))
+        counts = np.zeros(((k - j) * 2 * num_bins, N))
+        for start, block in X.iter_blocks():
+            is_scored = ~np.isnan(block)
+            scores = np.where(is_scored, block, 0.0)
+            width = block.shape[1]
+            indices = (bins[:, :, start : start + width] + offsets).ravel()
+            for i in range(N):
+                sums[:, i] += np.bincount(
+                    indices, np.tile(scores[i], (k - j) * 2), len(sums)
+                )
+                counts[:, i] += np.bincount(
+                    indices, np.tile(is_scored[i], (k - j) * 2), len(counts)
+                )
+
+        sums = np.cumsum(sums.reshape(k - j, 2, num_bins, N), axis=2)
+        counts = np.cumsum(counts.reshape(k - j, 2, num_bins, N), axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = sums / counts
+        for i in range(len(sizes)):
+            correlations[i, j:k] = batch_kendall_tau(
+                means[:, 0, i], means[:, 1, i], chunk_size
+            )
 
     return correlations
 
 
-def plot(
-    ax,
-    X: np.ndarray,
-    metric: str,
+@profiled("sample_self_correlation")
+def sample_self_correlation(
+    X: Union[np.ndarray, SparseScores, ChunkedMatrix],
     num_inputs_list: List[int],
-    xvalues: List[int],
     num_iterations: int,
-):
-    correlations = sample_self_correlation(X, num_inputs_list, num_iterations)
+    rng: Optional[np.random.Generator] = None,
+    chunk_size: int = 10_000_000,
+    sampling: str = "replacement",
+) -> np.ndarray:
+    # All of the iterations for an input size are sampled together. `chunk_size`
+    # bounds the number of elements in the gathered (systems, iterations, inputs)
+    # arrays. A `SparseScores` matrix is sampled by weighting its non-nan
+    # scores instead. A `ChunkedMatrix` is read one chunk at a time, which only
+    # works without replacement. See `SAMPLING_METHODS` for the `sampling`
+    # options.
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method: {sampling}")
+    if rng is None:
+        rng = np.random.default_rng()
+    if isinstance(X, ChunkedMatrix):
+        if sampling == "replacement":
+            raise ValueError("Out-of-core scores must be sampled without replacement")
+        return _sample_chunked_nested_self_correlation(
+            X,
+            num_inputs_list,
+            num_iterations,
+            rng,
+            sampling == "disjoint",
+            chunk_size,
+        )
+    if sampling != "replacement":
+        return _sample_nested_self_correlation(
+            X,
+            num_inputs_list,
+            num_iterations,
+            rng,
+            sampling == "disjoint",
+            chunk_size,
+        )
+
+    N, M = X.shape
+    if isinstance(X, SparseScores):
+        get_means = X.get_sampled_means
+    else:
+        is_scored = ~np.isnan(X)
+        scores = np.where(is_scored, X, 0.0)
+        get_means = lambda columns: get_system_means(scores, is_scored, columns)
+
+    correlations = np.empty((len(num_inputs_list), num_iterations))
+    for i, m in enumerate(num_inputs_list):
+        if isinstance(X, SparseScores):
+            iterations_per_chunk = max(1, chunk_size // max(X.nnz, M))
+        else:
+            iterations_per_chunk = max(1, chunk_size // (N * m))
+        for j in range(0, num_iterations, iterations_per_chunk):
+            k = min(j + iterations_per_chunk, num_iterations)
+            # Drawing both samples per iteration keeps the results independent
+            # of the chunk size
+            columns = rng.integers(0, M, size=(k - j, 2, m))
+            cols1 = columns[:, 0]
+            cols2 = columns[:, 1]
+            X_s1_mean = get_means(cols1)
+            X_s2_mean = get_means(cols2)
+            correlations[i, j:k] = batch_kendall_tau(X_s1_mean, X_s2_mean, chunk_size)
+
+    return correlations
+
+
+def _sample_self_correlation_task(
+    task: Tuple[
+        Union[Tuple[int, Optional[Tuple[int, int]]], ChunkedMatrix],
+        List[int],
+        int,
+        str,
+        np.random.SeedSequence,
+    ],
+) -> np.ndarray:
+    spec, num_inputs_list, num_iterations, sampling, seed = task
+    if isinstance(spec, ChunkedMatrix):
+        X = spec
+    elif spec[1] is None:
+        X = get_shared_array(spec[0])
+    else:
+        index, shape = spec
+        X = SparseScores(shape, *[get_shared_array(index + k) for k in range(3)])
+    rng = np.random.default_rng(seed)
+    return sample_self_correlation(
+        X, num_inputs_list, num_iterations, rng, sampling=sampling
+    )
+
+
+@profiled("sample_self_correlations")
+@memoized("sample_self_correlations", ignore=("num_workers",))
+def sample_self_correlations(
+    Xs: List[Union[np.ndarray, SparseScores, ChunkedMatrix]],
+    num_inputs_lists: List[List[int]],
+    num_iterations: int,
+    seed: Optional[int] = None,
+    num_workers: int = 1,
+    iterations_per_task: int = 250,
+    sampling: str = "replacement",
+) -> List[np.ndarray]:
+    # Runs `sample_self_correlation` for every matrix in `Xs` with the
+    # corresponding list of input sizes. The work is split into one task per
+    # (matrix, input size, chunk of iterations), and each task gets its own
+    # random stream spawned from `seed`, so the results do not depend on
+    # `num_workers`. Sampling without replacement computes all of the input
+    # sizes at once, so it has one task per (matrix, chunk of iterations).
+    arrays = []
+    specs = []
+    for X in Xs:
+        # A sparse matrix is shared as its three arrays and a chunked matrix
+        # is read from its files by every task
+        if isinstance(X, ChunkedMatrix):
+            specs.append(X)
+        elif isinstance(X, SparseScores):
+            specs.append((len(arrays), X.shape))
+            arrays.extend([X.indptr, X.indices, X.data])
+        else:
+            specs.append((len(arrays), None))
+            arrays.append(X)
+
+    # Every task fills the rows `rows` of the matrix's correlations starting
+    # at iteration `start`
+    tasks = []
+    locations = []
+    for index, (spec, num_inputs_list) in enumerate(zip(specs, num_inputs_lists)):
+        if sampling == "replacement":
+            groups = [[i] for i in range(len(num_inputs_list))]
+        else:
+            groups = [list(range(len(num_inputs_list)))]
+        for rows in groups:
+            sizes = [num_inputs_list[i] for i in rows]
+            for start in range(0, num_iterations, iterations_per_task):
+                count = min(iterations_per_task, num_iterations - start)
+                tasks.append((spec, sizes, count, sampling))
+                locations.append((index, rows, start))
+
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    tasks = [task + (task_seed,) for task, task_seed in zip(tasks, seeds)]
+    results = map_with_shared_arrays(
+        _sample_self_correlation_task, tasks, arrays, num_workers
+    )
+
+    correlations_list = [
+        np.empty((len(num_inputs_list), num_iterations))
+        for num_inputs_list in num_inputs_lists
+    ]
+    for (index, rows, start), chunk in zip(locations, results):
+        correlations_list[index][rows, start : start + chunk.shape[1]] = chunk
+    return correlations_list
+
+
+def plot(ax, correlations: np.ndarray, metric: str, xvalues: List[int]):
     mean = np.mean(correlations, axis=1)
     std = np.std(correlations, axis=1)
 
@@ -69,34 +363,76 @@ def plot(
     return line
 
 
-def main(args):
+def compute(args) -> Dict:
     num_iterations = 1000
-    fontsize = 16
 
-    plt.rcParams.update({"font.size": fontsize})
-
-    Xs_all, _ = load_matrices(args.all_metrics_jsonl, False, SMALL_METRICS)
-    Xs_judged, _ = load_matrices(
+    if args.out_of_core:
+        scores_all = load_chunked_scores(args.all_metrics_jsonl, args.memory_budget_mb)
+    elif args.sparse:
+        scores_all = load_sparse_scores(args.all_metrics_jsonl, False, SMALL_METRICS)
+    else:
+        scores_all = load_scores(args.all_metrics_jsonl, False, SMALL_METRICS)
+    scores_judged = load_scores(
         args.judged_metrics_jsonl, True, [GROUND_TRUTH] + SMALL_METRICS
     )
+    if args.out_of_core:
+        Xs_all = [scores_all[metric] for metric in SMALL_METRICS]
+    else:
+        Xs_all = scores_all.get_matrices()
+    Xs_judged = scores_judged.get_matrices()
+
+    # The disjoint samples can each use at most half of the inputs
+    max_fraction = 2 if args.sampling == "disjoint" else 1
+
+    _, N, M_judged = scores_judged.shape
+    num_inputs_judged, xlabels_judged = get_num_inputs_list(
+        M_judged // max_fraction, "normal"
+    )
+
+    M_all = scores_all.shape[2]
+    num_inputs_list_all, xlabels_all = get_num_inputs_list(M_all // max_fraction, "log")
+
+    correlations_list = sample_self_correlations(
+        Xs_judged + Xs_all,
+        [num_inputs_judged] * len(Xs_judged) + [num_inputs_list_all] * len(Xs_all),
+        num_iterations,
+        seed=args.seed,
+        num_workers=args.workers,
+        sampling=args.sampling,
+    )
+    correlations_judged = correlations_list[: len(Xs_judged)]
+    correlations_all = correlations_list[len(Xs_judged) :]
+
+    results = {
+        "dataset": args.dataset,
+        "xlabels_judged": [float(label) for label in xlabels_judged],
+        "xlabels_all": [float(label) for label in xlabels_all],
+    }
+    for metric, correlations in zip(
+        [GROUND_TRUTH] + SMALL_METRICS, correlations_judged
+    ):
+        results[f"judged/{metric}"] = correlations
+    for metric, correlations in zip(SMALL_METRICS, correlations_all):
+        results[f"all/{metric}"] = correlations
+    return results
 
-    N, M_judged = Xs_judged[0].shape
-    num_inputs_judged, xlabels_judged = get_num_inputs_list(M_judged, "normal")
 
-    M_all = Xs_all[0].shape[1]
-    num_inputs_list_all, xlabels_all = get_num_inputs_list(M_all, "log")
+def render(results: Dict, output_file: str) -> None:
+    import matplotlib.pyplot as plt
+
+    fontsize = 16
+    plt.rcParams.update({"font.size": fontsize})
 
     fig, (ax1, ax2) = plt.subplots(1, 2, sharey=True, figsize=(8, 4.5))
 
     lines = []
-    for metric, X_jud in zip([GROUND_TRUTH] + SMALL_METRICS, Xs_judged):
-        line = plot(
-            ax1, X_jud, metric, num_inputs_judged, xlabels_judged, num_iterations
-        )
+    for metric in [GROUND_TRUTH] + SMALL_METRICS:
+        correlations = results[f"judged/{metric}"]
+        line = plot(ax1, correlations, metric, results["xlabels_judged"])
         lines.append(line)
 
-    for metric, X_all in zip(SMALL_METRICS, Xs_all):
-        plot(ax2, X_all, metric, num_inputs_list_all, xlabels_all, num_iterations)
+    for metric in SMALL_METRICS:
+        plot(ax2, results[f"all/{metric}"], metric, results["xlabels_all"])
 
     ax1.grid()
     ax1.set_xticks([20, 40, 60, 80, 100])
@@ -112,22 +448,57 @@ def main(args):
     ax2.set_xlabel("log(#Instances)", fontsize=fontsize)
     ax2.yaxis.set_tick_params(labelleft=False)
 
-    title = get_dataset_title(args.dataset)
+    title = get_dataset_title(results["dataset"])
     plt.suptitle(title, y=0.95, fontsize=fontsize)
     plt.tight_layout(pad=0.5)
 
-    os.makedirs(args.output_dir, exist_ok=True)
-    output_file = f"{args.output_dir}/{args.dataset}.pdf"
+    dirname = os.path.dirname(output_file)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
     print(f"Saving plot to {output_file}")
     plt.savefig(output_file)
     plt.close()
 
 
+def main(args):
+    output_file = f"{args.output_dir}/{args.dataset}.pdf"
+    results_file = args.results_file or get_results_file(output_file)
+    if args.render_only:
+        results = load_results(results_file)
+    else:
+        results = compute(args)
+        save_results(results_file, results)
+
+    if not args.compute_only:
+        with span("plot"):
+            render(results, output_file)
+
+
 if __name__ == "__main__":
     argp = argparse.ArgumentParser()
-    argp.add_argument("--all-metrics-jsonl", required=True)
-    argp.add_argument("--judged-metrics-jsonl", required=True)
+    argp.add_argument("--all-metrics-jsonl")
+    argp.add_argument("--judged-metrics-jsonl")
     argp.add_argument("--dataset", required=True)
     argp.add_argument("--output-dir", required=True)
+    argp.add_argument("--seed", type=int)
+    argp.add_argument("--workers", type=int, default=get_default_num_workers())
+    argp.add_argument("--sparse", action="store_true")
+    argp.add_argument("--out-of-core", action="store_true")
+    argp.add_argument("--memory-budget-mb", type=float)
+    argp.add_argument("--sampling", choices=SAMPLING_METHODS, default="replacement")
+    argp.add_argument("--results-file")
+    stages = argp.add_mutually_exclusive_group()
+    stages.add_argument("--compute-only", action="store_true")
+    stages.add_argument("--render-only", action="store_true")
+    argp.add_argument("--profile", action="store_true")
     args = argp.parse_args()
-    main(args)
+    if not args.render_only and (
+        args.all_metrics_jsonl is None or args.judged_metrics_jsonl is None
+    ):
+        argp.error("the metrics files are required unless --render-only is used")
+    if args.out_of_core and args.sampling == "replacement":
+        argp.error("--out-of-core requires --sampling independent or disjoint")
+    if args.out_of_core and args.sparse:
+        argp.error("--out-of-core and --sparse cannot be used together")
+    with profile_run("ranking_stability", args.profile):
+        main(args)
@@ -0,0 +1,207 @@
+import argparse
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+import time
+import numpy as np
+from typing import Any, Callable, List, Optional, Tuple
+
+from syslevel.cache import get_cache_dir, is_cache_enabled
+
+RESULT_CACHE_VERSION = 1
+
+# The results of the expensive analysis functions are cached on disk, keyed
+# on a hash of the function's name and every argument, including the contents
+# of the arrays and the state of the random generators. Entries are evicted in
+# least-recently-used order once the cache is larger than
+# SYSLEVEL_RESULT_CACHE_MAX_MB.
+DEFAULT_MAX_MB = 2048
+
+
+def get_result_cache_dir() -> str:
+    return os.path.join(get_cache_dir(), f"results-v{RESULT_CACHE_VERSION}")
+
+
+def get_max_size() -> int:
+    return int(
+        float(os.environ.get("SYSLEVEL_RESULT_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1e6
+    )
+
+
+def _update_hash(sha, value: Any) -> None:
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        sha.update(f"ndarray:{value.dtype.str}:{value.shape}:".encode())
+        sha.update(value.data)
+    elif isinstance(value, np.random.Generator):
+        state = value.bit_generator.state
+        sha.update(f"generator:{json.dumps(state, sort_keys=True)}".encode())
+    elif isinstance(value, (list, tuple)):
+        sha.update(f"{type(value).__name__}:{len(value)}:".encode())
+        for item in value:
+            _update_hash(sha, item)
+    elif isinstance(value, dict):
+        sha.update(f"dict:{len(value)}:".encode())
+        for key in sorted(value):
+            _update_hash(sha, key)
+            _update_hash(sha, value[key])
+    elif value is None or isinstance(value, (bool, int, float, str, np.generic)):
+        sha.update(f"{type(value).__name__}:{value!r};".encode())
+    elif hasattr(value, "__dict__"):
+        # Objects such as `SparseScores` are hashed by their attributes
+        sha.update(f"object:{type(value).__qualname__}:".encode())
+        _update_hash(sha, vars(value))
+    else:
+        raise TypeError(f"Cannot hash argument of type {type(value)}")
+
+
+def get_key(name: str, arguments: List[Tuple[str, Any]]) -> str:
+    sha = hashlib.sha256()
+    sha.update(f"{name}:{RESULT_CACHE_VERSION};".encode())
+    for argument, value in arguments:
+        sha.update(f"{argument}=".encode())
+        _update_hash(sha, value)
+    return sha.hexdigest()
+
+
+def _get_generators(arguments: List[Tuple[str, Any]]) -> List[np.random.Generator]:
+    return [value for _, value in arguments if isinstance(value, np.random.Generator)]
+
+
+def _write_atomic(path: str, data: Any) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as out:
+        pickle.dump(data, out, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def list_entries() -> List[Tuple[str, int, float]]:
+    # Returns the (path, size, last used time) of every entry, least recently
+    # used first
+    cache_dir = get_result_cache_dir()
+    if not os.path.exists(cache_dir):
+        return []
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith(".pkl"):
+            continue
+        path = os.path.join(cache_dir, filename)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((path, stat.st_size, stat.st_mtime))
+    entries.sort(key=lambda entry: entry[2])
+    return entries
+
+
+def evict(max_size: int) -> None:
+    entries = list_entries()
+    total_size = sum(size for _, size, _ in entries)
+    for path, size, _ in entries:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def clear(name: Optional[str] = None) -> int:
+    # Removes every entry, or only those of the function `name`
+    num_removed = 0
+    for path, _, _ in list_entries():
+        if name is None or os.path.basename(path).startswith(f"{name}-"):
+            os.remove(path)
+            num_removed += 1
+    return num_removed
+
+
+def memoized(name: str, ignore: Tuple[str, ...] = ()) -> Callable:
+    # Decorates a function so that its results are cached. The arguments in
+    # `ignore` do not change the result, so they are left out of the key.
+    # Calls without a seed (an `rng` or `seed` argument which is None) are
+    # not cached, so callers should pass None rather than a generator which
+    # was not seeded, whose results could never be looked up again. On a cache
+    # hit, the random generators which were passed in are advanced to the
+    # state they would have been in after the call, so the following calls
+    # draw the same numbers whether or not the result was cached.
+    def decorator(function: Callable) -> Callable:
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not is_cache_enabled():
+                return function(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = [
+                (argument, value)
+                for argument, value in bound.arguments.items()
+                if argument not in ignore
+            ]
+            if any(
+                argument in {"rng", "seed"} and value is None
+                for argument, value in arguments
+            ):
+                return function(*args, **kwargs)
+
+            path = os.path.join(
+                get_result_cache_dir(), f"{name}-{get_key(name, arguments)}.pkl"
+            )
+            generators = _get_generators(arguments)
+            try:
+                with open(path, "rb") as f:
+                    result, states = pickle.load(f)
+                for generator, state in zip(generators, states):
+                    generator.bit_generator.state = state
+                os.utime(path)
+                return result
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+
+            result = function(*args, **kwargs)
+            states = [generator.bit_generator.state for generator in generators]
+            _write_atomic(path, (result, states))
+            evict(get_max_size())
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def main(args):
+    if args.command == "list":
+        entries = list_entries()
+        print(f"{'Entry':<32} {'Size (MB)':>10} {'Last used':>20}")
+        for path, size, last_used in reversed(entries):
+            filename = os.path.basename(path)
+            name, key = filename[: -len(".pkl")].rsplit("-", 1)
+            last_used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_used))
+            print(f"{name + '-' + key[:8]:<32} {size / 1e6:>10.2f} {last_used:>20}")
+        total_size = sum(size for _, size, _ in entries)
+        print(
+            f"{len(entries)} entries, {total_size / 1e6:.2f} MB of "
+            f"{get_max_size() / 1e6:.0f} MB in {get_result_cache_dir()}"
+        )
+    else:
+        num_removed = clear(args.name)
+        print(f"Removed {num_removed} entries")
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser()
+    subparsers = argp.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list")
+    clear_parser = subparsers.add_parser("clear")
+    clear_parser.add_argument("--name")
+    args = argp.parse_args()
+    main(args)
@@ -0,0 +1,40 @@
+import json
+import os
+import numpy as np
+from typing import Any, Dict
+
+# The results of an experiment's compute stage are saved as an `.npz` file so
+# that they can be plotted again without recomputing them. The arrays are
+# stored as members of the file and every other value (numbers, strings and
+# lists of them) in a JSON member.
+METADATA_KEY = "__metadata__"
+
+
+def get_results_file(output_file: str) -> str:
+    # The default results file for a plot saved to `output_file`
+    return os.path.splitext(output_file)[0] + ".npz"
+
+
+def save_results(output_file: str, results: Dict[str, Any]) -> None:
+    if not output_file.endswith(".npz"):
+        raise ValueError(f"Results file must end in .npz: {output_file}")
+
+    arrays = {}
+    metadata = {}
+    for key, value in results.items():
+        if isinstance(value, np.ndarray):
+            arrays[key] = value
+        else:
+            metadata[key] = value
+
+    dirname = os.path.dirname(output_file)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    np.savez(output_file, **{METADATA_KEY: np.array(json.dumps(metadata))}, **arrays)
+
+
+def load_results(input_file: str) -> Dict[str, Any]:
+    with np.load(input_file) as f:
+        results = {key: f[key] for key in f.files if key != METADATA_KEY}
+        results.update(json.loads(str(f[METADATA_KEY])))
+    return results
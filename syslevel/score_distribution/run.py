@@ -1,24 +1,35 @@
 import argparse
 import os
-import matplotlib.pyplot as plt
 import numpy as np
+from typing import Dict
 
-from syslevel.util import COLOR_MAP, GROUND_TRUTH, SMALL_METRICS, load_matrices
+from syslevel.profiling import profile_run, span
+from syslevel.results import get_results_file, load_results, save_results
+from syslevel.util import COLOR_MAP, GROUND_TRUTH, SMALL_METRICS, load_scores
 
 
-def main(args):
-    fontsize = 14
+def compute(args) -> Dict:
+    metrics = [GROUND_TRUTH] + SMALL_METRICS
+    scores = load_scores(args.metrics_jsonl, False, metrics)
 
-    plt.rcParams.update({"font.size": fontsize})
+    results = {"metrics": metrics}
+    for metric in metrics:
+        results[metric] = scores.get_means(metric)
+    return results
 
-    metrics = [GROUND_TRUTH] + SMALL_METRICS
-    Xs, _ = load_matrices(args.metrics_jsonl, False, metrics)
 
+def render(results: Dict, output_file: str) -> None:
+    import matplotlib.pyplot as plt
+
+    fontsize = 14
+    plt.rcParams.update({"font.size": fontsize})
+
+    metrics = results["metrics"]
     fig, axes = plt.subplots(len(metrics), 1)
-    for i, (ax, metric, X) in enumerate(zip(axes, metrics, Xs)):
+    for i, (ax, metric) in enumerate(zip(axes, metrics)):
         name = metric if metric != GROUND_TRUTH else "Human Judgment"
 
-        scores = np.nanmean(X, axis=1)
+        scores = results[metric]
 
         ax.scatter(scores, [1] * len(scores), label=name, color=COLOR_MAP[metric])
         ax.text(
@@ -37,13 +48,34 @@ def main(args):
     axes[-1].set_xlabel("Metric Value")
 
     plt.tight_layout(pad=0, h_pad=1.5)
-    os.makedirs(os.path.dirname(args.output_file), exist_ok=True)
-    plt.savefig(args.output_file)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    plt.savefig(output_file)
+
+
+def main(args):
+    results_file = args.results_file or get_results_file(args.output_file)
+    if args.render_only:
+        results = load_results(results_file)
+    else:
+        results = compute(args)
+        save_results(results_file, results)
+
+    if not args.compute_only:
+        with span("plot"):
+            render(results, args.output_file)
 
 
 if __name__ == "__main__":
     argp = argparse.ArgumentParser()
-    argp.add_argument("--metrics-jsonl", required=True)
+    argp.add_argument("--metrics-jsonl")
     argp.add_argument("--output-file", required=True)
+    argp.add_argument("--results-file")
+    stages = argp.add_mutually_exclusive_group()
+    stages.add_argument("--compute-only", action="store_true")
+    stages.add_argument("--render-only", action="store_true")
+    argp.add_argument("--profile", action="store_true")
     args = argp.parse_args()
-    main(args)
+    if not args.render_only and args.metrics_jsonl is None:
+        argp.error("--metrics-jsonl is required unless --render-only is used")
+    with profile_run("score_distribution", args.profile):
+        main(args)
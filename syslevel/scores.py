@@ -0,0 +1,162 @@
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class ScoreTensor:
+    # The scores of every metric as a (metrics, systems, inputs) array in which
+    # nan marks a missing score, with dicts which map the metric names,
+    # summarizer IDs and instance IDs to their indices. `scores` may also be a
+    # larger array, such as the memory-mapped cache of every metric in a file,
+    # with `metric_indices` giving each metric's index into it, so that the
+    # metrics' matrices are views of it instead of copies. The per-system
+    # counts, sums and means are computed once for all of the metrics when they
+    # are first used. The scores should not be modified in place.
+    def __init__(
+        self,
+        scores: np.ndarray,
+        metrics: List[str],
+        system_ids: List[str],
+        input_ids: List[str],
+        metric_indices: Optional[List[int]] = None,
+    ) -> None:
+        num_metrics = len(metrics) if metric_indices is None else len(scores)
+        if scores.shape != (num_metrics, len(system_ids), len(input_ids)):
+            raise ValueError(
+                f"Scores of shape {scores.shape} do not match the "
+                f"{num_metrics} metrics, {len(system_ids)} systems and "
+                f"{len(input_ids)} inputs"
+            )
+        if metric_indices is None:
+            metric_indices = range(len(metrics))
+        elif len(metric_indices) != len(metrics):
+            raise ValueError(
+                f"{len(metric_indices)} metric indices do not match the "
+                f"{len(metrics)} metrics"
+            )
+        self.base = scores
+        self.metric_indices = np.asarray(metric_indices, dtype=int)
+        self.metrics = list(metrics)
+        self.system_ids = list(system_ids)
+        self.input_ids = list(input_ids)
+        self.metric_to_index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.system_to_index = {id_: i for i, id_ in enumerate(self.system_ids)}
+        self.input_to_index = {id_: i for i, id_ in enumerate(self.input_ids)}
+        self._cache = {}
+
+    @staticmethod
+    def from_matrices(
+        metric_to_matrix: Dict[str, np.ndarray],
+        metrics: List[str],
+        system_ids: List[str],
+        input_ids: List[str],
+    ) -> "ScoreTensor":
+        # The metrics which are not in `metric_to_matrix` are all nan
+        scores = np.full((len(metrics), len(system_ids), len(input_ids)), np.nan)
+        for i, metric in enumerate(metrics):
+            if metric in metric_to_matrix:
+                scores[i] = metric_to_matrix[metric]
+        return ScoreTensor(scores, metrics, system_ids, input_ids)
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return len(self.metrics), len(self.system_ids), len(self.input_ids)
+
+    @property
+    def scores(self) -> np.ndarray:
+        # The (metrics, systems, inputs) array, which is only gathered from the
+        # base array (on first use) if the metrics are not all of it in order
+        if "scores" not in self._cache:
+            if np.array_equal(self.metric_indices, np.arange(len(self.base))):
+                self._cache["scores"] = self.base
+            else:
+                self._cache["scores"] = self.base[self.metric_indices]
+        return self._cache["scores"]
+
+    def __getitem__(self, metric: str) -> np.ndarray:
+        # The (systems, inputs) matrix of `metric`, which is a view of the scores
+        return self.base[self.metric_indices[self.metric_to_index[metric]]]
+
+    def get_matrices(self, metrics: Optional[List[str]] = None) -> List[np.ndarray]:
+        metrics = self.metrics if metrics is None else metrics
+        return [self[metric] for metric in metrics]
+
+    def _reduce(self, function) -> np.ndarray:
+        # Applies `function` to every metric's matrix one at a time, so that no
+        # temporary array is larger than one matrix
+        return np.array([function(self[metric]) for metric in self.metrics]).reshape(
+            self.shape[:2]
+        )
+
+    @property
+    def counts(self) -> np.ndarray:
+        # The (metrics, systems) number of non-nan scores
+        if "counts" not in self._cache:
+            self._cache["counts"] = self._reduce(lambda X: np.sum(~np.isnan(X), axis=1))
+        return self._cache["counts"]
+
+    @property
+    def sums(self) -> np.ndarray:
+        # The (metrics, systems) sums of the non-nan scores
+        if "sums" not in self._cache:
+            self._cache["sums"] = self._reduce(lambda X: np.nansum(X, axis=1))
+        return self._cache["sums"]
+
+    @property
+    def means(self) -> np.ndarray:
+        # The (metrics, systems) nan-ignoring system-level scores
+        if "means" not in self._cache:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self._cache["means"] = self.sums / self.counts
+        return self._cache["means"]
+
+    def get_means(self, metric: str) -> np.ndarray:
+        return self.means[self.metric_to_index[metric]]
+
+    def get_system_indices(self, system_ids: Iterable[str]) -> np.ndarray:
+        return np.array([self.system_to_index[id_] for id_ in system_ids], dtype=int)
+
+    def get_input_indices(self, input_ids: Iterable[str]) -> np.ndarray:
+        return np.array([self.input_to_index[id_] for id_ in input_ids], dtype=int)
+
+    def subset(
+        self,
+        metrics: Optional[List[str]] = None,
+        system_ids: Optional[List[str]] = None,
+        input_ids: Optional[List[str]] = None,
+    ) -> "ScoreTensor":
+        # Selects (and orders) the given metrics, systems and inputs, keeping
+        # all of them along the axes which are None
+        metrics = self.metrics if metrics is None else metrics
+        system_ids = self.system_ids if system_ids is None else system_ids
+        input_ids = self.input_ids if input_ids is None else input_ids
+        metric_indices = self.metric_indices[
+            [self.metric_to_index[metric] for metric in metrics]
+        ]
+        scores = self.base[
+            np.ix_(
+                metric_indices,
+                self.get_system_indices(system_ids),
+                self.get_input_indices(input_ids),
+            )
+        ]
+        return ScoreTensor(scores, metrics, system_ids, input_ids)
+
+    def align(self, other: "ScoreTensor") -> "ScoreTensor":
+        # Orders the metrics and systems the same as `other`, which must have
+        # the same ones. The inputs are kept.
+        if set(self.metrics) != set(other.metrics):
+            raise ValueError("Cannot align score tensors with different metrics")
+        if set(self.system_ids) != set(other.system_ids):
+            raise ValueError("Cannot align score tensors with different systems")
+        return self.subset(metrics=other.metrics, system_ids=other.system_ids)
+
+    def intersect(self, other: "ScoreTensor") -> Tuple["ScoreTensor", "ScoreTensor"]:
+        # Keeps the metrics and systems which both tensors have, in this
+        # tensor's order, such as to compare the judged and all splits. The
+        # inputs are kept.
+        metrics = [metric for metric in self.metrics if metric in other.metric_to_index]
+        system_ids = [id_ for id_ in self.system_ids if id_ in other.system_to_index]
+        return (
+            self.subset(metrics=metrics, system_ids=system_ids),
+            other.subset(metrics=metrics, system_ids=system_ids),
+        )
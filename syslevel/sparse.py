@@ -0,0 +1,170 @@
+import numpy as np
+from typing import Dict, Iterable, List, Tuple
+
+
+class SparseScores:
+    # Stores a (systems, inputs) score matrix in which most cells may be nan
+    # in compressed sparse row form: the non-nan scores of system i are
+    # `data[indptr[i]:indptr[i + 1]]` at the input indices in the same slice
+    # of `indices`, in increasing order. The number and sum of every system's
+    # scores are precomputed.
+    def __init__(
+        self,
+        shape: Tuple[int, int],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+    ) -> None:
+        self.shape = tuple(shape)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+        self.counts = np.diff(self.indptr)
+
+        self.sums = np.zeros(self.shape[0])
+        nonempty = self.counts > 0
+        if nonempty.any():
+            starts = self.indptr[:-1][nonempty]
+            self.sums[nonempty] = np.add.reduceat(self.data, starts)
+
+    @staticmethod
+    def from_dense(X: np.ndarray) -> "SparseScores":
+        is_scored = ~np.isnan(X)
+        indptr = np.concatenate([[0], np.cumsum(is_scored.sum(axis=1))])
+        rows, indices = np.nonzero(is_scored)
+        return SparseScores(X.shape, indptr, indices, X[rows, indices])
+
+    @staticmethod
+    def from_triples(
+        shape: Tuple[int, int],
+        rows: np.ndarray,
+        columns: np.ndarray,
+        values: np.ndarray,
+    ) -> "SparseScores":
+        # Builds the matrix from (row, column, value) triples without a dense
+        # step. Like scattering them into a nan matrix, the last triple of a
+        # cell wins and nan values are missing scores.
+        order = np.lexsort((columns, rows))
+        rows, columns, values = rows[order], columns[order], values[order]
+        is_last = np.ones(len(rows), dtype=bool)
+        is_last[:-1] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+        keep = is_last & ~np.isnan(values)
+        rows, columns, values = rows[keep], columns[keep], values[keep]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=shape[0]))])
+        return SparseScores(shape, indptr, columns, values)
+
+    def to_dense(self) -> np.ndarray:
+        X = np.full(self.shape, np.nan)
+        rows = np.repeat(np.arange(self.shape[0]), self.counts)
+        X[rows, self.indices] = self.data
+        return X
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+    def get_row(self, i: int) -> np.ndarray:
+        return self.data[self.indptr[i] : self.indptr[i + 1]]
+
+    def get_means(self) -> np.ndarray:
+        # The nan-ignoring system means
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sums / self.counts
+
+    def get_sums_of_squares(self) -> np.ndarray:
+        sums_of_squares = np.zeros(self.shape[0])
+        nonempty = self.counts > 0
+        if nonempty.any():
+            starts = self.indptr[:-1][nonempty]
+            sums_of_squares[nonempty] = np.add.reduceat(self.data**2, starts)
+        return sums_of_squares
+
+    def get_sampled_means(self, columns: np.ndarray) -> np.ndarray:
+        # Computes the nan-ignoring system means for every row of input indices
+        # in `columns`, returning a (len(columns), systems) array. Only the
+        # non-nan scores are touched, weighted by the number of times their
+        # input was sampled.
+        k = len(columns)
+        n = self.shape[1]
+        offsets = np.arange(k)[:, None] * n
+        weights = np.bincount((columns + offsets).ravel(), minlength=k * n)
+        weights = weights.reshape(k, n).astype(float)[:, self.indices]
+
+        sums = np.zeros((k, self.shape[0]))
+        counts = np.zeros((k, self.shape[0]))
+        nonempty = self.counts > 0
+        if nonempty.any():
+            starts = self.indptr[:-1][nonempty]
+            sums[:, nonempty] = np.add.reduceat(weights * self.data, starts, axis=1)
+            counts[:, nonempty] = np.add.reduceat(weights, starts, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return sums / counts
+
+    def get_prefix_means(
+        self, permutations: np.ndarray, num_inputs_list: List[int]
+    ) -> np.ndarray:
+        # Computes the nan-ignoring system means of the first m inputs in every
+        # row of `permutations` for every m in `num_inputs_list`, returning a
+        # (len(num_inputs_list), len(permutations), systems) array. Every
+        # non-nan score is added to the bin of the smallest m which includes
+        # its input, and the bins are summed cumulatively.
+        k, L = permutations.shape
+        N, M = self.shape
+        order = np.argsort(num_inputs_list)
+        sizes = np.asarray(num_inputs_list)[order]
+        num_bins = len(sizes) + 1
+
+        # The inputs which are not in the first L of a permutation are put in
+        # the last bin, which is not used
+        input_bins = np.full((k, M), len(sizes))
+        position_bins = np.searchsorted(sizes, np.arange(L), side="right")
+        np.put_along_axis(input_bins, permutations, position_bins[None], axis=1)
+
+        rows = np.repeat(np.arange(N), self.counts)
+        offsets = np.arange(k)[:, None] * num_bins
+        indices = ((input_bins[:, self.indices] + offsets) * N + rows).ravel()
+        sums = np.bincount(indices, np.tile(self.data, k), k * num_bins * N)
+        counts = np.bincount(indices, minlength=k * num_bins * N)
+        sums = np.cumsum(sums.reshape(k, num_bins, N), axis=1)
+        counts = np.cumsum(counts.reshape(k, num_bins, N), axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = (sums / counts)[:, : len(sizes)].transpose(1, 0, 2)
+        return means[np.argsort(order)]
+
+
+class SparseScoreTensor:
+    # The `SparseScores` of every metric with the same systems and inputs.
+    # Like `ScoreTensor`, indexing by a metric returns its matrix.
+    def __init__(
+        self,
+        metric_to_matrix: Dict[str, SparseScores],
+        metrics: List[str],
+        system_ids: List[str],
+        input_ids: List[str],
+    ) -> None:
+        shape = (len(system_ids), len(input_ids))
+        for metric in metrics:
+            if metric_to_matrix[metric].shape != shape:
+                raise ValueError(
+                    f"The {metric} matrix of shape {metric_to_matrix[metric].shape} "
+                    f"does not match the {shape[0]} systems and {shape[1]} inputs"
+                )
+        self.matrices = [metric_to_matrix[metric] for metric in metrics]
+        self.metrics = list(metrics)
+        self.system_ids = list(system_ids)
+        self.input_ids = list(input_ids)
+        self.metric_to_index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.system_to_index = {id_: i for i, id_ in enumerate(self.system_ids)}
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return len(self.metrics), len(self.system_ids), len(self.input_ids)
+
+    def __getitem__(self, metric: str) -> SparseScores:
+        return self.matrices[self.metric_to_index[metric]]
+
+    def get_matrices(self) -> List[SparseScores]:
+        return list(self.matrices)
+
+    def get_system_indices(self, system_ids: Iterable[str]) -> np.ndarray:
+        return np.array([self.system_to_index[id_] for id_ in system_ids], dtype=int)
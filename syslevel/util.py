@@ -1,13 +1,44 @@
-import gzip
-import json
+import atexit
+import os
+import shutil
+import tempfile
 import numpy as np
-from typing import Dict, List, Tuple
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from syslevel.cache import (
+    Matrices,
+    Scores,
+    SparseMatrices,
+    get_cache_dir,
+    get_content_hash,
+    is_cache_enabled,
+    load_cached_scores,
+    load_cached_sparse_scores,
+)
+from syslevel.chunked import (
+    CHUNKED_VERSION,
+    ChunkedMatrix,
+    ChunkedScores,
+    ScoreBatch,
+    bootstrap_chunked_system_scores,
+    get_memory_budget,
+    write_chunked_scores,
+)
+from syslevel.jsonl import ColumnBatch, make_column_batch, read_column_batches
+from syslevel.profiling import profiled
+from syslevel.result_cache import memoized
+from syslevel.scores import ScoreTensor
+from syslevel.sparse import SparseScores, SparseScoreTensor
 
 METRICS = ["ROUGE-1", "ROUGE-2", "ROUGE-L", "BERTScore", "QAEval"]
 SMALL_METRICS = ["ROUGE-1", "BERTScore", "QAEval"]
 ROUGE_METRICS = ["ROUGE-1", "ROUGE-2", "ROUGE-L"]
 GROUND_TRUTH = "ground-truth"
 
+# (system indices, input indices, values) of one metric's scores
+Triples = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
 COLOR_MAP = {
     "ROUGE-1": "#ed5564",
     "ROUGE-2": "#ff965a",
@@ -18,68 +49,357 @@ COLOR_MAP = {
 }
 
 
-def _get_value(metrics_dict: Dict, key: Tuple[str, str], metric: str) -> float:
-    value = metrics_dict[key][metric]
-    if isinstance(value, list):
-        return np.mean(value)
-    return value
+def _get_ranks(id_to_index: Dict[str, int], sorted_ids: List[str]) -> np.ndarray:
+    # Maps the index each ID was interned with to its position in `sorted_ids`
+    ranks = np.empty(len(sorted_ids), dtype=np.int64)
+    ranks[[id_to_index[id_] for id_ in sorted_ids]] = np.arange(len(sorted_ids))
+    return ranks
 
 
-def load_matrices(
-    input_file: str, require_parallel: bool, metrics: List[str]
-) -> Tuple[List[np.ndarray], List[str]]:
-    instance_ids = set()
+def _intern(ids: List[str], id_to_index: Dict[str, int]) -> np.ndarray:
+    return np.array(
+        [id_to_index.setdefault(id_, len(id_to_index)) for id_ in ids], dtype=np.int64
+    )
+
+
+def _batch_instances(
+    instances: Iterable[Dict], batch_size: int = 10000
+) -> Iterator[ColumnBatch]:
+    batch = []
+    for instance in instances:
+        batch.append(instance)
+        if len(batch) == batch_size:
+            yield make_column_batch(batch)
+            batch = []
+    if len(batch) > 0:
+        yield make_column_batch(batch)
+
+
+def _collect_triples(
+    batches: Iterable[ColumnBatch], metrics: Optional[List[str]] = None
+) -> Tuple[Dict[str, Triples], List[str], List[str]]:
+    # The IDs are interned to integer indices batch by batch, and each metric's
+    # (row, column, value) arrays are collected and concatenated at the end,
+    # with the rows and columns mapped to the positions of the IDs in the
+    # sorted summarizer and instance IDs. If `metrics` is None, every metric
+    # is collected.
+    summarizer_to_index = {}
+    instance_to_index = {}
+    arrays = defaultdict(list)
+
+    for batch in batches:
+        rows = _intern(batch.summarizer_ids, summarizer_to_index)
+        columns = _intern(batch.instance_ids, instance_to_index)
+        for metric, (positions, values) in batch.metrics.items():
+            if metrics is not None and metric not in metrics:
+                continue
+            arrays[metric].append((rows[positions], columns[positions], values))
+
+    summarizer_ids = sorted(summarizer_to_index)
+    instance_ids = sorted(instance_to_index)
+    summarizer_ranks = _get_ranks(summarizer_to_index, summarizer_ids)
+    instance_ranks = _get_ranks(instance_to_index, instance_ids)
+
+    metric_to_triples = {}
+    for metric in sorted(arrays.keys()):
+        rows, columns, values = (
+            np.concatenate(array) for array in zip(*arrays[metric])
+        )
+        metric_to_triples[metric] = (
+            summarizer_ranks[rows],
+            instance_ranks[columns],
+            values,
+        )
+    return metric_to_triples, summarizer_ids, instance_ids
+
+
+def _scatter_triples(
+    metric_to_triples: Dict[str, Triples],
+    metrics: List[str],
+    summarizer_ids: List[str],
+    instance_ids: List[str],
+) -> np.ndarray:
+    # Scatters the triples into one (metrics, systems, inputs) array in which
+    # the metrics without any triples are all nan
+    scores = np.full((len(metrics), len(summarizer_ids), len(instance_ids)), np.nan)
+    for i, metric in enumerate(metrics):
+        if metric in metric_to_triples:
+            rows, columns, values = metric_to_triples[metric]
+            scores[i, rows, columns] = values
+    return scores
+
+
+def build_scores_from_batches(
+    batches: Iterable[ColumnBatch], metrics: Optional[List[str]] = None
+) -> Scores:
+    # Builds the scores of `metrics` in that order, where the metrics which
+    # are not in the batches are all nan, or of every metric in the batches in
+    # sorted order if `metrics` is None
+    metric_to_triples, summarizer_ids, instance_ids = _collect_triples(batches, metrics)
+    if metrics is None:
+        metrics = sorted(metric_to_triples.keys())
+    scores = _scatter_triples(metric_to_triples, metrics, summarizer_ids, instance_ids)
+    return scores, metrics, summarizer_ids, instance_ids
+
+
+def build_matrices_from_batches(
+    batches: Iterable[ColumnBatch], metrics: Optional[List[str]] = None
+) -> Matrices:
+    # Builds a matrix for every metric in the batches (and in `metrics`, if it
+    # is not None). The matrices are views of one contiguous array.
+    metric_to_triples, summarizer_ids, instance_ids = _collect_triples(batches, metrics)
+    metrics = sorted(metric_to_triples.keys())
+    scores = _scatter_triples(metric_to_triples, metrics, summarizer_ids, instance_ids)
+    metric_to_matrix = {metric: scores[i] for i, metric in enumerate(metrics)}
+    return metric_to_matrix, summarizer_ids, instance_ids
+
+
+def build_matrices(
+    instances: Iterable[Dict], metrics: Optional[List[str]] = None
+) -> Matrices:
+    return build_matrices_from_batches(_batch_instances(instances), metrics)
+
+
+@profiled("read_jsonl")
+def _read_matrices(input_file: str, metrics: Optional[List[str]] = None) -> Matrices:
+    return build_matrices_from_batches(read_column_batches(input_file), metrics)
+
+
+@profiled("read_jsonl")
+def _read_sparse_matrices(
+    input_file: str, metrics: Optional[List[str]] = None
+) -> SparseMatrices:
+    metric_to_triples, summarizer_ids, instance_ids = _collect_triples(
+        read_column_batches(input_file), metrics
+    )
+    shape = (len(summarizer_ids), len(instance_ids))
+    metric_to_matrix = {
+        metric: SparseScores.from_triples(shape, *triples)
+        for metric, triples in metric_to_triples.items()
+    }
+    return metric_to_matrix, summarizer_ids, instance_ids
+
+
+@profiled("read_jsonl")
+def _read_scores(input_file: str, metrics: List[str]) -> Scores:
+    return build_scores_from_batches(read_column_batches(input_file), metrics)
+
+
+def _read_ids(input_file: str) -> Tuple[List[str], List[str], List[str]]:
+    # Returns the sorted metrics, summarizer IDs and instance IDs in the file
+    metrics = set()
     summarizer_ids = set()
-    metrics_dict = {}
+    instance_ids = set()
+    for batch in read_column_batches(input_file):
+        metrics.update(batch.metrics.keys())
+        summarizer_ids.update(batch.summarizer_ids)
+        instance_ids.update(batch.instance_ids)
+    return sorted(metrics), sorted(summarizer_ids), sorted(instance_ids)
+
+
+def _read_score_batches(
+    input_file: str,
+    metrics: List[str],
+    summarizer_ids: List[str],
+    instance_ids: List[str],
+) -> Iterator[ScoreBatch]:
+    # Yields one batch of scores per batch of lines in the file
+    metric_to_index = {metric: i for i, metric in enumerate(metrics)}
+    summarizer_to_index = {id_: i for i, id_ in enumerate(summarizer_ids)}
+    instance_to_index = {id_: i for i, id_ in enumerate(instance_ids)}
+    for batch in read_column_batches(input_file):
+        rows = np.array([summarizer_to_index[id_] for id_ in batch.summarizer_ids])
+        columns = np.array([instance_to_index[id_] for id_ in batch.instance_ids])
+        metric_indices, positions, values = [], [], []
+        for metric, (metric_positions, metric_values) in batch.metrics.items():
+            metric_indices.append(
+                np.full(len(metric_positions), metric_to_index[metric])
+            )
+            positions.append(metric_positions)
+            values.append(metric_values)
+        if len(values) > 0:
+            positions = np.concatenate(positions)
+            yield (
+                np.concatenate(metric_indices),
+                rows[positions],
+                columns[positions],
+                np.concatenate(values),
+            )
+
+
+@profiled("load_chunked_scores")
+def load_chunked_scores(
+    input_file: str, memory_budget_mb: Optional[float] = None
+) -> ChunkedScores:
+    # Loads every metric's scores in the out-of-core chunked format without
+    # ever holding a full matrix in memory, reading the file once for the IDs
+    # and once for the scores. The chunks are cached like the matrices are,
+    # or written to a temporary directory if caching is disabled.
+    memory_budget = get_memory_budget(memory_budget_mb)
+    content_hash = ""
+    if is_cache_enabled():
+        cache_dir = get_cache_dir()
+        content_hash = get_content_hash(input_file, cache_dir)
+        output_dir = os.path.join(
+            cache_dir,
+            f"chunked-v{CHUNKED_VERSION}",
+            f"{content_hash}-{memory_budget}",
+        )
+    else:
+        temp_dir = tempfile.mkdtemp(prefix="syslevel-chunked-")
+        atexit.register(shutil.rmtree, temp_dir, True)
+        output_dir = os.path.join(temp_dir, "scores")
+
+    if not os.path.exists(f"{output_dir}/metadata.json"):
+        metrics, summarizer_ids, instance_ids = _read_ids(input_file)
+        batches = _read_score_batches(input_file, metrics, summarizer_ids, instance_ids)
+        write_chunked_scores(
+            output_dir,
+            metrics,
+            summarizer_ids,
+            instance_ids,
+            batches,
+            memory_budget,
+            content_hash,
+        )
+    return ChunkedScores(output_dir)
 
-    with gzip.open(input_file, "r") as f:
-        for line in f:
-            instance = json.loads(line.decode())
 
-            instance_id = instance["instance_id"]
-            summarizer_id = instance["summarizer_id"]
-            key = (instance_id, summarizer_id)
+@profiled("load_scores")
+def load_scores(
+    input_file: str,
+    require_parallel: bool,
+    metrics: List[str],
+    use_cache: bool = True,
+) -> ScoreTensor:
+    # The scores are memory-mapped from the cache, in which case the tensor is
+    # a view of them, or read straight into the tensor
+    if use_cache and is_cache_enabled():
+        scores, cached_metrics, summarizer_ids, instance_ids = load_cached_scores(
+            input_file, lambda: _read_matrices(input_file)
+        )
+        metric_to_index = {metric: i for i, metric in enumerate(cached_metrics)}
+        if all(metric in metric_to_index for metric in metrics):
+            metric_indices = [metric_to_index[metric] for metric in metrics]
+            tensor = ScoreTensor(
+                scores, metrics, summarizer_ids, instance_ids, metric_indices
+            )
+        else:
+            # The metrics which are not in the file are all nan, so the
+            # scores are copied
+            metric_to_matrix = {
+                metric: scores[i] for i, metric in enumerate(cached_metrics)
+            }
+            tensor = ScoreTensor.from_matrices(
+                metric_to_matrix, metrics, summarizer_ids, instance_ids
+            )
+    else:
+        tensor = ScoreTensor(*_read_scores(input_file, metrics))
 
-            instance_ids.add(instance_id)
-            summarizer_ids.add(summarizer_id)
+    if require_parallel:
+        num_inputs = len(tensor.input_ids)
+        for metric, counts in zip(metrics, tensor.counts):
+            if np.any(counts < num_inputs):
+                raise Exception(
+                    f"Missing {metric} scores in parallel file {input_file}"
+                )
+    return tensor
 
-            metrics_dict[key] = instance["metrics"]
 
-    instance_ids = sorted(instance_ids)
-    summarizer_ids = sorted(summarizer_ids)
+@profiled("load_sparse_scores")
+def load_sparse_scores(
+    input_file: str,
+    require_parallel: bool,
+    metrics: List[str],
+    use_cache: bool = True,
+) -> SparseScoreTensor:
+    # Like `load_scores`, but every metric's `SparseScores` is built straight
+    # from the (system, input, value) triples in the file, or memory-mapped
+    # from the cache, without a dense matrix. The metrics which are not in the
+    # file have no scores.
+    if use_cache and is_cache_enabled():
+        metric_to_matrix, summarizer_ids, instance_ids = load_cached_sparse_scores(
+            input_file, lambda: _read_sparse_matrices(input_file)
+        )
+    else:
+        metric_to_matrix, summarizer_ids, instance_ids = _read_sparse_matrices(
+            input_file, metrics
+        )
 
-    m = len(summarizer_ids)
-    n = len(instance_ids)
-    matrices = []
+    shape = (len(summarizer_ids), len(instance_ids))
     for metric in metrics:
-        matrix = np.empty((m, n))
-        for i, summarizer_id in enumerate(summarizer_ids):
-            for j, instance_id in enumerate(instance_ids):
-                key = (instance_id, summarizer_id)
-                if require_parallel:
-                    matrix[i, j] = _get_value(metrics_dict, key, metric)
-                else:
-                    if key not in metrics_dict or metric not in metrics_dict[key]:
-                        matrix[i, j] = np.nan
-                    else:
-                        matrix[i, j] = _get_value(metrics_dict, key, metric)
-        matrices.append(matrix)
-
-    return matrices, summarizer_ids
-
-
-def bootstrap_system_scores(X: np.ndarray, num_iterations: int) -> np.ndarray:
+        if metric not in metric_to_matrix:
+            metric_to_matrix[metric] = SparseScores.from_triples(
+                shape, *[np.empty(0, dtype=dtype) for dtype in [int, int, float]]
+            )
+        if require_parallel and np.any(metric_to_matrix[metric].counts < shape[1]):
+            raise Exception(f"Missing {metric} scores in parallel file {input_file}")
+    return SparseScoreTensor(metric_to_matrix, metrics, summarizer_ids, instance_ids)
+
+
+@profiled("load_matrices")
+def load_matrices(
+    input_file: str,
+    require_parallel: bool,
+    metrics: List[str],
+    use_cache: bool = True,
+    sparse: bool = False,
+) -> Tuple[List[Union[np.ndarray, SparseScores]], List[str]]:
+    # Loads the scores as one matrix per metric. If `sparse` is true, the
+    # matrices are returned as `SparseScores`
+    if sparse:
+        tensor = load_sparse_scores(input_file, require_parallel, metrics, use_cache)
+        matrices = [tensor[metric] for metric in metrics]
+    else:
+        tensor = load_scores(input_file, require_parallel, metrics, use_cache)
+        matrices = tensor.get_matrices(metrics)
+    return matrices, tensor.system_ids
+
+
+@profiled("bootstrap_system_scores")
+@memoized("bootstrap_system_scores")
+def bootstrap_system_scores(
+    X: Union[np.ndarray, SparseScores, ChunkedMatrix],
+    num_iterations: int,
+    rng: Optional[np.random.Generator] = None,
+    chunk_size: int = 10_000_000,
+) -> np.ndarray:
+    # Systems with the same number of non-nan scores are resampled together
+    # using one index array per iteration. `chunk_size` bounds the number of
+    # elements in the gathered (systems, iterations, inputs) array. A
+    # `ChunkedMatrix` is resampled one chunk at a time within its memory budget.
+    if rng is None:
+        rng = np.random.default_rng()
+    if isinstance(X, ChunkedMatrix):
+        return bootstrap_chunked_system_scores(X, num_iterations, rng)
+
     N = X.shape[0]
     samples = np.empty((N, num_iterations))
 
-    for i in range(N):
-        # Take just the non-nan scores
-        scores = X[i, ~np.isnan(X[i])]
-        M = len(scores)
+    if isinstance(X, SparseScores):
+        counts = X.counts
+    else:
+        counts = np.sum(~np.isnan(X), axis=1)
+    for M in np.unique(counts):
+        rows = np.where(counts == M)[0]
+        if M == 0:
+            samples[rows] = np.nan
+            continue
+
+        rows_per_block = max(1, chunk_size // M)
+        for start in range(0, len(rows), rows_per_block):
+            block = rows[start : start + rows_per_block]
+            # Take just the non-nan scores
+            if isinstance(X, SparseScores):
+                scores = np.stack([X.get_row(i) for i in block])
+            else:
+                scores = np.stack([X[i, ~np.isnan(X[i])] for i in block])
 
-        for j in range(num_iterations):
-            columns = np.random.choice(M, M, replace=True)
-            samples[i, j] = np.mean(scores[columns])
+            iterations_per_chunk = max(1, chunk_size // (len(block) * M))
+            for j in range(0, num_iterations, iterations_per_chunk):
+                k = min(j + iterations_per_chunk, num_iterations)
+                columns = rng.integers(0, M, size=(k - j, M))
+                samples[block, j:k] = scores[:, columns].mean(axis=2)
 
     return samples
 
@@ -1,75 +1,241 @@
 import argparse
 import os
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.patches import Patch
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
-from syslevel.util import METRICS, load_matrices, bootstrap_system_scores
+from syslevel.chunked import ChunkedMatrix, ChunkedScores
+from syslevel.profiling import profile_run, profiled, span
+from syslevel.quantiles import QuantileSketch, SampleAccumulator
+from syslevel.results import load_results, save_results
+from syslevel.sparse import SparseScores, SparseScoreTensor
+from syslevel.scores import ScoreTensor
+from syslevel.util import (
+    METRICS,
+    bootstrap_system_scores,
+    load_chunked_scores,
+    load_scores,
+    load_sparse_scores,
+)
 
+# The largest relative difference between the analytic and bootstrapped average
+# variances before a warning is printed
+CONSISTENCY_TOLERANCE = 0.05
 
+# The samples outside of these quantiles are left out of the violin plots
+CONFIDENCE_QUANTILES = [0.025, 0.975]
+
+# With --sketch, each system's violin is drawn from its bootstrap distribution's
+# values at these evenly-spaced quantiles instead of from every sample
+VIOLIN_QUANTILES = (np.arange(500) + 0.5) / 500
+
+
+def get_alignment(
+    means_judged: np.ndarray,
+    scores_all: Union[ScoreTensor, SparseScoreTensor, ChunkedScores],
+    scores_judged: ScoreTensor,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns the indices which order the systems of the "all" and "judged"
+    # splits by their judged means
+    index_judged = np.argsort(means_judged, kind="stable")
+    index_all = scores_all.get_system_indices(scores_judged.system_ids)[index_judged]
+    return index_all, index_judged
+
+
+@profiled("align_samples")
 def align_samples(
     samples_all: np.ndarray,
     samples_judged: np.ndarray,
-    row_labels_all: List[str],
-    row_labels_judged: List[str],
+    scores_all: Union[ScoreTensor, SparseScoreTensor, ChunkedScores],
+    scores_judged: ScoreTensor,
 ) -> Tuple[np.ndarray, np.ndarray]:
-    means = np.mean(samples_judged, axis=1)
-    means = [(mean, label) for mean, label in zip(means, row_labels_judged)]
-    means.sort(key=lambda t: t[0])
-
-    new_all = np.empty(samples_all.shape)
-    new_judged = np.empty(samples_judged.shape)
-    for i, (_, label) in enumerate(means):
-        index = row_labels_all.index(label)
-        new_all[i] = samples_all[index]
+    index_all, index_judged = get_alignment(
+        np.mean(samples_judged, axis=1), scores_all, scores_judged
+    )
+    return samples_all[index_all], samples_judged[index_judged]
 
-        index = row_labels_judged.index(label)
-        new_judged[i] = samples_judged[index]
 
-    return new_all, new_judged
+@profiled("accumulate_bootstrap")
+def accumulate_bootstrap(
+    X: Union[np.ndarray, SparseScores],
+    num_iterations: int,
+    rng: Optional[np.random.Generator] = None,
+    iterations_per_update: int = 1000,
+) -> SampleAccumulator:
+    # Bootstraps the system scores in batches of iterations which are added to
+    # a `SampleAccumulator`, so only one batch of samples is held at a time
+    seed = None if rng is None else int(rng.integers(2**32))
+    accumulator = SampleAccumulator(X.shape[0], seed=seed)
+    for start in range(0, num_iterations, iterations_per_update):
+        num_batch_iterations = min(iterations_per_update, num_iterations - start)
+        accumulator.update(bootstrap_system_scores(X, num_batch_iterations, rng))
+    return accumulator
 
 
 def calculate_average_variance(samples: np.ndarray) -> float:
     return np.mean(np.var(samples, axis=1))
 
 
-def convert_to_confidence_interval(samples: np.ndarray) -> List[List[float]]:
-    cis = []
-    for i in range(samples.shape[0]):
-        lower = np.percentile(samples, 2.5)
-        upper = np.percentile(samples, 97.5)
-        cis.append([value for value in samples[i] if lower <= value <= upper])
-    return cis
+@profiled("calculate_analytic_variances")
+def calculate_analytic_variances(
+    X: Union[np.ndarray, SparseScores, ChunkedMatrix],
+) -> np.ndarray:
+    # Resampling a system's M non-nan scores with replacement gives a mean whose
+    # variance is exactly the (ddof=0) variance of the scores divided by M, so
+    # the bootstrap's variances can be computed from each system's count, sum
+    # and sum of squares without sampling. Systems without scores are nan.
+    if isinstance(X, (SparseScores, ChunkedMatrix)):
+        counts = X.counts
+        sums = X.sums
+        sums_of_squares = X.get_sums_of_squares()
+    else:
+        is_scored = ~np.isnan(X)
+        scores = np.where(is_scored, X, 0.0)
+        counts = is_scored.sum(axis=1)
+        sums = scores.sum(axis=1)
+        sums_of_squares = np.sum(scores**2, axis=1)
 
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+        variances = np.maximum(sums_of_squares / counts - means**2, 0.0)
+        return variances / counts
 
-def main(args):
-    num_iterations = 1000
-    fontsize = 16
 
-    Xs_all, row_labels_all = load_matrices(args.all_metrics_jsonl, False, METRICS)
-    Xs_judged, row_labels_judged = load_matrices(
-        args.judged_metrics_jsonl, True, METRICS
-    )
+def calculate_reduction(variance_all: float, variance_judged: float) -> float:
+    return (variance_judged - variance_all) / variance_judged * 100
+
+
+def check_consistency(
+    metric: str, name: str, analytic_variance: float, bootstrap_variance: float
+) -> None:
+    difference = abs(bootstrap_variance - analytic_variance) / analytic_variance
+    if difference > CONSISTENCY_TOLERANCE:
+        print(
+            f"Warning: the bootstrapped {name} {metric} variance "
+            f"{bootstrap_variance:.3g} differs from the analytic variance "
+            f"{analytic_variance:.3g} by {difference * 100:.1f}%"
+        )
+
+
+@profiled("convert_to_confidence_interval")
+def convert_to_confidence_interval(
+    samples: np.ndarray, bounds: Optional[np.ndarray] = None
+) -> List[np.ndarray]:
+    # Keeps each row's values which are within the `CONFIDENCE_QUANTILES` of
+    # all of the samples, or within `bounds` if they were already computed
+    if bounds is None:
+        sketch = QuantileSketch(exact=True).update(samples)
+        bounds = sketch.quantile(CONFIDENCE_QUANTILES)
+    lower, upper = bounds
+    return [row[(lower <= row) & (row <= upper)] for row in samples]
+
 
-    assert sorted(row_labels_all) == sorted(row_labels_judged)
-    num_systems = len(row_labels_all)
+def compute(args) -> Dict:
+    num_iterations = args.num_iterations
+    # Without --seed, no generator is passed so that the bootstraps are not
+    # cached
+    rng = None if args.seed is None else np.random.default_rng(args.seed)
 
-    for X_all, X_judged, metric in zip(Xs_all, Xs_judged, METRICS):
-        samples_all = bootstrap_system_scores(X_all, num_iterations)
-        samples_judged = bootstrap_system_scores(X_judged, num_iterations)
+    if args.out_of_core:
+        scores_all = load_chunked_scores(args.all_metrics_jsonl, args.memory_budget_mb)
+    elif args.sparse:
+        scores_all = load_sparse_scores(args.all_metrics_jsonl, False, METRICS)
+    else:
+        scores_all = load_scores(args.all_metrics_jsonl, False, METRICS)
+    scores_judged = load_scores(args.judged_metrics_jsonl, True, METRICS)
 
-        samples_all, samples_judged = align_samples(
-            samples_all, samples_judged, row_labels_all, row_labels_judged
+    assert set(scores_all.system_ids) == set(scores_judged.system_ids)
+
+    # With --analytic, the reductions are computed in closed form and the
+    # bootstrap is only run to draw the violin plots (and check the analytic
+    # variances against), so it is skipped entirely with --compute-only
+    run_bootstrap = not (args.analytic and args.compute_only)
+
+    results = {"metrics": METRICS}
+    for metric in METRICS:
+        X_all = scores_all[metric]
+        X_judged = scores_judged[metric]
+        if args.analytic:
+            variances_all = calculate_analytic_variances(X_all)
+            variances_judged = calculate_analytic_variances(X_judged)
+            variance_all = np.mean(variances_all)
+            variance_judged = np.mean(variances_judged)
+            reduction = calculate_reduction(variance_all, variance_judged)
+            print(f"{metric}: {reduction:.2f}% (analytic)")
+
+            results[f"{metric}/variances_all"] = variances_all
+            results[f"{metric}/variances_judged"] = variances_judged
+            results[f"{metric}/reduction"] = float(reduction)
+
+        if not run_bootstrap:
+            continue
+
+        if args.sketch:
+            accumulator_all = accumulate_bootstrap(X_all, num_iterations, rng)
+            accumulator_judged = accumulate_bootstrap(X_judged, num_iterations, rng)
+            index_all, index_judged = get_alignment(
+                accumulator_judged.mean, scores_all, scores_judged
+            )
+            for name, accumulator, index in [
+                ("all", accumulator_all, index_all),
+                ("judged", accumulator_judged, index_judged),
+            ]:
+                quantiles = accumulator.quantiles(VIOLIN_QUANTILES)[index]
+                bounds = accumulator.get_combined_sketch().quantile(
+                    CONFIDENCE_QUANTILES
+                )
+                results[f"{metric}/quantiles_{name}"] = quantiles
+                results[f"{metric}/bounds_{name}"] = bounds
+
+            bootstrap_variance_all = np.mean(accumulator_all.variance)
+            bootstrap_variance_judged = np.mean(accumulator_judged.variance)
+        else:
+            samples_all = bootstrap_system_scores(X_all, num_iterations, rng)
+            samples_judged = bootstrap_system_scores(X_judged, num_iterations, rng)
+
+            samples_all, samples_judged = align_samples(
+                samples_all, samples_judged, scores_all, scores_judged
+            )
+            results[f"{metric}/samples_all"] = samples_all
+            results[f"{metric}/samples_judged"] = samples_judged
+
+            bootstrap_variance_all = calculate_average_variance(samples_all)
+            bootstrap_variance_judged = calculate_average_variance(samples_judged)
+        if args.analytic:
+            check_consistency(metric, "all", variance_all, bootstrap_variance_all)
+            check_consistency(
+                metric, "judged", variance_judged, bootstrap_variance_judged
+            )
+        else:
+            reduction = calculate_reduction(
+                bootstrap_variance_all, bootstrap_variance_judged
+            )
+            print(f"{metric}: {reduction:.2f}%")
+            results[f"{metric}/reduction"] = float(reduction)
+    return results
+
+
+def get_violin_samples(results: Dict, metric: str, name: str) -> List[np.ndarray]:
+    if f"{metric}/samples_{name}" in results:
+        return convert_to_confidence_interval(results[f"{metric}/samples_{name}"])
+    if f"{metric}/quantiles_{name}" in results:
+        return convert_to_confidence_interval(
+            results[f"{metric}/quantiles_{name}"], results[f"{metric}/bounds_{name}"]
         )
+    raise Exception(
+        f"No bootstrap samples for {metric}; the results were computed "
+        f"with --analytic --compute-only"
+    )
 
-        variance_all = calculate_average_variance(samples_all)
-        variance_judged = calculate_average_variance(samples_judged)
-        reduction = (variance_judged - variance_all) / variance_judged * 100
-        print(f"{metric}: {reduction:.2f}%")
 
-        samples_all = convert_to_confidence_interval(samples_all)
-        samples_judged = convert_to_confidence_interval(samples_judged)
+def render(results: Dict, output_dir: str) -> None:
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Patch
+
+    fontsize = 16
+    for metric in results["metrics"]:
+        samples_all = get_violin_samples(results, metric, "all")
+        samples_judged = get_violin_samples(results, metric, "judged")
+        num_systems = len(samples_all)
 
         plt.figure(figsize=(8, 3))
         plt.violinplot(samples_judged, positions=[i for i in range(num_systems)])
@@ -91,15 +257,47 @@ def main(args):
         plt.ylabel(metric, fontsize=fontsize)
         plt.tight_layout()
 
-        os.makedirs(args.output_dir, exist_ok=True)
-        plt.savefig(f"{args.output_dir}/{metric}.pdf")
+        os.makedirs(output_dir, exist_ok=True)
+        plt.savefig(f"{output_dir}/{metric}.pdf")
         plt.close()
 
 
+def main(args):
+    results_file = args.results_file or f"{args.output_dir}/results.npz"
+    if args.render_only:
+        results = load_results(results_file)
+    else:
+        results = compute(args)
+        save_results(results_file, results)
+
+    if not args.compute_only:
+        with span("plot"):
+            render(results, args.output_dir)
+
+
 if __name__ == "__main__":
     argp = argparse.ArgumentParser()
-    argp.add_argument("--all-metrics-jsonl", required=True)
-    argp.add_argument("--judged-metrics-jsonl", required=True)
+    argp.add_argument("--all-metrics-jsonl")
+    argp.add_argument("--judged-metrics-jsonl")
     argp.add_argument("--output-dir", required=True)
+    argp.add_argument("--seed", type=int)
+    argp.add_argument("--sparse", action="store_true")
+    argp.add_argument("--out-of-core", action="store_true")
+    argp.add_argument("--memory-budget-mb", type=float)
+    argp.add_argument("--analytic", action="store_true")
+    argp.add_argument("--num-iterations", type=int, default=1000)
+    argp.add_argument("--sketch", action="store_true")
+    argp.add_argument("--results-file")
+    stages = argp.add_mutually_exclusive_group()
+    stages.add_argument("--compute-only", action="store_true")
+    stages.add_argument("--render-only", action="store_true")
+    argp.add_argument("--profile", action="store_true")
     args = argp.parse_args()
-    main(args)
+    if not args.render_only and (
+        args.all_metrics_jsonl is None or args.judged_metrics_jsonl is None
+    ):
+        argp.error("the metrics files are required unless --render-only is used")
+    if args.out_of_core and args.sparse:
+        argp.error("--out-of-core and --sparse cannot be used together")
+    with profile_run("variance", args.profile):
+        main(args)
@@ -0,0 +1,41 @@
+import argparse
+
+from syslevel import result_cache
+from syslevel.benchmarks.run import main
+
+
+def test_benchmarks_do_not_use_result_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("SYSLEVEL_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.delenv("SYSLEVEL_DISABLE_CACHE", raising=False)
+    lookups = []
+    get_key = result_cache.get_key
+    monkeypatch.setattr(
+        result_cache,
+        "get_key",
+        lambda *args: lookups.append(args[0]) or get_key(*args),
+    )
+
+    args = argparse.Namespace(
+        benchmarks=[
+            "bootstrap_system_scores",
+            "sample_self_correlation",
+            "ci_bootstrap",
+        ],
+        num_systems=[4],
+        num_inputs=[10],
+        sparsity=[0.0],
+        num_annotators=[1],
+        metrics=["m1", "m2"],
+        num_iterations=10,
+        repeats=1,
+        seed=0,
+        output_json=None,
+        baseline_json=None,
+        time_tolerance=0.2,
+        memory_tolerance=0.1,
+    )
+    # The second run would find the first run's results if they were cached
+    main(args)
+    main(args)
+    assert lookups == []
+    assert result_cache.list_entries() == []
@@ -0,0 +1,138 @@
+import warnings
+import numpy as np
+import pytest
+from scipy.stats import kendalltau
+
+from syslevel.correlations import (
+    batch_kendall_tau,
+    calculate_tau_from_deltas,
+    kendall_tau,
+)
+
+
+def _scipy_tau(x, y) -> float:
+    # scipy warns about constant inputs, for which it returns nan
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return kendalltau(x, y)[0]
+
+
+def _loop_tau(deltas_auto, deltas_human) -> float:
+    # The original pair-by-pair implementation of `calculate_tau`
+    P, Q, T, U = 0, 0, 0, 0
+    for delta_auto, delta_human in zip(deltas_auto, deltas_human):
+        if (delta_auto > 0 and delta_human > 0) or (delta_auto < 0 and delta_human < 0):
+            P += 1
+        elif (delta_auto > 0 and delta_human < 0) or (
+            delta_auto < 0 and delta_human > 0
+        ):
+            Q += 1
+        elif delta_auto == 0 and delta_human != 0:
+            T += 1
+        elif delta_auto != 0 and delta_human == 0:
+            U += 1
+    if P + Q + T == 0:
+        return 0
+    with np.errstate(invalid="ignore"):
+        return (P - Q) / np.sqrt((P + Q + T) * (P + Q + U))
+
+
+def _random_vectors(rng, n: int, num_values: int):
+    # Drawing from few distinct values makes ties common
+    x = rng.integers(0, num_values, n).astype(float)
+    y = rng.integers(0, num_values, n).astype(float)
+    return x, y
+
+
+def _get_deltas(x, y):
+    first, second = np.triu_indices(len(x), k=1)
+    return x[first] - x[second], y[first] - y[second]
+
+
+@pytest.mark.parametrize("num_values", [2, 3, 5, 1000])
+def test_kendall_tau_matches_scipy(num_values):
+    rng = np.random.default_rng(num_values)
+    for _ in range(200):
+        x, y = _random_vectors(rng, int(rng.integers(2, 60)), num_values)
+        expected = _scipy_tau(x, y)
+        actual = kendall_tau(x, y)
+        if np.isnan(expected):
+            assert np.isnan(actual)
+        else:
+            assert actual == pytest.approx(expected, abs=1e-12)
+
+
+def test_kendall_tau_large():
+    rng = np.random.default_rng(0)
+    x, y = _random_vectors(rng, 5000, 50)
+    assert kendall_tau(x, y) == pytest.approx(_scipy_tau(x, y), abs=1e-12)
+
+
+def test_kendall_tau_degenerate():
+    assert np.isnan(kendall_tau([], []))
+    assert np.isnan(kendall_tau([1.0], [2.0]))
+    assert np.isnan(kendall_tau([3.0, 3.0, 3.0], [1.0, 2.0, 3.0]))
+    assert np.isnan(kendall_tau([1.0, 2.0, 3.0], [0.5, 0.5, 0.5]))
+    assert np.isnan(kendall_tau([1.0, np.nan, 3.0], [1.0, 2.0, 3.0]))
+    assert np.isnan(kendall_tau([1.0, 2.0, 3.0], [1.0, 2.0, np.nan]))
+    assert kendall_tau([1.0, 2.0], [3.0, 4.0]) == 1.0
+    assert kendall_tau([1.0, 2.0], [4.0, 3.0]) == -1.0
+    with pytest.raises(ValueError):
+        kendall_tau([1.0, 2.0], [1.0])
+
+
+def test_calculate_tau_from_deltas_matches_loop():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        num_pairs = int(rng.integers(0, 80))
+        deltas_auto = rng.integers(-2, 3, num_pairs).astype(float)
+        deltas_human = rng.integers(-2, 3, num_pairs).astype(float)
+        expected = _loop_tau(deltas_auto, deltas_human)
+        with np.errstate(invalid="ignore"):
+            actual = calculate_tau_from_deltas(deltas_auto, deltas_human)
+        assert actual == pytest.approx(expected, abs=1e-12, nan_ok=True)
+
+
+def test_calculate_tau_from_deltas_all_pairs_matches_scipy():
+    # Over every pair of systems, the deltas' tau is Kendall's tau-b
+    rng = np.random.default_rng(2)
+    for _ in range(100):
+        x, y = _random_vectors(rng, int(rng.integers(2, 30)), 4)
+        expected = _scipy_tau(x, y)
+        if np.isnan(expected):
+            continue
+        actual = calculate_tau_from_deltas(*_get_deltas(x, y))
+        assert actual == pytest.approx(expected, abs=1e-12)
+
+
+def test_calculate_tau_from_deltas_degenerate():
+    assert calculate_tau_from_deltas([], []) == 0
+    assert calculate_tau_from_deltas([0.0, 0.0], [0.0, 0.0]) == 0
+    # Without any pairs which are untied in the human scores, tau is 0
+    assert calculate_tau_from_deltas([1.0, -1.0], [0.0, 0.0]) == 0
+    # Like the original loop, pairs tied only in the metric scores give 0 / 0
+    with np.errstate(invalid="ignore"):
+        assert np.isnan(calculate_tau_from_deltas([0.0, 0.0], [1.0, -1.0]))
+    assert calculate_tau_from_deltas([1.0, 2.0], [3.0, 1.0]) == 1.0
+
+
+def test_batch_kendall_tau_matches_scipy():
+    rng = np.random.default_rng(3)
+    X = rng.integers(0, 4, (300, 12)).astype(float)
+    Y = rng.integers(0, 4, (300, 12)).astype(float)
+    X[0] = 1.0
+    Y[1] = 2.0
+    X[2, 3] = np.nan
+    Y[3, 0] = np.nan
+    expected = np.array([_scipy_tau(x, y) for x, y in zip(X, Y)])
+    np.testing.assert_allclose(
+        batch_kendall_tau(X, Y, chunk_size=100), expected, atol=1e-12
+    )
+    assert np.isnan(expected[:4]).all()
+
+
+def test_batch_kendall_tau_degenerate():
+    assert np.isnan(batch_kendall_tau(np.ones((3, 1)), np.ones((3, 1)))).all()
+    assert batch_kendall_tau(np.zeros((0, 5)), np.zeros((0, 5))).shape == (0,)
+    with pytest.raises(ValueError):
+        batch_kendall_tau(np.ones((2, 3)), np.ones((2, 4)))
@@ -0,0 +1,51 @@
+import gzip
+import json
+import numpy as np
+import pytest
+
+from syslevel import jsonl
+from syslevel.util import load_scores
+
+
+def _write_jsonl(path, instances):
+    with gzip.open(path, "wt") as out:
+        for instance in instances:
+            out.write(json.dumps(instance) + "\n")
+
+
+def _get_instances():
+    return [
+        {"summarizer_id": "A", "instance_id": "1", "metrics": {"m": 0.5}},
+        {"summarizer_id": "A", "instance_id": "2", "metrics": {"m": float("nan")}},
+        {"summarizer_id": "B", "instance_id": "1", "metrics": {"m": [1.0, 2.0]}},
+        {"summarizer_id": "B", "instance_id": "2", "metrics": {"m": float("inf")}},
+    ]
+
+
+def test_loads_non_finite():
+    # `json.dumps` writes NaN and Infinity, which must be read by either backend
+    record = {"a": float("nan"), "b": float("inf"), "c": 1.0}
+    parsed = jsonl.loads(json.dumps(record).encode())
+    assert np.isnan(parsed["a"])
+    assert parsed["b"] == float("inf")
+    assert parsed["c"] == 1.0
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_read_column_batches_non_finite(tmp_path, num_workers):
+    path = str(tmp_path / "metrics.jsonl.gz")
+    _write_jsonl(path, _get_instances())
+    batches = list(jsonl.read_column_batches(path, num_workers, batch_bytes=64))
+    summarizer_ids = [id_ for batch in batches for id_ in batch.summarizer_ids]
+    values = np.concatenate([batch.metrics["m"][1] for batch in batches])
+    assert summarizer_ids == ["A", "A", "B", "B"]
+    np.testing.assert_array_equal(values, [0.5, np.nan, 1.5, np.inf])
+
+
+def test_load_scores_non_finite(tmp_path):
+    path = str(tmp_path / "metrics.jsonl.gz")
+    _write_jsonl(path, _get_instances())
+    scores = load_scores(path, False, ["m"], use_cache=False)
+    assert scores.system_ids == ["A", "B"]
+    assert scores.input_ids == ["1", "2"]
+    np.testing.assert_array_equal(scores["m"], [[0.5, np.nan], [1.5, np.inf]])
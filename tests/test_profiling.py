@@ -0,0 +1,42 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from syslevel.parallel import get_shared_array, map_with_shared_arrays
+from syslevel.profiling import profile_run, profiled
+
+
+@profiled("sum_row")
+def _sum_row(index: int) -> float:
+    return float(np.sum(get_shared_array(0)[index]))
+
+
+def _load_spans(profile_dir) -> list:
+    (filename,) = os.listdir(profile_dir)
+    with open(os.path.join(profile_dir, filename), "r") as f:
+        return json.load(f)["spans"]
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_worker_spans_are_recorded(tmp_path, monkeypatch, num_workers):
+    monkeypatch.setenv("SYSLEVEL_PROFILE_DIR", str(tmp_path))
+    X = np.arange(12.0).reshape(4, 3)
+    with profile_run("test", True):
+        sums = map_with_shared_arrays(_sum_row, list(range(4)), [X], num_workers)
+    assert sums == list(np.sum(X, axis=1))
+
+    spans = _load_spans(tmp_path)
+    depths = {record["name"]: record["depth"] for record in spans}
+    assert [record["name"] for record in spans].count("sum_row") == 4
+    assert depths["sum_row"] == depths["map_with_shared_arrays"] + 1
+
+
+@pytest.mark.parametrize("value,enabled", [("1", True), ("true", True), ("0", False)])
+def test_profile_environment_variable(tmp_path, monkeypatch, value, enabled):
+    monkeypatch.setenv("SYSLEVEL_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("SYSLEVEL_PROFILE", value)
+    with profile_run("test"):
+        pass
+    assert (len(os.listdir(tmp_path)) == 1) == enabled
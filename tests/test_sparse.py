@@ -0,0 +1,47 @@
+import numpy as np
+
+from syslevel.ranking_stability.run import get_prefix_means, sample_self_correlation
+from syslevel.sparse import SparseScores
+
+
+def _random_matrix(rng, N: int, M: int) -> np.ndarray:
+    X = rng.normal(size=(N, M))
+    X[rng.random((N, M)) < rng.random()] = np.nan
+    return X
+
+
+def test_get_prefix_means_matches_dense():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        X = _random_matrix(rng, int(rng.integers(1, 8)), int(rng.integers(2, 40)))
+        M = X.shape[1]
+        L = int(rng.integers(1, M + 1))
+        permutations = rng.random((int(rng.integers(1, 5)), M)).argsort(axis=1)
+        permutations = permutations[:, :L]
+        # The sizes do not have to be sorted or unique
+        num_inputs_list = list(rng.integers(1, L + 1, int(rng.integers(1, L + 1))))
+
+        is_scored = ~np.isnan(X)
+        scores = np.where(is_scored, X, 0.0)
+        expected = get_prefix_means(scores, is_scored, permutations, num_inputs_list)
+        actual = SparseScores.from_dense(X).get_prefix_means(
+            permutations, num_inputs_list
+        )
+        np.testing.assert_allclose(actual, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_sparse_nested_sampling_matches_dense():
+    rng = np.random.default_rng(1)
+    X = _random_matrix(rng, 10, 300)
+    for sampling in ["independent", "disjoint"]:
+        expected = sample_self_correlation(
+            X, [10, 50, 100, 150], 50, np.random.default_rng(2), sampling=sampling
+        )
+        actual = sample_self_correlation(
+            SparseScores.from_dense(X),
+            [10, 50, 100, 150],
+            50,
+            np.random.default_rng(2),
+            sampling=sampling,
+        )
+        np.testing.assert_allclose(actual, expected, atol=1e-12)